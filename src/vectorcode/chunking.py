@@ -1,6 +1,21 @@
 from abc import abstractmethod
-from io import TextIOWrapper
-from typing import Generator
+from dataclasses import dataclass
+from typing import Any, Generator, Iterator, TextIO
+
+
+@dataclass
+class Chunk:
+    """
+    A piece of a document and where it was taken from.
+    Lines are 1-based and inclusive; byte offsets are 0-based and the end is
+    exclusive, both measured on the utf-8 encoded document.
+    """
+
+    text: str
+    start_line: int
+    end_line: int
+    start_byte: int
+    end_byte: int
 
 
 class ChunkerBase:
@@ -35,27 +50,263 @@ class StringChunker(ChunkerBase):
 
 
 class FileChunker(ChunkerBase):
-    def __init__(self, chunk_size: int = -1, overlap_ratio: float = 0.2) -> None:
+    def __init__(
+        self,
+        chunk_size: int = -1,
+        overlap_ratio: float = 0.2,
+        buffer_size: int = 1 << 16,
+    ) -> None:
         super().__init__()
         self.__chunk_size = chunk_size
         assert 0 <= overlap_ratio < 1, (
             "Overlap ratio has to be a float between 0 (inclusive) and 1 (exclusive)."
         )
         self.__overlap_ratio = overlap_ratio
+        self.__buffer_size = max(buffer_size, chunk_size)
+
+    @property
+    def step_size(self) -> int:
+        """Number of characters between the starts of consecutive chunks."""
+        return max(1, int(self.__chunk_size * (1 - self.__overlap_ratio)))
+
+    def chunk(self, data: TextIO) -> Generator[str, None, None]:
+        """
+        The output of this method is identical to that of `StringChunker.chunk`.
 
-    def chunk(self, data: TextIOWrapper) -> Generator[str, None, None]:
+        Instead of rebuilding the window for every chunk, the file is read in
+        blocks of `buffer_size` characters and the chunks are sliced out of the
+        buffer. The buffer is only compacted when the next window would run past
+        its end, so each character is copied a constant number of times
+        regardless of the overlap ratio.
+        """
         if self.__chunk_size < 0:
-            yield "".join(data.readlines())
-        else:
-            step_size = max(1, int(self.__chunk_size * (1 - self.__overlap_ratio)))
-            # the output of this method should be identical to that of StringChunker.chunk
-            output = data.read(self.__chunk_size)
-            yield output
-            if len(output) < self.__chunk_size:
+            yield data.read()
+            return
+        chunk_size = self.__chunk_size
+        step_size = self.step_size
+        buffer = data.read(self.__buffer_size)
+        eof = len(buffer) < self.__buffer_size
+        start = 0
+        while not eof:
+            # a window that ends before the end of the buffer can't be the last one.
+            stop = len(buffer) - chunk_size
+            while start < stop:
+                yield buffer[start : start + chunk_size]
+                start += step_size
+            new_chars = data.read(self.__buffer_size)
+            eof = len(new_chars) < self.__buffer_size
+            buffer = buffer[start:] + new_chars
+            start = 0
+        while start < len(buffer):
+            yield buffer[start : start + chunk_size]
+            if start + chunk_size >= len(buffer):
                 return
-            while True:
-                new_chars = data.read(step_size)
-                output = output[step_size:] + new_chars
-                yield output
-                if len(new_chars) < step_size:
+            start += step_size
+
+
+class LineChunker(ChunkerBase):
+    """
+    Chunk a document along line boundaries so that each chunk can be mapped back
+    to a region of the file.
+
+    A chunk holds as many whole lines as fit into `chunk_size` characters. When
+    there's a choice, the chunk is cut after a blank line or before a line that
+    is indented no deeper than the first line of the chunk, so that functions and
+    paragraphs are more likely to stay in one piece. Lines that are longer than
+    `chunk_size` are split the same way as `StringChunker` does.
+    """
+
+    def __init__(self, chunk_size: int = -1, overlap_ratio: float = 0.2) -> None:
+        super().__init__()
+        self.__chunk_size = chunk_size
+        assert 0 <= overlap_ratio < 1, (
+            "Overlap ratio has to be a float between 0 (inclusive) and 1 (exclusive)."
+        )
+        self.__overlap_ratio = overlap_ratio
+
+    def _length(self, text: str) -> int:
+        return len(text)
+
+    def _split_line(self, line: str) -> Iterator[tuple[int, str]]:
+        """Split a line that is too long into (offset, text) windows."""
+        step_size = max(1, int(self.__chunk_size * (1 - self.__overlap_ratio)))
+        for offset, piece in zip(
+            range(0, len(line), step_size),
+            StringChunker(self.__chunk_size, self.__overlap_ratio).chunk(line),
+        ):
+            yield offset, piece
+
+    @staticmethod
+    def _boundary_score(prev_line: str, next_line: str, indent: int) -> int:
+        """How good it is to cut between `prev_line` and `next_line`."""
+        if prev_line.strip() == "":
+            return 2
+        stripped = next_line.lstrip()
+        if stripped and len(next_line) - len(stripped) <= indent:
+            return 1
+        return 0
+
+    def chunk(self, data: TextIO) -> Generator[Chunk, None, None]:
+        if self.__chunk_size < 0:
+            text = data.read()
+            if text:
+                yield Chunk(
+                    text=text,
+                    start_line=1,
+                    end_line=text.count("\n") + (not text.endswith("\n")),
+                    start_byte=0,
+                    end_byte=len(text.encode()),
+                )
+            return
+
+        lines: list[str] = []
+        lengths: list[int] = []
+        start_bytes: list[int] = []
+        # line number of `lines[0]`
+        first_line = 1
+        next_byte = 0
+        line_iter = iter(data)
+
+        def load(count: int) -> bool:
+            """Make sure that at least `count` lines are buffered."""
+            nonlocal next_byte
+            while len(lines) < count:
+                line = next(line_iter, None)
+                if line is None:
+                    return False
+                lines.append(line)
+                lengths.append(self._length(line))
+                start_bytes.append(next_byte)
+                next_byte += len(line.encode())
+            return True
+
+        start = 0
+        while load(start + 1):
+            if lengths[start] > self.__chunk_size:
+                line_no = first_line + start
+                line = lines[start]
+                for offset, piece in self._split_line(line):
+                    start_byte = start_bytes[start] + len(line[:offset].encode())
+                    yield Chunk(
+                        text=piece,
+                        start_line=line_no,
+                        end_line=line_no,
+                        start_byte=start_byte,
+                        end_byte=start_byte + len(piece.encode()),
+                    )
+                start += 1
+            else:
+                # find the longest run of lines that fits into a chunk.
+                end = start + 1
+                size = lengths[start]
+                while load(end + 1) and size + lengths[end] <= self.__chunk_size:
+                    size += lengths[end]
+                    end += 1
+
+                if load(end + 1):
+                    # not the end of the document. snap to the best boundary in
+                    # the second half of the chunk.
+                    first = lines[start]
+                    indent = len(first) - len(first.lstrip())
+                    best_end, best_score = end, -1
+                    size_so_far = size
+                    for candidate in range(end, start, -1):
+                        if size_so_far * 2 < size:
+                            break
+                        score = self._boundary_score(
+                            lines[candidate - 1], lines[candidate], indent
+                        )
+                        if score > best_score:
+                            best_end, best_score = candidate, score
+                        size_so_far -= lengths[candidate - 1]
+                    end = best_end
+
+                yield Chunk(
+                    text="".join(lines[start:end]),
+                    start_line=first_line + start,
+                    end_line=first_line + end - 1,
+                    start_byte=start_bytes[start],
+                    end_byte=start_bytes[end - 1] + len(lines[end - 1].encode()),
+                )
+                if not load(end + 1):
                     return
+
+                # step back to share roughly `overlap_ratio` of the chunk.
+                overlap = self.__chunk_size * self.__overlap_ratio
+                next_start = end
+                while next_start - 1 > start and overlap - lengths[next_start - 1] >= 0:
+                    overlap -= lengths[next_start - 1]
+                    next_start -= 1
+                start = next_start
+
+            if start > 1024:
+                # drop the lines that have been fully consumed.
+                del lines[:start], lengths[:start], start_bytes[:start]
+                first_line += start
+                start = 0
+
+
+def count_tokens(tokenizer: Any, text: str) -> int:
+    """Number of tokens in `text`, excluding the special tokens."""
+    return len(tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+
+def count_truncated_chars(tokenizer: Any, text: str, max_tokens: int) -> int:
+    """
+    Number of characters at the end of `text` that won't be seen by a model that
+    only embeds the first `max_tokens` tokens.
+    """
+    try:
+        encoding = tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False,
+        )
+    except NotImplementedError:
+        # slow tokenizers don't provide the offsets. estimate from the token count.
+        num_tokens = count_tokens(tokenizer, text)
+        if num_tokens <= max_tokens:
+            return 0
+        return int(len(text) * (1 - max_tokens / num_tokens))
+    if len(encoding["input_ids"]) <= max_tokens:
+        return 0
+    return len(text) - encoding["offset_mapping"][max_tokens][0]
+
+
+class TokenChunker(LineChunker):
+    """
+    A `LineChunker` that measures `chunk_size` in tokens of the embedding model,
+    so that the chunks are not truncated by the model.
+
+    The size of a chunk is the sum of the token counts of its lines, which may
+    be off by a few tokens for tokenizers that merge across line breaks.
+    """
+
+    def __init__(
+        self, tokenizer: Any, chunk_size: int, overlap_ratio: float = 0.2
+    ) -> None:
+        assert chunk_size > 0, "The maximum number of tokens has to be positive."
+        super().__init__(chunk_size, overlap_ratio)
+        self.__tokenizer = tokenizer
+        self.__chunk_size = chunk_size
+        self.__overlap_ratio = overlap_ratio
+
+    def _length(self, text: str) -> int:
+        return count_tokens(self.__tokenizer, text)
+
+    def _split_line(self, line: str) -> Iterator[tuple[int, str]]:
+        start = 0
+        while start < len(line):
+            # binary search for the longest piece that fits.
+            low, high = start + 1, len(line)
+            while low < high:
+                mid = (low + high + 1) // 2
+                if self._length(line[start:mid]) <= self.__chunk_size:
+                    low = mid
+                else:
+                    high = mid - 1
+            yield start, line[start:low]
+            if low == len(line):
+                return
+            start += max(1, int((low - start) * (1 - self.__overlap_ratio)))
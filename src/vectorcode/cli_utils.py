@@ -1,7 +1,9 @@
 import argparse
 import glob
+import hashlib
 import json
 import os
+import socket
 from dataclasses import dataclass, field, fields
 from enum import Enum, StrEnum
 from pathlib import Path
@@ -17,22 +19,45 @@ GLOBAL_CONFIG_PATH = os.path.join(
     os.path.expanduser("~"), ".config", "vectorcode", "config.json"
 )
 
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "vectorcode",
+)
+
 CHECK_OPTIONS = ["config"]
 
+# value of `update --since` without a REV. It is not a valid git revision, so
+# it can't be confused with one.
+LAST_INDEXED_COMMIT = "@{indexed}"
+
 
 class QueryInclude(StrEnum):
     path = "path"
     document = "document"
+    chunk = "chunk"
 
     def to_header(self) -> str:
         """
         Make the string into a nice-looking format for printing in the terminal.
         """
-        if self.value == "document":
+        if self.value in ("document", "chunk"):
             return f"{self.value.capitalize()}:\n"
         return f"{self.value.capitalize()}: "
 
 
+class ChunkMode(StrEnum):
+    char = "char"
+    line = "line"
+    token = "token"
+
+
+class QueryMode(StrEnum):
+    auto = "auto"
+    vector = "vector"
+    lexical = "lexical"
+    hybrid = "hybrid"
+
+
 class CliAction(Enum):
     vectorise = "vectorise"
     query = "query"
@@ -43,6 +68,7 @@ class CliAction(Enum):
     check = "check"
     update = "update"
     clean = "clean"
+    watch = "watch"
 
 
 @dataclass
@@ -53,10 +79,19 @@ class Config:
     pipe: bool = False
     action: Optional[CliAction] = None
     files: list[PathLike] = field(default_factory=list)
+    files_from: Optional[str] = None
+    prioritise: list[str] = field(default_factory=list)
     project_root: Optional[PathLike] = None
+    # all projects to be queried, when there are more than one.
+    project_roots: list[PathLike] = field(default_factory=list)
+    query_all: bool = False
     query: Optional[list[str]] = None
+    batch: Optional[str] = None
     host: str = "127.0.0.1"
     port: int = 8000
+    # whether the database is served by a chromadb that this command started,
+    # which stops when the command exits.
+    temporary_server: bool = False
     embedding_function: str = "SentenceTransformerEmbeddingFunction"  # This should fallback to whatever the default is.
     embedding_params: dict[str, Any] = field(default_factory=(lambda: {}))
     n_result: int = 1
@@ -65,7 +100,22 @@ class Config:
     db_settings: Optional[dict] = None
     chunk_size: int = -1
     overlap_ratio: float = 0.2
+    chunk_mode: ChunkMode = ChunkMode.char
+    truncation_report: bool = False
+    resume: bool = False
+    since: Optional[str] = None
+    debounce: float = 0.5
+    max_file_size: int = 1024 * 1024
+    embedding_cache_size: int = 512 * 1024 * 1024
+    max_pending_chunks: int = 4096
+    workers: int = 1
+    max_pending_bytes: int = 64 * 1024 * 1024
     query_multiplier: int = -1
+    query_mode: QueryMode = QueryMode.auto
+    refresh_budget: int = 4
+    query_cache_size: int = 256
+    max_bytes: int = -1
+    max_tokens: int = -1
     query_exclude: list[PathLike] = field(default_factory=list)
     reranker: Optional[str] = None
     reranker_params: dict[str, Any] = field(default_factory=dict)
@@ -100,7 +150,21 @@ class Config:
                 "db_path": db_path,
                 "chunk_size": config_dict.get("chunk_size", -1),
                 "overlap_ratio": config_dict.get("overlap_ratio", 0.2),
+                "chunk_mode": ChunkMode(config_dict.get("chunk_mode", "char")),
+                "max_file_size": config_dict.get("max_file_size", 1024 * 1024),
+                "embedding_cache_size": config_dict.get(
+                    "embedding_cache_size", 512 * 1024 * 1024
+                ),
+                "max_pending_chunks": config_dict.get("max_pending_chunks", 4096),
+                "max_pending_bytes": config_dict.get(
+                    "max_pending_bytes", 64 * 1024 * 1024
+                ),
+                "workers": config_dict.get("workers", 1),
+                "debounce": config_dict.get("debounce", 0.5),
                 "query_multiplier": config_dict.get("query_multiplier", -1),
+                "query_mode": QueryMode(config_dict.get("query_mode", "auto")),
+                "refresh_budget": config_dict.get("refresh_budget", 4),
+                "query_cache_size": config_dict.get("query_cache_size", 256),
                 "reranker": config_dict.get("reranker", None),
                 "reranker_params": config_dict.get("reranker_params", {}),
                 "db_settings": config_dict.get("db_settings", None),
@@ -108,15 +172,23 @@ class Config:
         )
 
     async def merge_from(self, other: "Config") -> "Config":
-        """Return the merged config."""
+        """
+        Return the merged config. The values of `other` that are unset (None,
+        empty or the defaults) are taken from `self`. Numbers are kept even if
+        they're 0, so that an explicit `--refresh_budget 0` isn't overridden.
+        """
         final_config = {}
         default_config = Config()
         for merged_field in fields(self):
-            final_config[merged_field.name] = getattr(other, merged_field.name)
-            if not final_config[merged_field.name] or final_config[
-                merged_field.name
-            ] == getattr(default_config, merged_field.name):
-                final_config[merged_field.name] = getattr(self, merged_field.name)
+            value = getattr(other, merged_field.name)
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if (
+                value is None
+                or (not value and not is_number)
+                or value == getattr(default_config, merged_field.name)
+            ):
+                value = getattr(self, merged_field.name)
+            final_config[merged_field.name] = value
         return Config(**final_config)
 
 
@@ -133,10 +205,17 @@ def get_cli_parser():
         default=-1,
         help="Size of chunks (-1 for no chunking).",
     )
+    chunkinng_parser.add_argument(
+        "--chunk_mode",
+        choices=list(i.value for i in ChunkMode),
+        default=None,
+        help="How to cut the chunks. `line` only cuts at line breaks and records the line ranges of the chunks. `token` does the same but measures the chunk size in tokens of the embedding model.",
+    )
     shared_parser.add_argument(
         "--project_root",
+        action="append",
         default=None,
-        help="Project root to be used as an identifier of the project.",
+        help="Project root to be used as an identifier of the project. `query` accepts more than one.",
     ).complete = shtab.DIRECTORY
     shared_parser.add_argument(
         "--pipe",
@@ -175,7 +254,20 @@ def get_cli_parser():
         help="Vectorise and send documents to chromadb.",
     )
     vectorise_parser.add_argument(
-        "file_paths", nargs="+", help="Paths to files to be vectorised."
+        "file_paths", nargs="*", help="Paths to files to be vectorised."
+    ).complete = shtab.FILE
+    vectorise_parser.add_argument(
+        "--files_from",
+        metavar="FILE",
+        default=None,
+        help="Read the paths to be vectorised from FILE (`-` for STDIN), separated by NUL or newlines.",
+    ).complete = shtab.FILE
+    vectorise_parser.add_argument(
+        "--prioritise",
+        metavar="PATH",
+        action="append",
+        default=[],
+        help="A file to be vectorised before the others, like a file that is open in the editor. Can be repeated.",
     ).complete = shtab.FILE
     vectorise_parser.add_argument(
         "--recursive",
@@ -189,7 +281,31 @@ def get_cli_parser():
         "-f",
         action="store_true",
         default=False,
-        help="Force to vectorise the file(s) against the gitignore.",
+        help="Force to vectorise the file(s) against the gitignore and the binary/generated file filters.",
+    )
+    vectorise_parser.add_argument(
+        "--max_file_size",
+        type=int,
+        default=None,
+        help="Skip files that are larger than this number of bytes (-1 for no limit).",
+    )
+    vectorise_parser.add_argument(
+        "--truncation_report",
+        action="store_true",
+        default=False,
+        help="Report the number of characters per file that are truncated by the embedding model.",
+    )
+    vectorise_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes that compute the embeddings, each with its own copy of the embedding model.",
+    )
+    vectorise_parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue an interrupted run. Without file paths, the paths of the interrupted run are used.",
     )
 
     query_parser = subparsers.add_parser(
@@ -197,10 +313,21 @@ def get_cli_parser():
         parents=[shared_parser, chunkinng_parser],
         help="Send query to retrieve documents.",
     )
-    query_parser.add_argument("query", nargs="+", help="Query keywords.")
+    query_parser.add_argument("query", nargs="*", help="Query keywords.")
+    query_parser.add_argument(
+        "--batch",
+        default=None,
+        help="Run the queries in a JSONL file (`-` for stdin) and print the results as JSONL.",
+    ).complete = shtab.FILE
     query_parser.add_argument(
         "--multiplier", "-m", type=int, default=-1, help="Query multiplier."
     )
+    query_parser.add_argument(
+        "--all",
+        action="store_true",
+        default=False,
+        help="Query all projects in the database, and merge the results.",
+    )
     query_parser.add_argument(
         "-n", "--number", type=int, default=1, help="Number of results to retrieve."
     )
@@ -213,6 +340,30 @@ def get_cli_parser():
         action="store_true",
         help="Use absolute path when returning the retrieval results.",
     )
+    query_parser.add_argument(
+        "--query_mode",
+        choices=list(i.value for i in QueryMode),
+        default=None,
+        help="How to search. `lexical` looks up the identifiers and file names in the query, `vector` runs a vector search, `hybrid` fuses both, and `auto` uses `lexical` for queries that look like identifiers or file names.",
+    )
+    query_parser.add_argument(
+        "--refresh_budget",
+        type=int,
+        default=None,
+        help="Number of stale files in the results that are re-embedded before returning. The rest are updated in the background. Negative values turn off the freshness check.",
+    )
+    query_parser.add_argument(
+        "--max_bytes",
+        type=int,
+        default=-1,
+        help="Maximum number of bytes of the documents and chunks in the output.",
+    )
+    query_parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=-1,
+        help="Maximum number of tokens (estimated at 4 bytes per token) of the documents and chunks in the output.",
+    )
     query_parser.add_argument(
         "--include",
         choices=list(i.value for i in QueryInclude),
@@ -250,11 +401,42 @@ def get_cli_parser():
         help=f"Item to be checked. Possible options: [{', '.join(CHECK_OPTIONS)}]",
     )
 
-    subparsers.add_parser(
+    update_parser = subparsers.add_parser(
         "update",
         parents=[shared_parser],
         help="Update embeddings in the database for indexed files.",
     )
+    update_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes that compute the embeddings, each with its own copy of the embedding model.",
+    )
+    update_parser.add_argument(
+        "--since",
+        nargs="?",
+        const=LAST_INDEXED_COMMIT,
+        default=None,
+        metavar="REV",
+        help="Only update the files that git reports as changed since REV. Without REV, the last indexed commit is used.",
+    )
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        parents=[shared_parser, chunkinng_parser],
+        help="Keep the embeddings up to date as files change.",
+    )
+    watch_parser.add_argument(
+        "file_paths",
+        nargs="*",
+        help="Directories to watch. Defaults to the project root.",
+    ).complete = shtab.DIRECTORY
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=None,
+        help="Seconds to wait for the files to settle before updating the embeddings.",
+    )
 
     subparsers.add_parser(
         "clean",
@@ -271,13 +453,31 @@ async def parse_cli_args(args: Optional[Sequence[str]] = None):
         main_args = main_parser.parse_args(["--help"])
 
     files = []
+    files_from = None
+    prioritise = []
+    project_roots = main_args.project_root or []
+    if len(project_roots) > 1 and main_args.action != "query":
+        main_parser.error("Only `query` accepts more than one --project_root.")
     query = None
+    batch = None
+    query_all = False
     recursive = False
     number_of_result = 1
     force = False
     chunk_size = -1
     overlap_ratio = 0.2
+    chunk_mode = "char"
+    truncation_report = False
+    resume = False
+    since = None
+    workers = 1
+    debounce = 0.5
+    max_file_size = 1024 * 1024
     query_multiplier = -1
+    query_mode = "auto"
+    refresh_budget = 4
+    max_bytes = -1
+    max_tokens = -1
     query_exclude = []
     query_include = ["path", "document"]
     check_item = None
@@ -285,34 +485,80 @@ async def parse_cli_args(args: Optional[Sequence[str]] = None):
     match main_args.action:
         case "vectorise":
             files = main_args.file_paths
+            files_from = main_args.files_from
+            prioritise = main_args.prioritise
             recursive = main_args.recursive
             force = main_args.force
             chunk_size = main_args.chunk_size
             overlap_ratio = main_args.overlap
+            chunk_mode = main_args.chunk_mode or chunk_mode
+            truncation_report = main_args.truncation_report
+            resume = main_args.resume
+            workers = main_args.workers or workers
+            if main_args.max_file_size is not None:
+                max_file_size = main_args.max_file_size
         case "query":
             query = main_args.query
+            batch = main_args.batch
+            if not query and batch is None:
+                main_parser.error("Either query keywords or --batch is required.")
+            query_all = main_args.all
+            if batch is not None and (query_all or len(project_roots) > 1):
+                main_parser.error("--batch only queries one project.")
             number_of_result = main_args.number
             query_multiplier = main_args.multiplier
+            query_mode = main_args.query_mode or query_mode
             query_exclude = main_args.exclude
             absolute = main_args.absolute
             query_include = main_args.include
+            if main_args.refresh_budget is not None:
+                refresh_budget = main_args.refresh_budget
+            max_bytes = main_args.max_bytes
+            max_tokens = main_args.max_tokens
         case "check":
             check_item = main_args.check_item
         case "init":
             force = main_args.force
+        case "update":
+            since = main_args.since
+            workers = main_args.workers or workers
+        case "watch":
+            files = main_args.file_paths
+            recursive = True
+            chunk_size = main_args.chunk_size
+            overlap_ratio = main_args.overlap
+            chunk_mode = main_args.chunk_mode or chunk_mode
+            if main_args.debounce is not None:
+                debounce = main_args.debounce
     return Config(
         no_stderr=main_args.no_stderr,
         action=CliAction(main_args.action),
         files=files,
-        project_root=main_args.project_root,
+        files_from=files_from,
+        prioritise=prioritise,
+        project_root=project_roots[0] if project_roots else None,
+        project_roots=project_roots if len(project_roots) > 1 else [],
+        query_all=query_all,
         query=query,
+        batch=batch,
         recursive=recursive,
         n_result=number_of_result,
         pipe=main_args.pipe,
         force=force,
         chunk_size=chunk_size,
         overlap_ratio=overlap_ratio,
+        chunk_mode=ChunkMode(chunk_mode),
+        truncation_report=truncation_report,
+        resume=resume,
+        since=since,
+        workers=workers,
+        debounce=debounce,
+        max_file_size=max_file_size,
         query_multiplier=query_multiplier,
+        query_mode=QueryMode(query_mode),
+        refresh_budget=refresh_budget,
+        max_bytes=max_bytes,
+        max_tokens=max_tokens,
         query_exclude=query_exclude,
         check_item=check_item,
         use_absolute_path=absolute,
@@ -345,6 +591,18 @@ async def load_config_file(path: Optional[PathLike] = None):
     return Config()
 
 
+async def load_project_config(project_root: Optional[PathLike]) -> Config:
+    """
+    Load the project-local config file of the project, or the global config
+    file if the project doesn't have one.
+    """
+    if project_root is not None:
+        project_config_file = os.path.join(project_root, ".vectorcode", "config.json")
+        if os.path.isfile(project_config_file):
+            return await load_config_file(project_config_file)
+    return await load_config_file()
+
+
 async def find_project_config_dir(start_from: PathLike = "."):
     """Returns the project-local config directory."""
     current_dir = Path(start_from).resolve()
@@ -367,6 +625,16 @@ def expand_path(path: PathLike, absolute: bool = False) -> PathLike:
     return expanded
 
 
+def get_collection_name(full_path: str) -> str:
+    full_path = str(expand_path(full_path, absolute=True))
+    hasher = hashlib.sha256()
+    hasher.update(
+        f"{os.environ.get('USER', os.environ.get('USERNAME', 'DEFAULT_USER'))}@{socket.gethostname()}:{full_path}".encode()
+    )
+    collection_id = hasher.hexdigest()[:63]
+    return collection_id
+
+
 async def expand_globs(
     paths: list[PathLike], recursive: bool = False
 ) -> list[PathLike]:
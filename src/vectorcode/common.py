@@ -1,10 +1,11 @@
 import asyncio
 import hashlib
+import json
 import os
 import socket
 import subprocess
 import sys
-from typing import Any, AsyncGenerator, Coroutine
+from typing import Any, AsyncGenerator, Coroutine, Optional
 
 import chromadb
 import httpx
@@ -13,7 +14,11 @@ from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 
-from vectorcode.cli_utils import Config, expand_path
+from vectorcode.cli_utils import CACHE_DIR, Config, expand_path, get_collection_name
+from vectorcode.embedding_cache import EmbeddingCache
+from vectorcode.embedding_pool import EmbeddingPool
+from vectorcode.git import get_changes
+from vectorcode.manifest import Manifest
 
 
 async def get_collections(
@@ -79,6 +84,7 @@ async def start_server(configs: Config):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind(("", 0))  # OS selects a free ephemeral port
         configs.port = int(s.getsockname()[1])
+    configs.temporary_server = True
     env.update({"ANONYMIZED_TELEMETRY": "False"})
     process = await asyncio.create_subprocess_exec(
         sys.executable,
@@ -119,16 +125,6 @@ def get_client(configs: Config) -> Coroutine[Any, Any, AsyncClientAPI]:
     )
 
 
-def get_collection_name(full_path: str) -> str:
-    full_path = str(expand_path(full_path, absolute=True))
-    hasher = hashlib.sha256()
-    hasher.update(
-        f"{os.environ.get('USER', os.environ.get('USERNAME', 'DEFAULT_USER'))}@{socket.gethostname()}:{full_path}".encode()
-    )
-    collection_id = hasher.hexdigest()[:63]
-    return collection_id
-
-
 def get_embedding_function(configs: Config) -> chromadb.EmbeddingFunction:
     try:
         return getattr(embedding_functions, configs.embedding_function)(
@@ -142,16 +138,56 @@ def get_embedding_function(configs: Config) -> chromadb.EmbeddingFunction:
         return embedding_functions.SentenceTransformerEmbeddingFunction()
 
 
+def get_bulk_embedding_function(configs: Config) -> chromadb.EmbeddingFunction:
+    """
+    The embedding function for vectorising files. With `workers` > 1, this is
+    an `EmbeddingPool` that should be closed when it's no longer needed.
+    """
+    if configs.workers > 1:
+        if configs.workers > (os.cpu_count() or 1):
+            print(
+                f"Using {configs.workers} embedding workers on {os.cpu_count()} CPU core(s). This is likely to be slower than fewer workers.",
+                file=sys.stderr,
+            )
+        return EmbeddingPool(configs, configs.workers)
+    return get_embedding_function(configs)
+
+
+def get_embedding_tokenizer(
+    embedding_function: chromadb.EmbeddingFunction,
+) -> Optional[tuple[Any, int]]:
+    """
+    Return the tokenizer of the model behind the embedding function and the
+    maximum number of (non-special) tokens that the model embeds without
+    truncation. Return None if the embedding function doesn't expose them.
+    """
+    model = getattr(embedding_function, "_model", None)
+    tokenizer = getattr(model, "tokenizer", None)
+    max_seq_length = getattr(model, "max_seq_length", None)
+    if tokenizer is None or not isinstance(max_seq_length, int):
+        return None
+    num_special_tokens = 0
+    if hasattr(tokenizer, "num_special_tokens_to_add"):
+        num_special_tokens = tokenizer.num_special_tokens_to_add()
+    return tokenizer, max_seq_length - num_special_tokens
+
+
 async def get_collection(
-    client: AsyncClientAPI, configs: Config, make_if_missing: bool = False
+    client: AsyncClientAPI,
+    configs: Config,
+    make_if_missing: bool = False,
+    embedding_function: Optional[chromadb.EmbeddingFunction] = None,
 ):
     """
     Raise ValueError when make_if_missing is False and no collection is found;
     Raise IndexError on hash collision.
+
+    `embedding_function` is created from the configs if not given.
     """
     full_path = str(expand_path(str(configs.project_root), absolute=True))
     collection_name = get_collection_name(full_path)
-    embedding_function = get_embedding_function(configs)
+    if embedding_function is None:
+        embedding_function = get_embedding_function(configs)
     collection_meta = {
         "path": full_path,
         "hostname": socket.gethostname(),
@@ -179,6 +215,32 @@ async def get_collection(
     return collection
 
 
+async def update_collection_metadata(collection: AsyncCollection, **metadata):
+    """Add or overwrite keys in the metadata of the collection."""
+    new_metadata = dict(collection.metadata or {})
+    new_metadata.update(metadata)
+    # chromadb refuses to modify the distance function, even to the same value.
+    new_metadata.pop("hnsw:space", None)
+    await collection.modify(metadata=new_metadata)
+
+
+async def record_git_commit(
+    collection: AsyncCollection, manifest: Manifest, project_root: str, commit: str
+):
+    """
+    Store the commit that the collection has been indexed at in the metadata
+    of the collection. The files that differed from the commit (uncommitted
+    changes) are stored in the manifest, because `git diff` won't report them
+    if they're reverted later.
+    """
+    changes = await get_changes(project_root, commit)
+    dirty = None
+    if changes is not None:
+        dirty = sorted(changes.changed | changes.deleted)
+    manifest.set_value("git_dirty", dirty)
+    await update_collection_metadata(collection, git_commit=commit)
+
+
 def verify_ef(collection: AsyncCollection, configs: Config):
     collection_ef = collection.metadata.get("embedding_function")
     collection_ep = collection.metadata.get("embedding_params")
@@ -195,3 +257,60 @@ def verify_ef(collection: AsyncCollection, configs: Config):
         )
         print("The result may be inaccurate.", file=sys.stderr)
     return True
+
+
+def get_cache_dir(collection_name: str) -> str:
+    """Directory for the local files that belong to a collection."""
+    cache_dir = os.path.join(CACHE_DIR, collection_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_manifest(
+    collection: AsyncCollection, configs: Config, reset: bool = True
+) -> Manifest:
+    """
+    Open the manifest of the collection. The fingerprints are discarded if the
+    collection has been re-created or the configs that affect the embeddings
+    have changed, unless `reset` is False (see `Manifest`).
+    """
+    return Manifest(
+        os.path.join(get_cache_dir(collection.name), "manifest.db"),
+        str(collection.id),
+        {
+            "embedding_function": configs.embedding_function,
+            "embedding_params": configs.embedding_params,
+            "chunk_size": configs.chunk_size,
+            "overlap_ratio": configs.overlap_ratio,
+            "chunk_mode": str(configs.chunk_mode),
+        },
+        reset,
+    )
+
+
+def remove_manifest(collection_name: str):
+    """
+    Remove the manifest of a deleted collection, so that its lexical index
+    doesn't answer queries anymore.
+    """
+    try:
+        os.remove(os.path.join(CACHE_DIR, collection_name, "manifest.db"))
+    except FileNotFoundError:
+        pass
+
+
+def get_embedding_cache(configs: Config) -> Optional[EmbeddingCache]:
+    """
+    Open the local embedding cache of the configured embedding function, or
+    return None if the cache is disabled (`embedding_cache_size` <= 0).
+    """
+    if configs.embedding_cache_size <= 0:
+        return None
+    key = hashlib.sha256(
+        json.dumps(
+            [configs.embedding_function, configs.embedding_params], sort_keys=True
+        ).encode()
+    ).hexdigest()
+    return EmbeddingCache(
+        os.path.join(CACHE_DIR, "embeddings", key), configs.embedding_cache_size
+    )
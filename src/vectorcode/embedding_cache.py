@@ -0,0 +1,278 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy
+
+# rows are added to the vector file in steps of at least this many entries.
+GROWTH_STEP = 1024
+
+# number of parameters in one sqlite query.
+QUERY_BATCH_SIZE = 500
+
+# seconds to wait for the other processes that use the cache.
+LOCK_TIMEOUT = 60
+
+
+class EmbeddingCache:
+    """
+    A local, size-capped cache of embeddings, keyed by the content hash of the
+    chunks. A cache only holds the embeddings of one embedding function (with
+    one set of parameters), so callers should use a different directory for
+    each of them.
+
+    The embeddings are stored as float16 rows of a memory-mapped file, and a
+    sqlite database maps the hashes to the rows. When the cache is full, the
+    least recently used rows are overwritten.
+
+    The cache may be used by several processes at once (`watch`, `update` and
+    `query` of different projects). Every read and write runs in an exclusive
+    sqlite transaction, which also covers the vector file, so a slot is never
+    handed out twice or read while it's being overwritten. The vector file
+    can't be rolled back, so only the rows that no committed entry refers to
+    are written: the evicted entries are removed (and their rows recorded as
+    free) in a transaction of their own, before their rows are reused.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """`max_size` is the maximum size of the vector file in bytes."""
+        os.makedirs(directory, exist_ok=True)
+        self.__vectors_path = os.path.join(directory, "vectors.f16")
+        self.__max_size = max_size
+        # the connection is only used by one thread at a time, but not
+        # necessarily the one that created it.
+        self.__conn = sqlite3.connect(
+            os.path.join(directory, "index.db"),
+            check_same_thread=False,
+            timeout=LOCK_TIMEOUT,
+            # the transactions are managed by `__lock`.
+            isolation_level=None,
+        )
+        self.__conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS entries (
+                hash TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            -- rows below the highest used one that no entry refers to.
+            CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY);
+            """
+        )
+        self.__dim: Optional[int] = None
+        self.__vectors: Optional[numpy.memmap] = None
+
+    @property
+    def capacity(self) -> int:
+        """Maximum number of embeddings in the cache."""
+        if self.__dim is None:
+            return 0
+        return self.__max_size // (self.__dim * 2)
+
+    def __len__(self) -> int:
+        return self.__conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @contextmanager
+    def __lock(self) -> Iterator[None]:
+        """
+        Hold an exclusive lock of the cache (across processes), with the
+        vector file in sync with the changes of the other processes.
+        """
+        self.__conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.__sync()
+            yield
+        except BaseException:
+            self.__conn.execute("ROLLBACK")
+            raise
+        else:
+            self.__commit()
+
+    def __sync(self):
+        """Catch up with the changes of the other processes."""
+        if self.__dim is None:
+            row = self.__conn.execute(
+                "SELECT value FROM meta WHERE key = 'dim'"
+            ).fetchone()
+            self.__dim = None if row is None else int(row[0])
+        if self.__dim is not None and os.path.isfile(self.__vectors_path):
+            num_rows = os.path.getsize(self.__vectors_path) // (self.__dim * 2)
+            if self.__vectors is None or self.__vectors.shape[0] != num_rows:
+                # the file was grown by another process.
+                self.__open_vectors()
+
+    def __commit(self):
+        if self.__vectors is not None:
+            self.__vectors.flush()
+        self.__conn.execute("COMMIT")
+
+    def __checkpoint(self):
+        """Commit the changes so far, and start another exclusive transaction."""
+        self.__commit()
+        self.__conn.execute("BEGIN IMMEDIATE")
+        self.__sync()
+
+    def __open_vectors(self):
+        assert self.__dim is not None
+        num_rows = os.path.getsize(self.__vectors_path) // (self.__dim * 2)
+        self.__vectors = None
+        if num_rows > 0:
+            self.__vectors = numpy.memmap(
+                self.__vectors_path,
+                dtype=numpy.float16,
+                mode="r+",
+                shape=(num_rows, self.__dim),
+            )
+
+    def __reserve(self, num_rows: int):
+        """Make sure the vector file has at least `num_rows` rows."""
+        assert self.__dim is not None
+        current = 0 if self.__vectors is None else self.__vectors.shape[0]
+        if num_rows <= current:
+            return
+        num_rows = min(max(num_rows, current * 2, GROWTH_STEP), self.capacity)
+        if self.__vectors is not None:
+            self.__vectors.flush()
+        with open(self.__vectors_path, "ab") as fout:
+            fout.truncate(num_rows * self.__dim * 2)
+        self.__open_vectors()
+
+    def get(self, hashes: Iterable[str]) -> dict[str, Any]:
+        """Return the cached embeddings (as float32 arrays) of the hashes."""
+        hashes = list(hashes)
+        if not hashes:
+            return {}
+        with self.__lock():
+            if self.__vectors is None:
+                return {}
+            found = self.__find_slots(hashes)
+            if not found:
+                return {}
+            now = time.time_ns()
+            self.__conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE hash = ?",
+                ((now, h) for h in found.keys()),
+            )
+            rows = numpy.asarray(
+                self.__vectors[list(found.values())], dtype=numpy.float32
+            )
+        return dict(zip(found.keys(), rows))
+
+    def __find_slots(self, hashes: list[str]) -> dict[str, int]:
+        """The slots of the hashes that are in the cache."""
+        found: dict[str, int] = {}
+        for idx in range(0, len(hashes), QUERY_BATCH_SIZE):
+            batch = hashes[idx : idx + QUERY_BATCH_SIZE]
+            found.update(
+                self.__conn.execute(
+                    f"SELECT hash, slot FROM entries WHERE hash IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            )
+        return found
+
+    def put(self, embeddings: dict[str, Any]):
+        """Add the embeddings, evicting the least recently used ones if needed."""
+        if not embeddings:
+            return
+        with self.__lock():
+            self.__put(
+                list(embeddings.keys()),
+                numpy.asarray(list(embeddings.values()), dtype=numpy.float32),
+            )
+
+    def __put(self, hashes: list[str], vectors: numpy.ndarray):
+        if self.__dim is None:
+            self.__dim = int(vectors.shape[1])
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)",
+                (self.__dim,),
+            )
+        if vectors.shape[1] != self.__dim or self.capacity == 0:
+            return
+        with numpy.errstate(over="ignore"):
+            vectors = vectors.astype(numpy.float16)
+        # values out of the range of float16 can't be cached.
+        keep = numpy.isfinite(vectors).all(axis=1)
+        hashes = [h for h, k in zip(hashes, keep) if k]
+        vectors = vectors[keep]
+        if len(hashes) > self.capacity:
+            hashes, vectors = hashes[: self.capacity], vectors[: self.capacity]
+        if not hashes:
+            return
+
+        # hashes that are already cached keep their slots (and vectors).
+        cached = self.__find_slots(hashes)
+        now = time.time_ns()
+        self.__conn.executemany(
+            "UPDATE entries SET last_used = ? WHERE hash = ?",
+            ((now, h) for h in cached.keys()),
+        )
+        new = [idx for idx, h in enumerate(hashes) if h not in cached]
+        if not new:
+            return
+        slots = self.__allocate(len(new))
+        if len(slots) < len(new):
+            # evict the least recently used entries that are not being added.
+            evicted = self.__conn.execute(
+                "SELECT hash, slot FROM entries ORDER BY last_used LIMIT ?",
+                (len(new) - len(slots) + len(cached),),
+            ).fetchall()
+            evicted = [(h, slot) for h, slot in evicted if h not in cached][
+                : len(new) - len(slots)
+            ]
+            self.__conn.executemany(
+                "DELETE FROM entries WHERE hash = ?", ((h,) for h, _ in evicted)
+            )
+            self.__conn.executemany(
+                "INSERT OR IGNORE INTO free_slots (slot) VALUES (?)",
+                ((slot,) for _, slot in evicted),
+            )
+            # the evicted rows may only be overwritten once no committed entry
+            # refers to them. Another process may take some of them meanwhile.
+            self.__checkpoint()
+            # which may have cached some of the hashes too.
+            cached = self.__find_slots([hashes[idx] for idx in new])
+            new = [idx for idx in new if hashes[idx] not in cached]
+            slots = self.__allocate(len(new))
+        new = new[: len(slots)]
+        if not new:
+            return
+
+        self.__reserve(max(slots) + 1)
+        assert self.__vectors is not None
+        self.__vectors[slots] = vectors[new]
+        self.__conn.executemany(
+            "DELETE FROM free_slots WHERE slot = ?", ((slot,) for slot in slots)
+        )
+        self.__conn.executemany(
+            "INSERT OR REPLACE INTO entries (hash, slot, last_used) VALUES (?, ?, ?)",
+            ((hashes[idx], slot, now) for idx, slot in zip(new, slots)),
+        )
+
+    def __allocate(self, num_slots: int) -> list[int]:
+        """Up to `num_slots` rows that no entry refers to."""
+        slots = [
+            row[0]
+            for row in self.__conn.execute(
+                "SELECT slot FROM free_slots WHERE slot < ? ORDER BY slot LIMIT ?",
+                (self.capacity, num_slots),
+            )
+        ]
+        # the rows above the highest one in use.
+        top = self.__conn.execute(
+            "SELECT MAX(slot) FROM (SELECT slot FROM entries UNION ALL SELECT slot FROM free_slots)"
+        ).fetchone()[0]
+        top = 0 if top is None else top + 1
+        slots.extend(range(top, min(self.capacity, top + num_slots - len(slots))))
+        return slots
+
+    def close(self):
+        if self.__vectors is not None:
+            self.__vectors.flush()
+            self.__vectors = None
+        self.__conn.close()
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from vectorcode.cli_utils import Config
+
+# shards smaller than this aren't worth the round trip to another process.
+MIN_SHARD_SIZE = 8
+
+# the embedding function of a worker process.
+_embedding_function: Any = None
+
+
+def _init_worker(configs: Config, num_threads: int):
+    # these have to be set before the numerical libraries are loaded.
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+    from vectorcode.common import get_embedding_function
+
+    global _embedding_function
+    _embedding_function = get_embedding_function(configs)
+
+
+def _embed(documents: list[str]) -> list:
+    return list(_embedding_function(documents))
+
+
+def split_shards(documents: list[str], num_shards: int) -> list[list[str]]:
+    """Split the documents into at most `num_shards` contiguous, even shards."""
+    num_shards = max(1, min(num_shards, len(documents) // MIN_SHARD_SIZE))
+    size, remainder = divmod(len(documents), num_shards)
+    shards = []
+    start = 0
+    for idx in range(num_shards):
+        end = start + size + (1 if idx < remainder else 0)
+        shards.append(documents[start:end])
+        start = end
+    return shards
+
+
+class EmbeddingPool:
+    """
+    A drop-in replacement of the embedding function that computes the
+    embeddings in `num_workers` processes. Each process holds its own instance
+    of the embedding function, limited to `threads_per_worker` threads
+    (default: the CPU cores divided evenly between the workers), and each call
+    is split into one shard per worker.
+
+    This helps with CPU-only models, where tokenisation and the Python side of
+    the batching are serialised in a single process. The workers are started,
+    and load their models, on the first call.
+    """
+
+    def __init__(
+        self,
+        configs: Config,
+        num_workers: int,
+        threads_per_worker: Optional[int] = None,
+    ):
+        self.num_workers = num_workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+        self.__executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            # the parent may have loaded libraries that don't survive a fork.
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(configs, threads_per_worker),
+        )
+
+    def __call__(self, input: list[str]) -> list:
+        if not input:
+            return []
+        futures = [
+            self.__executor.submit(_embed, shard)
+            for shard in split_shards(list(input), self.num_workers)
+        ]
+        embeddings: list = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,105 @@
+import codecs
+import math
+import os
+from collections import Counter
+from typing import Optional
+
+SNIFF_SIZE = 8192
+
+LOCK_FILES = {
+    "bun.lockb",
+    "Cargo.lock",
+    "composer.lock",
+    "flake.lock",
+    "Gemfile.lock",
+    "go.sum",
+    "mix.lock",
+    "npm-shrinkwrap.json",
+    "package-lock.json",
+    "packages.lock.json",
+    "pdm.lock",
+    "Pipfile.lock",
+    "pnpm-lock.yaml",
+    "Podfile.lock",
+    "poetry.lock",
+    "uv.lock",
+    "yarn.lock",
+}
+
+GENERATED_SUFFIXES = (".min.js", ".min.css", ".js.map", ".css.map", ".min.map")
+
+GENERATED_MARKERS = (
+    "@generated",
+    "do not edit",
+    "code generated by",
+    "auto-generated",
+    "autogenerated",
+)
+
+# number of leading lines to look for the generated markers in.
+MARKER_LINES = 10
+
+# average line length (in characters) above which a file is considered minified.
+MAX_AVERAGE_LINE_LENGTH = 300
+
+# bits per byte. Source code is usually around 4.5~5.5; base64 blobs and
+# compressed data are close to 6 and 8 respectively.
+MAX_ENTROPY = 5.9
+
+
+def entropy(data: bytes) -> float:
+    """Shannon entropy of the bytes, in bits per byte."""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(
+        count / total * math.log2(count / total) for count in Counter(data).values()
+    )
+
+
+def sniff_content(head: bytes) -> Optional[str]:
+    """
+    Inspect the first few KB of a file.
+    Return the reason why the file should be skipped, or None if it looks like text
+    that's worth embedding.
+    """
+    if b"\0" in head:
+        return "binary"
+    try:
+        # the sniffed bytes may end in the middle of a multibyte character.
+        text = codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return "binary"
+
+    for line in text.splitlines()[:MARKER_LINES]:
+        lowered = line.lower()
+        if any(marker in lowered for marker in GENERATED_MARKERS):
+            return "generated"
+
+    if len(text) >= 1024:
+        if len(text) / (text.count("\n") + 1) > MAX_AVERAGE_LINE_LENGTH:
+            return "minified"
+        if entropy(head) > MAX_ENTROPY:
+            return "high entropy"
+    return None
+
+
+def should_skip(path: str, max_file_size: int = -1) -> Optional[str]:
+    """
+    Decide whether a file should be skipped without reading the whole file.
+    Return the reason for skipping it, or None if it should be vectorised.
+    `max_file_size` is in bytes, and a negative value means no limit.
+    """
+    name = os.path.basename(path)
+    if name in LOCK_FILES:
+        return "lock file"
+    if name.endswith(GENERATED_SUFFIXES):
+        return "generated"
+    try:
+        if max_file_size >= 0 and os.path.getsize(path) > max_file_size:
+            return "too large"
+        with open(path, "rb") as fin:
+            head = fin.read(SNIFF_SIZE)
+    except OSError:
+        return "unreadable"
+    return sniff_content(head)
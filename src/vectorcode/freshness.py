@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+from typing import Iterable, Optional, Sequence
+
+from chromadb.api.types import QueryResult
+
+from vectorcode.manifest import Manifest, is_stat_unchanged
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def get_candidate_files(results: QueryResult) -> list[str]:
+    """
+    The files in the query results, ordered by the best rank of their chunks
+    in any of the query chunks.
+    """
+    assert results["metadatas"] is not None
+    candidates: dict[str, None] = {}
+    chunk_metas = results["metadatas"]
+    for rank in range(max((len(metas) for metas in chunk_metas), default=0)):
+        for metas in chunk_metas:
+            if rank < len(metas) and metas[rank].get("path") is not None:
+                candidates.setdefault(str(metas[rank]["path"]))
+    return list(candidates)
+
+
+def find_stale_files(
+    paths: Iterable[str], manifest: Manifest
+) -> tuple[list[str], list[str]]:
+    """
+    Compare the size and mtime of the files against the fingerprints recorded
+    when they were vectorised. Returns the files that may have changed since
+    (including the ones without a fingerprint), and the files that no longer
+    exist, both in the order of `paths`.
+    """
+    stale: list[str] = []
+    deleted: list[str] = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            deleted.append(path)
+            continue
+        if not is_stat_unchanged(manifest.get(path), stat):
+            stale.append(path)
+    return stale, deleted
+
+
+def start_background_update(
+    project_root: str, lock_path: str, args: Optional[Sequence[str]] = None
+) -> bool:
+    """
+    Start a detached `vectorcode update --since` for the project, or `args` if
+    given, unless a previous one started with the same `lock_path` is still
+    running. The child holds a lock on `lock_path` for as long as it runs.
+
+    Returns whether a new process has been started.
+    """
+    if args is None:
+        args = [
+            sys.executable,
+            "-m",
+            "vectorcode.main",
+            "update",
+            "--pipe",
+            "--project_root",
+            project_root,
+            "--since",
+        ]
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        subprocess.Popen(
+            args,
+            cwd=project_root,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            # the lock is released when the child closes its copy of the file.
+            pass_fds=(fd,),
+        )
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
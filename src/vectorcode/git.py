@@ -0,0 +1,188 @@
+import asyncio
+import os
+import subprocess
+from dataclasses import dataclass, field
+from typing import Optional
+
+# modes of the index entries that are not regular files: symlinks and submodules.
+NON_REGULAR_MODES = {"120000", "160000"}
+
+
+@dataclass
+class GitChanges:
+    """Absolute paths of the files that changed since a commit."""
+
+    # added, modified or renamed-to files, including untracked ones.
+    changed: set[str] = field(default_factory=set)
+    # deleted or renamed-from files.
+    deleted: set[str] = field(default_factory=set)
+    # the renamed-from path of each renamed-to file.
+    renamed: dict[str, str] = field(default_factory=dict)
+
+
+async def run_git(cwd: str, *args: str) -> Optional[str]:
+    """Run a git command. Return its stdout, or None if it fails."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "git",
+            *args,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        # git is not installed.
+        return None
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        return None
+    return stdout.decode(errors="surrogateescape")
+
+
+async def get_repo_root(cwd: str) -> Optional[str]:
+    output = await run_git(cwd, "rev-parse", "--show-toplevel")
+    if output is None:
+        return None
+    return output.strip()
+
+
+async def get_head(cwd: str) -> Optional[str]:
+    """The commit ID of HEAD, or None if `cwd` is not in a git repository."""
+    output = await run_git(cwd, "rev-parse", "--verify", "HEAD")
+    if output is None:
+        return None
+    return output.strip()
+
+
+def parse_name_status(output: str, changes: GitChanges, root: str):
+    """Parse the output of `git diff --name-status -z`."""
+    fields = output.split("\0")
+    idx = 0
+    while idx < len(fields) and fields[idx]:
+        status = fields[idx]
+        if status[0] in "RC":
+            old_path, new_path = fields[idx + 1], fields[idx + 2]
+            if status[0] == "R":
+                changes.deleted.add(os.path.join(root, old_path))
+                changes.renamed[os.path.join(root, new_path)] = os.path.join(
+                    root, old_path
+                )
+            changes.changed.add(os.path.join(root, new_path))
+            idx += 3
+            continue
+        path = os.path.join(root, fields[idx + 1])
+        if status[0] == "D":
+            changes.deleted.add(path)
+        else:
+            changes.changed.add(path)
+        idx += 2
+
+
+def parse_untracked(output: str, root: str) -> set[str]:
+    """Parse the untracked files from the output of `git status --porcelain -z`."""
+    untracked = set()
+    fields = iter(output.split("\0"))
+    for entry in fields:
+        if entry.startswith("?? "):
+            untracked.add(os.path.join(root, entry[3:]))
+        elif entry[:1] in "RC":
+            # renames and copies are followed by the original path.
+            next(fields, None)
+    return untracked
+
+
+def parse_non_regular(output: str, root: str) -> set[str]:
+    """Parse the symlinks and submodules from the output of `git ls-files -s -z`."""
+    paths = set()
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        if info.split(" ", 1)[0] in NON_REGULAR_MODES:
+            paths.add(os.path.join(root, path))
+    return paths
+
+
+async def get_changes(cwd: str, since: str) -> Optional[GitChanges]:
+    """
+    Find the files in the working tree that have changed since the commit
+    `since`, including uncommitted changes and untracked (but not ignored)
+    files. Symlinks and submodules are left out.
+
+    Return None if `cwd` is not in a git repository or `since` is not a valid
+    commit.
+    """
+    root = await get_repo_root(cwd)
+    if root is None:
+        return None
+    diff, status, ls_files = await asyncio.gather(
+        run_git(root, "diff", "--name-status", "-z", "--find-renames", since, "--"),
+        run_git(root, "status", "--porcelain", "-z", "--untracked-files=all"),
+        run_git(root, "ls-files", "-s", "-z"),
+    )
+    if diff is None or status is None or ls_files is None:
+        return None
+    changes = GitChanges()
+    parse_name_status(diff, changes, root)
+    changes.changed.update(parse_untracked(status, root))
+    changes.changed.difference_update(parse_non_regular(ls_files, root))
+    # a file that is deleted in the index may still be in the working tree.
+    changes.deleted = {path for path in changes.deleted if not os.path.isfile(path)}
+    return changes
+
+
+# marks the start of a commit in the output of `git log`.
+COMMIT_MARKER = "\x01"
+
+
+def parse_log_names(
+    output: str, root: str, max_files_per_commit: Optional[int] = None
+) -> list[str]:
+    """
+    Parse the output of `git log --name-only --format=%x01 -z` into the paths
+    it mentions, in the order of their first appearance. Commits that touch
+    more than `max_files_per_commit` files are left out.
+    """
+    paths: dict[str, None] = {}
+    commits: list[list[str]] = []
+    for entry in output.split("\0"):
+        entry = entry.strip("\n")
+        if entry == COMMIT_MARKER:
+            commits.append([])
+        elif entry and commits:
+            commits[-1].append(entry)
+    for commit in commits:
+        if max_files_per_commit is not None and len(commit) > max_files_per_commit:
+            continue
+        for path in commit:
+            paths.setdefault(os.path.join(root, path))
+    return list(paths)
+
+
+async def get_recent_files(
+    cwd: str, max_commits: int, max_files_per_commit: Optional[int] = None
+) -> Optional[list[str]]:
+    """
+    The files touched by the last `max_commits` commits, the most recently
+    committed first. Commits that touch more than `max_files_per_commit` files
+    (like imports, mass renames or reformatting) say little about which files
+    are being worked on, so they are left out.
+
+    Return None if `cwd` is not in a git repository.
+    """
+    root = await get_repo_root(cwd)
+    if root is None:
+        return None
+    output = await run_git(
+        root,
+        "log",
+        f"--max-count={max_commits}",
+        "--name-only",
+        "--no-renames",
+        # prints COMMIT_MARKER.
+        "--format=%x01",
+        "-z",
+    )
+    if output is None:
+        return None
+    return parse_log_names(output, root, max_files_per_commit)
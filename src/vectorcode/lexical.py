@@ -0,0 +1,426 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+from vectorcode.cli_utils import (
+    CACHE_DIR,
+    Config,
+    QueryMode,
+    expand_globs,
+    expand_path,
+    get_collection_name,
+)
+from vectorcode.results import MAX_CHUNKS_PER_FILE, Snippet
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# the words in snake_case, camelCase and PascalCase identifiers.
+SUBWORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+# the shapes of the words of a query that look like symbols or file names:
+# snake_case (or with a leading underscore), camelCase and PascalCase,
+# dotted and `::` paths, and file paths.
+SNAKE_CASE_RE = re.compile(r"\w*[A-Za-z]\w*_\w*|_+[A-Za-z]\w*")
+CAMEL_CASE_RE = re.compile(r"[A-Za-z0-9]*[a-z0-9][A-Z][A-Za-z0-9]*")
+PATH_RE = re.compile(r"(?:~|\.{1,2})?[/\\]?[\w-]+(?:(?:\.|::|[/\\])[\w-]+)*[/\\]?")
+
+# (text, start_line, end_line, start_byte, end_byte) of a chunk.
+ChunkLocation = tuple[str, Optional[int], Optional[int], Optional[int], Optional[int]]
+
+# weights of the kinds of terms: whole identifiers, path tokens, sub-words of
+# identifiers and trigrams of identifiers.
+TERM_WEIGHTS = {"i": 3.0, "p": 3.0, "w": 1.0, "t": 0.25}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# the constant of reciprocal rank fusion.
+RRF_K = 60
+
+
+def get_terms(text: str) -> Counter[str]:
+    """The identifiers, their sub-words and their trigrams in `text`."""
+    terms: Counter[str] = Counter()
+    for identifier in IDENTIFIER_RE.findall(text):
+        lowered = identifier.lower()
+        terms["i:" + lowered] += 1
+        for word in SUBWORD_RE.findall(identifier):
+            terms["w:" + word.lower()] += 1
+        for idx in range(len(lowered) - 2):
+            terms["t:" + lowered[idx : idx + 3]] += 1
+    return terms
+
+
+def get_path_terms(relpath: str) -> Counter[str]:
+    """The terms of a path: the terms in it, and its trailing components."""
+    terms = get_terms(relpath)
+    parts = relpath.lower().replace("\\", "/").split("/")
+    for idx in range(len(parts)):
+        terms["p:" + "/".join(parts[idx:])] += 1
+    terms["p:" + os.path.splitext(parts[-1])[0]] += 1
+    return terms
+
+
+def get_query_terms(query: Iterable[str]) -> Counter[str]:
+    terms: Counter[str] = Counter()
+    for q in query:
+        terms.update(get_terms(q))
+        for token in q.split():
+            token = token.lower().replace("\\", "/").strip("./")
+            if token:
+                terms["p:" + token] += 1
+    return terms
+
+
+def is_identifier(word: str) -> bool:
+    """Whether a word of a query has the shape of a symbol or a file name."""
+    # a call, like `get_collection()`.
+    word = word.removesuffix("()")
+    if SNAKE_CASE_RE.fullmatch(word) or CAMEL_CASE_RE.fullmatch(word):
+        return True
+    # a path needs a separator, so that plain words aren't taken for one.
+    return (
+        PATH_RE.fullmatch(word) is not None
+        and any(separator in word for separator in "./\\:")
+        and any(char.isalpha() for char in word)
+    )
+
+
+def is_identifier_query(query: Optional[list[str]]) -> bool:
+    """
+    Whether the query is made of symbol or file names, without any prose.
+    The words of the query are judged together, and every one of them has to
+    look like a symbol or a path, so that a question made of plain words
+    (`how does the cache work`) goes to the vector search.
+    """
+    words = " ".join(query or []).split()
+    return bool(words) and all(is_identifier(word) for word in words)
+
+
+class LexicalIndex:
+    """
+    An inverted index of the identifiers (and their sub-words and trigrams) in
+    the chunks of a collection, and of the paths of the files, scored by BM25.
+
+    Only the postings and the locations of the chunks are stored. The text of
+    the chunks that are returned is read from the files, if they haven't
+    changed since they were indexed.
+
+    It lives in the database of the `Manifest` of the collection, which owns
+    the connection: changes are committed by the manifest, and the index is
+    cleared along with the fingerprints.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.__conn = conn
+        columns = [
+            row[1] for row in self.__conn.execute("PRAGMA table_info(lexical_chunks)")
+        ]
+        if "text" in columns:
+            # an index that held a copy of the chunks. The files are indexed
+            # again by the next `vectorise` or `update`.
+            self.__conn.executescript(
+                """
+                DROP TABLE lexical_files;
+                DROP TABLE lexical_chunks;
+                DROP TABLE lexical_postings;
+                """
+            )
+        self.__conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS lexical_files (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT
+            );
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                start_line INTEGER,
+                end_line INTEGER,
+                start_byte INTEGER,
+                end_byte INTEGER,
+                length INTEGER NOT NULL,
+                is_path INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lexical_chunks_path ON lexical_chunks (path);
+            CREATE TABLE IF NOT EXISTS lexical_postings (
+                term TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS lexical_postings_chunk ON lexical_postings (chunk);
+            """
+        )
+
+    def clear(self):
+        self.__conn.execute("DELETE FROM lexical_files")
+        self.__conn.execute("DELETE FROM lexical_chunks")
+        self.__conn.execute("DELETE FROM lexical_postings")
+
+    def has(self, path: str) -> bool:
+        return (
+            self.__conn.execute(
+                "SELECT 1 FROM lexical_files WHERE path = ?", (path,)
+            ).fetchone()
+            is not None
+        )
+
+    def replace(
+        self,
+        path: str,
+        relpath: str,
+        chunks: Iterable[ChunkLocation],
+        sha256: Optional[str] = None,
+    ):
+        """
+        Index the chunks of a file, given as (text, start_line, end_line,
+        start_byte, end_byte). `sha256` is the hash of the content of the file,
+        which is checked before the chunks are read back from it.
+        """
+        self.remove([path])
+        self.__conn.execute(
+            "INSERT INTO lexical_files (path, sha256) VALUES (?, ?)", (path, sha256)
+        )
+        entries = [(None, None, None, None, get_path_terms(relpath), True)]
+        entries.extend(
+            (start_line, end_line, start_byte, end_byte, get_terms(text), False)
+            for text, start_line, end_line, start_byte, end_byte in chunks
+        )
+        if len(entries) == 1:
+            # an empty file.
+            return
+        for start_line, end_line, start_byte, end_byte, terms, is_path in entries:
+            cursor = self.__conn.execute(
+                "INSERT INTO lexical_chunks (path, start_line, end_line, start_byte, end_byte, length, is_path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    start_line,
+                    end_line,
+                    start_byte,
+                    end_byte,
+                    sum(terms.values()),
+                    is_path,
+                ),
+            )
+            self.__conn.executemany(
+                "INSERT INTO lexical_postings (term, chunk, tf) VALUES (?, ?, ?)",
+                ((term, cursor.lastrowid, tf) for term, tf in terms.items()),
+            )
+
+    def remove(self, paths: Iterable[str]):
+        for path in paths:
+            self.__conn.execute(
+                "DELETE FROM lexical_postings WHERE chunk IN (SELECT id FROM lexical_chunks WHERE path = ?)",
+                (path,),
+            )
+            self.__conn.execute("DELETE FROM lexical_chunks WHERE path = ?", (path,))
+            self.__conn.execute("DELETE FROM lexical_files WHERE path = ?", (path,))
+
+    def has_exact_match(self, terms: Iterable[str]) -> bool:
+        """Whether any chunk contains one of the identifiers or paths in `terms`."""
+        exact = [term for term in terms if term[0] in "ip"]
+        return any(
+            self.__conn.execute(
+                "SELECT 1 FROM lexical_postings WHERE term = ? LIMIT 1", (term,)
+            ).fetchone()
+            is not None
+            for term in exact
+        )
+
+    def search(
+        self, terms: Iterable[str], n_result: int, exclude: Iterable[str] = ()
+    ) -> tuple[list[str], dict[str, list[Snippet]]]:
+        """
+        The `n_result` best files for the query terms, and their best chunks.
+        The score of a file is the BM25 score of its best chunk plus the score
+        of its path.
+        """
+        num_chunks, avg_length = self.__conn.execute(
+            "SELECT COUNT(*), AVG(length) FROM lexical_chunks"
+        ).fetchone()
+        if not num_chunks:
+            return [], {}
+        avg_length = avg_length or 1
+        scores: defaultdict[int, float] = defaultdict(float)
+        for term in set(terms):
+            rows = self.__conn.execute(
+                """
+                SELECT p.chunk, p.tf, c.length FROM lexical_postings p
+                JOIN lexical_chunks c ON c.id = p.chunk WHERE p.term = ?
+                """,
+                (term,),
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (num_chunks - len(rows) + 0.5) / (len(rows) + 0.5))
+            weight = TERM_WEIGHTS[term[0]] * idf
+            for chunk, tf, length in rows:
+                scores[chunk] += (
+                    weight
+                    * tf
+                    * (BM25_K1 + 1)
+                    / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                )
+
+        excluded = set(exclude)
+        path_scores: defaultdict[str, float] = defaultdict(float)
+        chunk_scores: defaultdict[str, list[tuple[float, int]]] = defaultdict(list)
+        chunk_ids = list(scores.keys())
+        for idx in range(0, len(chunk_ids), 500):
+            page = chunk_ids[idx : idx + 500]
+            for chunk, path, is_path in self.__conn.execute(
+                f"SELECT id, path, is_path FROM lexical_chunks WHERE id IN ({','.join('?' * len(page))})",
+                page,
+            ):
+                if path in excluded:
+                    continue
+                if is_path:
+                    path_scores[path] += scores[chunk]
+                else:
+                    chunk_scores[path].append((scores[chunk], chunk))
+        file_scores = {
+            path: path_scores.get(path, 0.0)
+            + max((score for score, _ in chunk_scores.get(path, [])), default=0.0)
+            for path in set(path_scores) | set(chunk_scores)
+        }
+        files = sorted(file_scores, key=lambda path: -file_scores[path])[:n_result]
+
+        snippets: dict[str, list[Snippet]] = {}
+        for path in files:
+            snippets[path] = []
+            best = sorted(chunk_scores.get(path, []), reverse=True)[
+                :MAX_CHUNKS_PER_FILE
+            ]
+            content = self.__read(path) if best else None
+            if content is None:
+                continue
+            for _, chunk in best:
+                start_line, end_line, start_byte, end_byte = self.__conn.execute(
+                    "SELECT start_line, end_line, start_byte, end_byte FROM lexical_chunks WHERE id = ?",
+                    (chunk,),
+                ).fetchone()
+                if start_byte is None or end_byte is None:
+                    continue
+                snippets[path].append(
+                    Snippet(
+                        content[start_byte:end_byte].decode(errors="replace"),
+                        start_line,
+                        end_line,
+                    )
+                )
+        return files, snippets
+
+    def __read(self, path: str) -> Optional[bytes]:
+        """
+        The content of an indexed file, or None if it can't be read or it has
+        changed since it was indexed.
+        """
+        row = self.__conn.execute(
+            "SELECT sha256 FROM lexical_files WHERE path = ?", (path,)
+        ).fetchone()
+        try:
+            with open(path, "rb") as fin:
+                content = fin.read()
+        except OSError:
+            return None
+        if row is None or row[0] is None:
+            return content
+        if hashlib.sha256(content).hexdigest() != row[0]:
+            return None
+        return content
+
+
+def get_lexical_index_path(collection_name: str) -> str:
+    # the database of the manifest (see `common.get_manifest`).
+    return os.path.join(CACHE_DIR, collection_name, "manifest.db")
+
+
+async def search_collection(
+    collection_name: str, configs: Config, n_result: int, exact_only: bool = False
+) -> Optional[tuple[list[str], dict[str, list[Snippet]]]]:
+    """
+    Search the lexical index of the collection. Returns None if there's no
+    index, or if `exact_only` and no chunk contains any of the identifiers or
+    paths in the query.
+    """
+    db_path = get_lexical_index_path(collection_name)
+    if not os.path.isfile(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        index = LexicalIndex(conn)
+        terms = get_query_terms(configs.query or [])
+        if exact_only and not index.has_exact_match(terms):
+            return None
+        excluded = [
+            str(expand_path(path, True))
+            for path in await expand_globs(list(configs.query_exclude))
+            if os.path.isfile(path)
+        ]
+        return index.search(terms, n_result, excluded)
+    finally:
+        conn.close()
+
+
+async def get_lexical_result(
+    configs: Config,
+) -> Optional[tuple[list[str], dict[str, list[Snippet]]]]:
+    """
+    Answer the query from the lexical index, without the embedding model or
+    the database, if `query_mode` is `lexical`, or if it's `auto` and the
+    query is an identifier or a file name that's in the index. Returns None
+    if the query should go to the vector search.
+    """
+    if configs.query_mode == QueryMode.auto:
+        if not is_identifier_query(configs.query):
+            return None
+    elif configs.query_mode != QueryMode.lexical:
+        return None
+    result = await search_collection(
+        get_collection_name(str(configs.project_root)),
+        configs,
+        configs.n_result,
+        exact_only=configs.query_mode == QueryMode.auto,
+    )
+    if result is None and configs.query_mode == QueryMode.lexical:
+        print(
+            "There's no lexical index for this project. Falling back to the vector search. Run `vectorcode vectorise` to build it.",
+            file=sys.stderr,
+        )
+    return result
+
+
+def fuse_rankings(rankings: Iterable[list[str]], k: int = RRF_K) -> list[str]:
+    """Merge the rankings of the files by reciprocal rank fusion."""
+    scores: defaultdict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, path in enumerate(ranking):
+            scores[path] += 1 / (k + rank + 1)
+    return sorted(scores, key=lambda path: -scores[path])
+
+
+async def fuse_lexical_result(
+    collection_name: str,
+    configs: Config,
+    files: list[str],
+    snippets: dict[str, list[Snippet]],
+) -> tuple[list[str], dict[str, list[Snippet]]]:
+    """
+    Fuse the ranking of the files from the vector search with the one from the
+    lexical index (for `query_mode` `hybrid`). The chunks that contain the
+    query terms go before the ones from the vector search.
+    """
+    lexical = await search_collection(collection_name, configs, len(files))
+    if lexical is None:
+        return files[: configs.n_result], snippets
+    lexical_files, lexical_snippets = lexical
+    fused = fuse_rankings([files, lexical_files])[: configs.n_result]
+    fused_snippets = {}
+    for path in fused:
+        merged: dict[tuple, Snippet] = {}
+        for snippet in lexical_snippets.get(path, []) + snippets.get(path, []):
+            merged.setdefault((snippet.start_line, snippet.text), snippet)
+        fused_snippets[path] = list(merged.values())[:MAX_CHUNKS_PER_FILE]
+    return fused, fused_snippets
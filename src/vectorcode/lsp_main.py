@@ -6,6 +6,7 @@ from pathlib import Path
 
 from chromadb.api import AsyncClientAPI
 from chromadb.api.models.AsyncCollection import AsyncCollection
+from chromadb.api.types import EmbeddingFunction
 from lsprotocol import types
 from pygls.server import LanguageServer
 
@@ -17,12 +18,20 @@ from vectorcode.cli_utils import (
     load_config_file,
     parse_cli_args,
 )
-from vectorcode.common import get_client, get_collection, try_server
-from vectorcode.subcommands.query import get_query_result_files
+from vectorcode.common import (
+    get_client,
+    get_collection,
+    get_embedding_function,
+    try_server,
+)
+from vectorcode.lexical import get_lexical_result
+from vectorcode.results import build_query_results
+from vectorcode.subcommands.query import get_query_result_snippets
 
 cached_project_configs: dict[str, Config] = {}
 cached_clients: dict[tuple[str, int], AsyncClientAPI] = {}
 cached_collections: dict[str, AsyncCollection] = {}
+cached_embedding_functions: dict[str, EmbeddingFunction] = {}
 
 
 async def lsp_start() -> int:
@@ -63,26 +72,35 @@ async def lsp_start() -> int:
                 "VectorCode", message="Retrieving from VectorCode."
             ),
         )
-        if not await try_server(final_configs.host, final_configs.port):
-            raise ConnectionError(
-                "Failed to find an existing ChromaDB server, which is a hard requirement for LSP mode!"
-            )
-        if cached_clients.get((final_configs.host, final_configs.port)) is None:
-            cached_clients[(final_configs.host, final_configs.port)] = await get_client(
-                final_configs
-            )
-        if cached_collections.get(str(final_configs.project_root)) is None:
-            cached_collections[str(final_configs.project_root)] = await get_collection(
-                cached_clients[(final_configs.host, final_configs.port)], final_configs
+        result = await get_lexical_result(final_configs)
+        if result is None:
+            if not await try_server(final_configs.host, final_configs.port):
+                raise ConnectionError(
+                    "Failed to find an existing ChromaDB server, which is a hard requirement for LSP mode!"
+                )
+            if cached_clients.get((final_configs.host, final_configs.port)) is None:
+                cached_clients[
+                    (final_configs.host, final_configs.port)
+                ] = await get_client(final_configs)
+            project_root = str(final_configs.project_root)
+            if cached_embedding_functions.get(project_root) is None:
+                cached_embedding_functions[project_root] = get_embedding_function(
+                    final_configs
+                )
+            if cached_collections.get(project_root) is None:
+                cached_collections[project_root] = await get_collection(
+                    cached_clients[(final_configs.host, final_configs.port)],
+                    final_configs,
+                    embedding_function=cached_embedding_functions[project_root],
+                )
+            result = await get_query_result_snippets(
+                collection=cached_collections[project_root],
+                configs=final_configs,
+                embedding_function=cached_embedding_functions[project_root],
             )
-        final_results = []
-        for path in await get_query_result_files(
-            collection=cached_collections[str(final_configs.project_root)],
-            configs=final_configs,
-        ):
-            if os.path.isfile(path):
-                with open(path) as fin:
-                    final_results.append({"path": path, "document": fin.read()})
+        result_files, snippets = result
+        final_configs.use_absolute_path = True
+        final_results = build_query_results(final_configs, result_files, snippets)
         ls.progress.end(
             progress_token,
             types.WorkDoneProgressEnd(
@@ -10,19 +10,12 @@ from vectorcode.cli_utils import (
     CliAction,
     find_project_config_dir,
     load_config_file,
+    load_project_config,
     parse_cli_args,
 )
-from vectorcode.common import start_server, try_server
-from vectorcode.subcommands import (
-    check,
-    clean,
-    drop,
-    init,
-    ls,
-    query,
-    update,
-    vectorise,
-)
+from vectorcode.lexical import get_lexical_result
+from vectorcode.query_cache import get_cached_result
+from vectorcode.results import load_query_result, print_query_results
 
 
 async def async_main():
@@ -36,17 +29,10 @@ async def async_main():
             if cli_args.project_root is None:
                 cli_args.project_root = str(Path(project_dir).parent.resolve())
 
-            project_config_file = os.path.join(
-                cli_args.project_root, ".vectorcode", "config.json"
-            )
-            if os.path.isfile(project_config_file):
-                # has project-local config. use it
-                final_configs = await (
-                    await load_config_file(project_config_file)
-                ).merge_from(cli_args)
-            else:
-                # no project-local config. use global config.
-                final_configs = await (await load_config_file()).merge_from(cli_args)
+            # the project-local config, or the global one if there's none.
+            final_configs = await (
+                await load_project_config(cli_args.project_root)
+            ).merge_from(cli_args)
         else:
             final_configs = await (await load_config_file()).merge_from(cli_args)
             if final_configs.project_root is None:
@@ -55,6 +41,37 @@ async def async_main():
         traceback.print_exception(e, file=sys.stderr)
         return 1
 
+    if (
+        final_configs.action == CliAction.query
+        and final_configs.batch is None
+        and not final_configs.project_roots
+        and not final_configs.query_all
+    ):
+        cached = await get_cached_result(final_configs)
+        if cached is not None:
+            print_query_results(final_configs, *load_query_result(cached))
+            return 0
+        lexical_result = await get_lexical_result(final_configs)
+        if lexical_result is not None:
+            print_query_results(final_configs, *lexical_result)
+            return 0
+
+    # chromadb (and the embedding model) take a while to load, so they're
+    # only imported when the command isn't answered from the query cache or
+    # the lexical index.
+    from vectorcode.common import start_server, try_server
+    from vectorcode.subcommands import (
+        check,
+        clean,
+        drop,
+        init,
+        ls,
+        query,
+        update,
+        vectorise,
+        watch,
+    )
+
     match cli_args.action:
         case CliAction.check:
             return await check(cli_args)
@@ -92,6 +109,8 @@ async def async_main():
                 return_val = await update(final_configs)
             case CliAction.clean:
                 return_val = await clean(final_configs)
+            case CliAction.watch:
+                return_val = await watch(final_configs)
     except Exception as e:
         return_val = 1
         traceback.print_exception(e, file=sys.stderr)
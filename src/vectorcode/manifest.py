@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from vectorcode.lexical import LexicalIndex
+
+# number of parameters in one sqlite query.
+QUERY_BATCH_SIZE = 500
+
+
+@dataclass
+class Fingerprint:
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class Manifest:
+    """
+    Fingerprints of the files that have been vectorised into a collection, stored
+    in a sqlite database.
+
+    The manifest is bound to the ID of the collection and to the settings that
+    affect the embeddings (chunking, embedding function, etc.). If either of them
+    changes, all recorded fingerprints are discarded, unless the manifest is
+    opened with `reset=False`. Then it's left untouched and `is_valid` is
+    False, so that readers that don't own the settings can't discard it.
+
+    It maps the content hashes of the chunks in the collection to the ID of
+    one chunk with that content, so that the embeddings of duplicated chunks
+    can be fetched without scanning the collection. The map may point to
+    chunks that have since been deleted.
+
+    It also keeps track of the progress of a run: the arguments of a run that
+    hasn't finished yet, and the files whose chunks may have been partially
+    written. Changes are only persisted when `commit` or `close` is called, so
+    callers should commit periodically as checkpoints.
+
+    The `LexicalIndex` of the collection is kept in the same database as
+    `lexical`, so that it's committed, reset and pruned along with the
+    fingerprints.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        collection_id: str,
+        settings: dict[str, Any],
+        reset: bool = True,
+    ):
+        self.__conn = sqlite3.connect(db_path)
+        self.__conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS in_progress (path TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS chunks (
+                sha256 TEXT PRIMARY KEY,
+                id TEXT NOT NULL
+            );
+            """
+        )
+        self.lexical = LexicalIndex(self.__conn)
+        expected = {
+            "collection_id": collection_id,
+            "settings": json.dumps(settings, sort_keys=True),
+        }
+        stored = dict(self.__conn.execute("SELECT key, value FROM meta").fetchall())
+        self.is_valid = all(stored.get(key) == value for key, value in expected.items())
+        if not self.is_valid and reset:
+            self.__conn.execute("DELETE FROM files")
+            self.__conn.execute("DELETE FROM in_progress")
+            self.__conn.execute("DELETE FROM chunks")
+            self.lexical.clear()
+            self.__conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                expected.items(),
+            )
+            self.__conn.commit()
+            self.is_valid = True
+
+    def get(self, path: str) -> Optional[Fingerprint]:
+        row = self.__conn.execute(
+            "SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return Fingerprint(*row)
+
+    def paths(self) -> list[str]:
+        return [row[0] for row in self.__conn.execute("SELECT path FROM files")]
+
+    def paths_in(self, directory: str) -> list[str]:
+        """The paths under `directory`, found by a range scan of the index."""
+        prefix = os.path.join(directory, "")
+        # the paths that start with the prefix sort before this one.
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return [
+            row[0]
+            for row in self.__conn.execute(
+                "SELECT path FROM files WHERE path >= ? AND path < ?", (prefix, end)
+            )
+        ]
+
+    def update(self, path: str, fingerprint: Fingerprint):
+        self.__conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (path, fingerprint.size, fingerprint.mtime_ns, fingerprint.sha256),
+        )
+        self.__conn.execute("DELETE FROM in_progress WHERE path = ?", (path,))
+
+    def remove(self, paths: Iterable[str]):
+        paths = [(path,) for path in paths]
+        self.__conn.executemany("DELETE FROM files WHERE path = ?", paths)
+        self.__conn.executemany("DELETE FROM in_progress WHERE path = ?", paths)
+        self.lexical.remove(path for (path,) in paths)
+
+    def add_chunks(self, chunks: Iterable[tuple[str, str]]):
+        """Record the (sha256, ID) of chunks that are in the collection."""
+        self.__conn.executemany(
+            "INSERT OR REPLACE INTO chunks (sha256, id) VALUES (?, ?)", chunks
+        )
+
+    def get_chunk_ids(self, hashes: list[str]) -> dict[str, str]:
+        """The ID of a chunk with each of the hashes, if any is known."""
+        found: dict[str, str] = {}
+        for idx in range(0, len(hashes), QUERY_BATCH_SIZE):
+            batch = hashes[idx : idx + QUERY_BATCH_SIZE]
+            found.update(
+                self.__conn.execute(
+                    f"SELECT sha256, id FROM chunks WHERE sha256 IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            )
+        return found
+
+    def mark_in_progress(self, path: str):
+        """Record that the chunks of `path` are about to be written."""
+        self.__conn.execute(
+            "INSERT OR IGNORE INTO in_progress (path) VALUES (?)", (path,)
+        )
+
+    def in_progress_paths(self) -> list[str]:
+        """Files whose chunks may have been partially written by an interrupted run."""
+        return [row[0] for row in self.__conn.execute("SELECT path FROM in_progress")]
+
+    def get_value(self, key: str) -> Any:
+        """Return a JSON value stored by `set_value`, or None."""
+        row = self.__conn.execute(
+            "SELECT value FROM meta WHERE key = ?", ("value:" + key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_value(self, key: str, value: Any):
+        """Store a JSON value. `None` removes the key."""
+        if value is None:
+            self.__conn.execute("DELETE FROM meta WHERE key = ?", ("value:" + key,))
+        else:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ("value:" + key, json.dumps(value)),
+            )
+
+    def begin_run(self, args: dict[str, Any]):
+        """Record the arguments of a run, so that it can be resumed if interrupted."""
+        self.set_value("run", args)
+        self.__conn.commit()
+
+    def get_run(self) -> Optional[dict[str, Any]]:
+        """The arguments of the last run that hasn't finished."""
+        return self.get_value("run")
+
+    def end_run(self):
+        self.set_value("run", None)
+        self.__conn.commit()
+
+    def commit(self):
+        self.__conn.commit()
+
+    def rollback(self):
+        """Discard the changes since the last commit."""
+        self.__conn.rollback()
+
+    def close(self):
+        self.__conn.commit()
+        self.__conn.close()
+
+
+def is_stat_unchanged(fingerprint: Optional[Fingerprint], stat: os.stat_result) -> bool:
+    """Whether the file looks unchanged without reading its content."""
+    return (
+        fingerprint is not None
+        and fingerprint.size == stat.st_size
+        and fingerprint.mtime_ns == stat.st_mtime_ns
+    )
@@ -0,0 +1,125 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+
+from vectorcode.git import get_changes, get_recent_files
+
+# number of commits whose files count as recently committed.
+RECENT_COMMITS = 200
+# commits that touch more files than this are not counted.
+MAX_FILES_PER_COMMIT = 50
+
+# fractions of the hot files at which the indexing time is reported.
+HOT_THRESHOLDS = (0.5, 0.9, 1.0)
+
+
+@dataclass
+class PrioritySignals:
+    """What's known about the files that are likely to be queried soon."""
+
+    # files that are open in the editor.
+    open_files: set[str] = field(default_factory=set)
+    # files with uncommitted changes, including untracked ones.
+    dirty_files: set[str] = field(default_factory=set)
+    # recently committed files, by recency (0 is the most recent).
+    recent_files: dict[str, int] = field(default_factory=dict)
+
+
+async def get_priority_signals(
+    project_root: str, open_files: Iterable[str] = ()
+) -> PrioritySignals:
+    """Collect the signals. The git ones are left empty outside of a repository."""
+    signals = PrioritySignals(open_files={os.path.abspath(path) for path in open_files})
+    changes = await get_changes(project_root, "HEAD")
+    if changes is not None:
+        signals.dirty_files = changes.changed
+    recent = await get_recent_files(project_root, RECENT_COMMITS, MAX_FILES_PER_COMMIT)
+    if recent is not None:
+        signals.recent_files = {path: rank for rank, path in enumerate(recent)}
+    return signals
+
+
+def get_priority(path: str, signals: PrioritySignals) -> tuple:
+    """
+    The sort key of a hot file. Open files go first, then files with
+    uncommitted changes, then recently committed files by recency.
+    """
+    if path in signals.open_files:
+        return (0,)
+    if path in signals.dirty_files:
+        return (1,)
+    return (2, signals.recent_files.get(path, 0))
+
+
+def get_hot_files(
+    signals: PrioritySignals, is_included: Callable[[str], bool]
+) -> list[str]:
+    """
+    The hot files that exist and are accepted by `is_included` (which tells
+    whether a file is part of the run), most useful first.
+    """
+    hot_files = (
+        signals.open_files | signals.dirty_files | set(signals.recent_files.keys())
+    )
+    return sorted(
+        (path for path in hot_files if os.path.isfile(path) and is_included(path)),
+        key=lambda path: get_priority(path, signals),
+    )
+
+
+def prioritise(files: Iterable[str], hot_files: list[str]) -> Iterator[str]:
+    """
+    Yield the hot files first, and then the rest of `files` as they come, so
+    that a long walk isn't held in memory. The hot files are not yielded
+    again.
+    """
+    yield from hot_files
+    yielded = set(hot_files)
+    for file in files:
+        path = os.path.abspath(str(file))
+        if path not in yielded:
+            yield path
+
+
+class IndexProgress:
+    """
+    Record how long it takes from `start` (a `time.monotonic()` timestamp,
+    default: now) until a fraction of the hot files is searchable (or found
+    unchanged), for each of `thresholds`.
+    """
+
+    def __init__(
+        self,
+        hot_files: Iterable[str],
+        thresholds: tuple[float, ...] = HOT_THRESHOLDS,
+        start: Optional[float] = None,
+    ):
+        self.hot_files = set(hot_files)
+        self.thresholds = thresholds
+        self.__start = time.monotonic() if start is None else start
+        self.__num_done = 0
+        self.__times: dict[float, float] = {}
+
+    def done(self, path: str):
+        if path not in self.hot_files:
+            return
+        self.hot_files.discard(path)
+        self.__num_done += 1
+        total = self.__num_done + len(self.hot_files)
+        for threshold in self.thresholds:
+            if threshold not in self.__times and self.__num_done >= threshold * total:
+                self.__times[threshold] = time.monotonic() - self.__start
+
+    @property
+    def num_hot_files(self) -> int:
+        return self.__num_done + len(self.hot_files)
+
+    def report(self) -> dict[str, Optional[float]]:
+        """Seconds to each threshold, keyed by percentage, or None if not reached."""
+        return {
+            f"{threshold:.0%}": (
+                round(self.__times[threshold], 3) if threshold in self.__times else None
+            )
+            for threshold in self.thresholds
+        }
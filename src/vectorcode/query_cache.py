@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Iterable, Optional
+
+from vectorcode.cli_utils import (
+    CACHE_DIR,
+    Config,
+    QueryInclude,
+    expand_globs,
+    expand_path,
+    get_collection_name,
+)
+
+
+def get_stat(path: str) -> Optional[list[int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class QueryCache:
+    """
+    The results of recent queries on a collection, stored in a sqlite
+    database. A result is any JSON value, along with the files it refers to.
+
+    The cache has a generation counter that is bumped by every write to the
+    collection. A result is stored with the generation that was current when
+    the query started, and is only returned while that generation is still
+    current, so that a query that ran during a write can't store an outdated
+    result. A result is also dropped if the size or mtime of any of its files
+    has changed. When there are more than `max_entries` results, the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 0):
+        self.__max_entries = max_entries
+        self.__conn = sqlite3.connect(db_path)
+        self.__conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+            """
+        )
+
+    @property
+    def generation(self) -> int:
+        row = self.__conn.execute(
+            "SELECT value FROM meta WHERE key = 'generation'"
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def bump(self):
+        """Invalidate all results."""
+        self.__conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)"
+        )
+        self.__conn.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+        )
+        self.__conn.execute("DELETE FROM results")
+        self.__conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self.__conn.execute(
+            "SELECT value FROM results WHERE key = ? AND generation = ?",
+            (key, self.generation),
+        ).fetchone()
+        if row is None:
+            return None
+        value, files = json.loads(row[0])
+        if any(get_stat(path) != stat for path, stat in files):
+            self.__conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.__conn.commit()
+            return None
+        self.__conn.execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (time.time_ns(), key)
+        )
+        self.__conn.commit()
+        return value
+
+    def put(self, key: str, generation: int, value: Any, files: Iterable[str]):
+        """Store the result of a query that started at `generation`."""
+        if self.__max_entries <= 0 or generation != self.generation:
+            return
+        files = [[path, get_stat(path)] for path in files]
+        self.__conn.execute(
+            "INSERT OR REPLACE INTO results (key, generation, value, last_used) VALUES (?, ?, ?, ?)",
+            (key, generation, json.dumps([value, files]), time.time_ns()),
+        )
+        self.__conn.execute(
+            """
+            DELETE FROM results WHERE key NOT IN (
+                SELECT key FROM results ORDER BY last_used DESC LIMIT ?
+            )
+            """,
+            (self.__max_entries,),
+        )
+        self.__conn.commit()
+
+    def close(self):
+        self.__conn.commit()
+        self.__conn.close()
+
+
+def get_query_cache_path(collection_name: str) -> str:
+    cache_dir = os.path.join(CACHE_DIR, collection_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, "queries.db")
+
+
+def get_query_cache(collection_name: str, configs: Config) -> Optional[QueryCache]:
+    """
+    Open the cache of query results of the collection, or return None if the
+    cache is disabled (`query_cache_size` <= 0).
+    """
+    if configs.query_cache_size <= 0:
+        return None
+    return QueryCache(get_query_cache_path(collection_name), configs.query_cache_size)
+
+
+def bump_generation(collection_name: str):
+    """
+    Invalidate the cached query results of the collection. This should be
+    called after every write to the collection.
+    """
+    cache = QueryCache(get_query_cache_path(collection_name))
+    cache.bump()
+    cache.close()
+
+
+async def get_query_cache_key(configs: Config) -> str:
+    """The key of a query in the query cache: everything that affects the result."""
+    excluded = sorted(
+        str(expand_path(path, True))
+        for path in await expand_globs(list(configs.query_exclude))
+        if os.path.isfile(path)
+    )
+    return hashlib.sha256(
+        json.dumps(
+            [
+                configs.query,
+                configs.n_result,
+                configs.query_multiplier,
+                str(configs.query_mode),
+                # the chunks are only retrieved when they're in the output.
+                QueryInclude.chunk in configs.include,
+                excluded,
+                configs.reranker,
+                configs.reranker_params,
+                configs.embedding_function,
+                configs.embedding_params,
+                configs.chunk_size,
+                configs.overlap_ratio,
+            ],
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+
+async def get_cached_result(configs: Config) -> Optional[Any]:
+    """
+    Look the query up in the cache. This doesn't need the database or the
+    embedding model, and doesn't import chromadb.
+    """
+    cache = get_query_cache(get_collection_name(str(configs.project_root)), configs)
+    if cache is None:
+        return None
+    try:
+        return cache.get(await get_query_cache_key(configs))
+    finally:
+        cache.close()
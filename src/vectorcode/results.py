@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import sys
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+from vectorcode.cli_utils import Config, QueryInclude
+
+if TYPE_CHECKING:
+    # chromadb is slow to import, and this module is used before it's loaded.
+    from chromadb.api.types import QueryResult
+
+# number of the best-matching chunks that are kept for each file.
+MAX_CHUNKS_PER_FILE = 3
+
+
+@dataclass
+class Snippet:
+    """A chunk of a file that matched the query. Lines are 1-based and inclusive."""
+
+    text: str
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    # the smallest distance to any of the query chunks.
+    distance: float = 0.0
+
+
+def get_snippets(
+    results: "QueryResult", paths: Iterable[str], project_root: str
+) -> dict[str, list[Snippet]]:
+    """
+    The best-matching chunks (at most `MAX_CHUNKS_PER_FILE`) of each of
+    `paths` in the query results, best first. Empty if the results don't
+    include the documents.
+    """
+    assert results["metadatas"] is not None
+    assert results["distances"] is not None
+    snippets: dict[str, dict[tuple, Snippet]] = {path: {} for path in paths}
+    if results["documents"] is None:
+        # the documents weren't retrieved.
+        return {path: [] for path in snippets}
+    for metas, documents, distances in zip(
+        results["metadatas"], results["documents"], results["distances"]
+    ):
+        for meta, document, distance in zip(metas, documents, distances):
+            path = meta.get("path")
+            if path not in snippets:
+                continue
+            start_line = meta.get("start_line")
+            end_line = meta.get("end_line")
+            if start_line is None and document == os.path.relpath(
+                str(path), project_root
+            ):
+                # the path of the file, which is embedded along with the chunks.
+                continue
+            key = (start_line, end_line, document)
+            snippet = snippets[str(path)].get(key)
+            if snippet is None or distance < snippet.distance:
+                snippets[str(path)][key] = Snippet(
+                    document,
+                    None if start_line is None else int(start_line),
+                    None if end_line is None else int(end_line),
+                    float(distance),
+                )
+    return {
+        path: sorted(chunks.values(), key=lambda snippet: snippet.distance)[
+            :MAX_CHUNKS_PER_FILE
+        ]
+        for path, chunks in snippets.items()
+    }
+
+
+def locate_lines(content: str, text: str) -> Optional[tuple[int, int]]:
+    """The line range of the first occurrence of `text` in `content`."""
+    idx = content.find(text) if text else -1
+    if idx < 0:
+        return None
+    start_line = content.count("\n", 0, idx) + 1
+    return start_line, start_line + text.rstrip("\n").count("\n")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    A rough estimate of the number of tokens of `text` for a language model
+    (about 4 bytes per token), which doesn't depend on any tokenizer.
+    """
+    return math.ceil(len(text.encode()) / 4)
+
+
+def get_output_budgets(configs: Config) -> list[tuple[Callable[[str], int], int]]:
+    """The measures and the limits of the output set by `--max_bytes`/`--max_tokens`."""
+    budgets: list[tuple[Callable[[str], int], int]] = []
+    if configs.max_bytes > 0:
+        budgets.append((lambda text: len(text.encode()), configs.max_bytes))
+    if configs.max_tokens > 0:
+        budgets.append((estimate_tokens, configs.max_tokens))
+    return budgets
+
+
+def build_query_results(
+    configs: Config,
+    result_files: list[str],
+    snippets: Optional[dict[str, list[Snippet]]] = None,
+    projects: Optional[dict[str, str]] = None,
+) -> list[dict[str, Any]]:
+    """
+    Build the output of a query: a dictionary with the items in
+    `configs.include` for each file that still exists. For a query over
+    several projects, `projects` maps the files to the roots of their
+    projects, which are added to the dictionaries as `project`, and the
+    relative paths are relative to them.
+
+    If an output budget is set, the documents and chunks are packed into it:
+    the documents and the best chunk of each file go first (by the rank of
+    the file), then the second best chunk of each file, and so on. Pieces
+    that don't fit are left out, and so are the files that end up with
+    nothing but their paths.
+    """
+    include_document = QueryInclude.document in configs.include
+    include_chunk = QueryInclude.chunk in configs.include
+    entries: list[dict[str, Any]] = []
+    # (priority, index of the entry, key, value, text) of the pieces of content.
+    pieces: list[tuple[tuple[int, int], int, str, Any, str]] = []
+    for path in result_files:
+        if not os.path.isfile(path):
+            print(
+                f"{path} is no longer a valid file! Please re-run vectorcode vectorise to refresh the database.",
+                file=sys.stderr,
+            )
+            continue
+        project_root = str(configs.project_root)
+        if projects is not None:
+            project_root = projects[path]
+        if configs.use_absolute_path:
+            output_path = os.path.abspath(path)
+        else:
+            output_path = os.path.relpath(path, project_root)
+        idx = len(entries)
+        entries.append({"path": output_path})
+        if projects is not None:
+            entries[idx]["project"] = project_root
+        # the content with its line endings, which is what the chunks without
+        # line numbers (char mode) were cut from.
+        content = None
+        file_snippets = (snippets or {}).get(path, [])
+        if include_chunk and any(
+            snippet.start_line is None for snippet in file_snippets
+        ):
+            with open(path, newline="") as fin:
+                content = fin.read()
+        if include_document:
+            if content is None:
+                with open(path) as fin:
+                    document = fin.read()
+            else:
+                # the same as reading the file with universal newlines.
+                document = content.replace("\r\n", "\n").replace("\r", "\n")
+            pieces.append(((0, idx), idx, "document", document, document))
+        if include_chunk:
+            entries[idx]["chunk"] = []
+            for rank, snippet in enumerate(file_snippets):
+                chunk = {
+                    "start_line": snippet.start_line,
+                    "end_line": snippet.end_line,
+                    "text": snippet.text,
+                }
+                if snippet.start_line is None and content is not None:
+                    lines = locate_lines(content, snippet.text)
+                    if lines is not None:
+                        chunk["start_line"], chunk["end_line"] = lines
+                pieces.append(((rank, idx), idx, "chunk", chunk, snippet.text))
+
+    budgets = get_output_budgets(configs)
+    remaining = [limit for _, limit in budgets]
+    packed = set()
+    for _, idx, key, value, text in sorted(pieces, key=lambda piece: piece[0]):
+        costs = [measure(text) for measure, _ in budgets]
+        if any(cost > left for cost, left in zip(costs, remaining)):
+            continue
+        remaining = [left - cost for cost, left in zip(costs, remaining)]
+        packed.add(idx)
+        if key == "chunk":
+            entries[idx]["chunk"].append(value)
+        else:
+            entries[idx][key] = value
+
+    results = []
+    for idx, entry in enumerate(entries):
+        if budgets and (include_document or include_chunk) and idx not in packed:
+            continue
+        if "chunk" in entry:
+            entry["chunk"].sort(key=lambda chunk: chunk["start_line"] or 0)
+        result = {
+            str(key): entry[str(key)] for key in configs.include if str(key) in entry
+        }
+        if "project" in entry:
+            result["project"] = entry["project"]
+        results.append(result)
+    return results
+
+
+def format_chunks(chunks: list[dict[str, Any]]) -> str:
+    formatted = []
+    for chunk in chunks:
+        if chunk["start_line"] is None:
+            formatted.append(chunk["text"])
+        else:
+            formatted.append(
+                f"Lines {chunk['start_line']}-{chunk['end_line']}:\n{chunk['text']}"
+            )
+    return "\n\n".join(formatted)
+
+
+def print_query_results(
+    configs: Config,
+    result_files: list[str],
+    snippets: Optional[dict[str, list[Snippet]]] = None,
+    projects: Optional[dict[str, str]] = None,
+):
+    """Print the files of a query result in the format set by the configs."""
+    structured_result = build_query_results(configs, result_files, snippets, projects)
+
+    if configs.pipe:
+        print(json.dumps(structured_result))
+    else:
+        for idx, result in enumerate(structured_result):
+            if "project" in result:
+                print(f"Project: {result['project']}")
+            for include_item in configs.include:
+                value = result.get(include_item.value)
+                if value is None:
+                    continue
+                if include_item == QueryInclude.chunk:
+                    value = format_chunks(value)
+                print(f"{include_item.to_header()}{value}")
+            if idx != len(structured_result) - 1:
+                print()
+
+
+def dump_query_result(
+    result_files: list[str], snippets: dict[str, list[Snippet]]
+) -> dict[str, Any]:
+    """Convert a query result to a JSON value, for the query cache."""
+    return {
+        "files": result_files,
+        "snippets": {
+            path: [asdict(snippet) for snippet in file_snippets]
+            for path, file_snippets in snippets.items()
+        },
+    }
+
+
+def load_query_result(
+    value: dict[str, Any],
+) -> tuple[list[str], dict[str, list[Snippet]]]:
+    """The reverse of `dump_query_result`."""
+    return value["files"], {
+        path: [Snippet(**snippet) for snippet in file_snippets]
+        for path, file_snippets in value["snippets"].items()
+    }
@@ -6,5 +6,16 @@ from vectorcode.subcommands.ls import ls
 from vectorcode.subcommands.query import query
 from vectorcode.subcommands.update import update
 from vectorcode.subcommands.vectorise import vectorise
+from vectorcode.subcommands.watch import watch
 
-__all__ = ["drop", "init", "query", "ls", "vectorise", "check", "update", "clean"]
+__all__ = [
+    "drop",
+    "init",
+    "query",
+    "ls",
+    "vectorise",
+    "check",
+    "update",
+    "clean",
+    "watch",
+]
@@ -1,5 +1,6 @@
 from vectorcode.cli_utils import Config
-from vectorcode.common import get_client, get_collections
+from vectorcode.common import get_client, get_collections, remove_manifest
+from vectorcode.query_cache import bump_generation
 
 
 async def clean(configs: Config) -> int:
@@ -8,6 +9,8 @@ async def clean(configs: Config) -> int:
         meta = collection.metadata
         if await collection.count() == 0:
             await client.delete_collection(collection.name)
+            bump_generation(collection.name)
+            remove_manifest(collection.name)
             if not configs.pipe:
                 print(f"Deleted {meta['path']}.")
 
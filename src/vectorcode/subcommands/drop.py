@@ -1,7 +1,8 @@
 from chromadb.errors import InvalidCollectionException
 
 from vectorcode.cli_utils import Config
-from vectorcode.common import get_client, get_collection_name
+from vectorcode.common import get_client, get_collection_name, remove_manifest
+from vectorcode.query_cache import bump_generation
 
 
 async def drop(config: Config) -> int:
@@ -12,6 +13,8 @@ async def drop(config: Config) -> int:
         )
         collection_path = collection.metadata["path"]
         await client.delete_collection(collection.name)
+        bump_generation(collection.name)
+        remove_manifest(collection.name)
         print(f"Collection for {collection_path} has been deleted.")
         return 0
     except (ValueError, InvalidCollectionException):
@@ -1,129 +1,418 @@
-import json
 import os
+import sqlite3
 import sys
+from asyncio import Lock
+from dataclasses import dataclass, replace
+from typing import Optional
 
+from chromadb.api import AsyncClientAPI
 from chromadb.api.models.AsyncCollection import AsyncCollection
-from chromadb.api.types import IncludeEnum
+from chromadb.api.types import EmbeddingFunction, IncludeEnum, QueryResult
 from chromadb.errors import InvalidCollectionException, InvalidDimensionException
 
 from vectorcode.chunking import StringChunker
-from vectorcode.cli_utils import Config, expand_globs, expand_path
+from vectorcode.cli_utils import (
+    Config,
+    QueryInclude,
+    QueryMode,
+    expand_globs,
+    expand_path,
+)
 from vectorcode.common import (
+    get_cache_dir,
     get_client,
     get_collection,
+    get_collection_name,
+    get_embedding_cache,
+    get_embedding_function,
+    get_manifest,
     verify_ef,
 )
+from vectorcode.freshness import (
+    find_stale_files,
+    get_candidate_files,
+    start_background_update,
+)
+from vectorcode.lexical import fuse_lexical_result
+from vectorcode.query_cache import (
+    bump_generation,
+    get_query_cache,
+    get_query_cache_key,
+)
+from vectorcode.results import (
+    Snippet,
+    dump_query_result,
+    get_snippets,
+    load_query_result,
+    print_query_results,
+)
+from vectorcode.subcommands.vectorise import (
+    BatchWriter,
+    chunked_add,
+    get_chunker,
+    new_stats,
+    remove_paths,
+)
+
+from .reranker import RerankerBase
+
+# the least number of files from the vector search that are fused with the
+# lexical ranking in the `hybrid` mode.
+HYBRID_MIN_RANKED = 10
+# the least number of chunks retrieved for each query chunk, unless
+# `query_multiplier` is set.
+MIN_CANDIDATE_CHUNKS = 32
 
 
 async def get_query_result_files(
     collection: AsyncCollection, configs: Config
 ) -> list[str]:
+    result_files, _ = await get_query_result_snippets(collection, configs)
+    return result_files
+
+
+def get_query_chunks(configs: Config) -> list[str]:
     query_chunks = []
     if configs.query:
         chunker = StringChunker(configs.chunk_size, configs.overlap_ratio)
         for q in configs.query:
             query_chunks.extend(chunker.chunk(q))
+    return query_chunks
 
-    configs.query_exclude = [
-        expand_path(i, True)
+
+async def get_excluded_files(configs: Config) -> list[str]:
+    return [
+        str(expand_path(i, True))
         for i in await expand_globs(configs.query_exclude)
         if os.path.isfile(i)
     ]
-    if (await collection.count()) == 0:
+
+
+def get_reranker(configs: Config, query_chunks: list[str]) -> RerankerBase:
+    if configs.reranker is None:
+        from .reranker import NaiveReranker
+
+        return NaiveReranker(configs)
+    from .reranker import CrossEncoderReranker
+
+    return CrossEncoderReranker(
+        configs, query_chunks, configs.reranker, **configs.reranker_params
+    )
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """How the candidate chunks are retrieved for each query chunk."""
+
+    num_query: int
+    include_documents: bool
+
+    def get_include(self) -> list[IncludeEnum]:
+        include = [IncludeEnum.metadatas, IncludeEnum.distances]
+        if self.include_documents:
+            include.append(IncludeEnum.documents)
+        return include
+
+
+def plan_query(
+    configs: Config, collection_size: int, reranker: RerankerBase
+) -> QueryPlan:
+    """
+    Choose the number of chunks to retrieve for each query chunk: `n_result *
+    query_multiplier` if the multiplier is set, otherwise enough chunks for
+    the reranker to tell the best `n_result` files apart. The documents are
+    only retrieved if the reranker or the output needs them.
+    """
+    if configs.query_multiplier > 0:
+        num_query = int(configs.n_result * configs.query_multiplier)
+    else:
+        num_query = max(
+            get_num_ranked(configs) * reranker.candidates_per_file,
+            MIN_CANDIDATE_CHUNKS,
+        )
+    return QueryPlan(
+        num_query=max(1, min(num_query, collection_size)),
+        include_documents=reranker.needs_documents
+        or QueryInclude.chunk in configs.include,
+    )
+
+
+def widen_query(
+    plan: QueryPlan, results: QueryResult, num_ranked: int, collection_size: int
+) -> Optional[QueryPlan]:
+    """
+    A plan with twice as many candidates if the results have fewer distinct
+    files than `num_ranked`, and there are more chunks in the collection.
+    """
+    if plan.num_query >= collection_size:
+        return None
+    if len(get_candidate_files(results)) >= num_ranked:
+        return None
+    return replace(plan, num_query=min(2 * plan.num_query, collection_size))
+
+
+def get_num_ranked(configs: Config) -> int:
+    """
+    Number of files to be ranked by the reranker. With `hybrid`, more of them
+    are fused with the lexical ranking.
+    """
+    if configs.query_mode == QueryMode.hybrid:
+        return max(2 * configs.n_result, HYBRID_MIN_RANKED)
+    return configs.n_result
+
+
+def get_query_filter(query_exclude: list[str]) -> Optional[dict]:
+    if len(query_exclude):
+        return {"path": {"$nin": query_exclude}}
+    return None
+
+
+async def retrieve_files(
+    collection: AsyncCollection,
+    configs: Config,
+    embedding_function: Optional[EmbeddingFunction] = None,
+) -> Optional[tuple[QueryResult, list[str]]]:
+    """
+    Query the collection. Returns the retrieved chunks and the ranked files,
+    or None if nothing is found. The query is embedded once, with
+    `embedding_function` (created from the configs if not given).
+    """
+    query_chunks = get_query_chunks(configs)
+    configs.query_exclude = await get_excluded_files(configs)
+    collection_size = await collection.count()
+    if collection_size == 0:
         print("Empty collection!", file=sys.stderr)
-        return []
-    try:
-        num_query = await collection.count()
-        if configs.query_multiplier > 0:
-            num_query = min(
-                int(configs.n_result * configs.query_multiplier),
-                await collection.count(),
+        return None
+
+    reranker = get_reranker(configs, query_chunks)
+    num_ranked = get_num_ranked(configs)
+    if embedding_function is None:
+        embedding_function = get_embedding_function(configs)
+    # reused by the wider queries and the query after the refresh.
+    query_embeddings = embedding_function(query_chunks)
+
+    async def run_query() -> QueryResult:
+        plan: Optional[QueryPlan] = plan_query(configs, collection_size, reranker)
+        while True:
+            assert plan is not None
+            results = await collection.query(
+                query_embeddings=query_embeddings,
+                n_results=plan.num_query,
+                include=plan.get_include(),
+                where=get_query_filter(configs.query_exclude),
             )
-        if len(configs.query_exclude):
-            filtered_files = {"path": {"$nin": configs.query_exclude}}
-        else:
-            filtered_files = None
-        results = await collection.query(
-            query_texts=query_chunks,
-            n_results=num_query,
-            include=[
-                IncludeEnum.metadatas,
-                IncludeEnum.distances,
-                IncludeEnum.documents,
-            ],
-            where=filtered_files,
-        )
+            plan = widen_query(plan, results, num_ranked, collection_size)
+            if plan is None:
+                return results
+
+    try:
+        results = await run_query()
     except IndexError:
         # no results found
-        return []
+        return None
+    aggregated_results = reranker.rerank(results, n_result=num_ranked)
 
-    if configs.reranker is None:
-        from .reranker import NaiveReranker
+    if configs.refresh_budget >= 0 and await refresh_stale_files(
+        collection,
+        configs,
+        # the results go first, so that they're the ones that are re-embedded.
+        list(dict.fromkeys(aggregated_results + get_candidate_files(results))),
+    ):
+        # re-score with the new embeddings.
+        collection_size = await collection.count()
+        if collection_size == 0:
+            return None
+        try:
+            results = await run_query()
+        except IndexError:
+            return None
+        aggregated_results = reranker.rerank(results, n_result=num_ranked)
+    return results, aggregated_results
 
-        aggregated_results = NaiveReranker(configs).rerank(results)
-    else:
-        from .reranker import CrossEncoderReranker
 
-        aggregated_results = CrossEncoderReranker(
-            configs, query_chunks, configs.reranker, **configs.reranker_params
-        ).rerank(results)
-    return aggregated_results
+async def get_query_result_snippets(
+    collection: AsyncCollection,
+    configs: Config,
+    embedding_function: Optional[EmbeddingFunction] = None,
+) -> tuple[list[str], dict[str, list[Snippet]]]:
+    """
+    Query the collection. Returns the ranked files and the best-matching
+    chunks of each of them.
+    """
+    retrieved = await retrieve_files(collection, configs, embedding_function)
+    if retrieved is None:
+        return [], {}
+    results, aggregated_results = retrieved
+    snippets = get_snippets(
+        results,
+        aggregated_results,
+        str(expand_path(str(configs.project_root), True)),
+    )
+    if configs.query_mode == QueryMode.hybrid:
+        return await fuse_lexical_result(
+            collection.name, configs, aggregated_results, snippets
+        )
+    return aggregated_results, snippets
 
 
-async def query(configs: Config) -> int:
-    client = await get_client(configs)
+async def refresh_stale_files(
+    collection: AsyncCollection, configs: Config, candidates: list[str]
+) -> bool:
+    """
+    Re-embed the first `refresh_budget` of the candidates that have changed
+    since they were vectorised, and remove the ones that no longer exist. The
+    other stale candidates are left to a background `update`, unless the
+    database is served by a temporary chromadb that stops with this command.
+
+    Returns whether the collection has been modified.
+    """
+    manifest = get_manifest(collection, configs, reset=False)
+    if not manifest.is_valid:
+        # vectorised with other settings. re-embedding here would mix them up.
+        manifest.close()
+        return False
+    modified = False
     try:
-        collection = await get_collection(client, configs, False)
+        stale, deleted = find_stale_files(candidates, manifest)
+        refreshed = stale[: configs.refresh_budget]
+        queued = stale[configs.refresh_budget :]
+        if refreshed:
+            stats = new_stats()
+            stats_lock = Lock()
+            writer = BatchWriter(
+                collection,
+                Lock(),
+                stats,
+                stats_lock,
+                get_embedding_function(configs),
+                await (await get_client(configs)).get_max_batch_size(),
+                manifest,
+                get_embedding_cache(configs),
+            )
+            chunker = get_chunker(configs)
+            try:
+                for path in refreshed:
+                    await chunked_add(path, writer, stats, stats_lock, configs, chunker)
+                await writer.flush()
+                modified = stats["add"] + stats["update"] > 0
+            except Exception as e:
+                print(f"Failed to re-embed the stale files: {e}", file=sys.stderr)
+                queued = stale
+            finally:
+                await writer.close()
+        if deleted:
+            await remove_paths(collection, deleted)
+            manifest.remove(deleted)
+            modified = True
+        manifest.commit()
+    except sqlite3.OperationalError as e:
+        # the manifest is locked by a concurrent `watch` or `update`. The
+        # files are found stale again by the next query.
+        print(f"Failed to update the manifest: {e}", file=sys.stderr)
+        manifest.rollback()
+    finally:
+        manifest.close()
+    if modified:
+        bump_generation(collection.name)
+
+    if not queued:
+        return modified
+    if configs.temporary_server:
+        # the background update couldn't reach the temporary server, and it
+        # would start another one on the same database.
+        if not configs.pipe:
+            print(
+                f"{len(queued)} stale file(s) left. Run `vectorcode update` to refresh them.",
+                file=sys.stderr,
+            )
+    elif start_background_update(
+        str(expand_path(str(configs.project_root), True)),
+        os.path.join(get_cache_dir(collection.name), "refresh.lock"),
+    ):
+        if not configs.pipe:
+            print(
+                f"Updating {len(queued)} stale file(s) in the background.",
+                file=sys.stderr,
+            )
+    return modified
+
+
+async def open_collection(
+    configs: Config,
+    embedding_function: Optional[EmbeddingFunction] = None,
+    client: Optional[AsyncClientAPI] = None,
+) -> Optional[AsyncCollection]:
+    """Get the collection to be queried. Returns None if it can't be queried."""
+    if client is None:
+        client = await get_client(configs)
+    try:
+        collection = await get_collection(client, configs, False, embedding_function)
         if not verify_ef(collection, configs):
-            return 1
+            return None
     except (ValueError, InvalidCollectionException):
         print(
             f"There's no existing collection for {configs.project_root}",
             file=sys.stderr,
         )
-        return 1
+        return None
     except InvalidDimensionException:
         print(
             "The collection was embedded with a different embedding model.",
             file=sys.stderr,
         )
-        return 1
+        return None
     except IndexError:
         print(
             "Failed to get the collection. Please check your config.", file=sys.stderr
         )
-        return 1
+        return None
+    return collection
+
+
+async def query_collection(
+    configs: Config,
+) -> Optional[tuple[list[str], dict[str, list[Snippet]]]]:
+    """Run the query on the collection. Returns None if it can't be queried."""
+    embedding_function = get_embedding_function(configs)
+    collection = await open_collection(configs, embedding_function)
+    if collection is None:
+        return None
 
     if not configs.pipe:
         print("Starting querying...")
+    return await get_query_result_snippets(collection, configs, embedding_function)
+
 
-    structured_result = []
+async def query(configs: Config) -> int:
+    if configs.batch is not None:
+        from .batch import query_batch
 
-    for path in await get_query_result_files(collection, configs):
-        if os.path.isfile(path):
-            with open(path) as fin:
-                document = fin.read()
-            if configs.use_absolute_path:
-                output_path = os.path.abspath(path)
-            else:
-                output_path = os.path.relpath(path, configs.project_root)
+        return await query_batch(configs)
+    if configs.project_roots or configs.query_all:
+        from .fanout import query_projects
 
-            full_result = {"path": output_path, "document": document}
-            structured_result.append(
-                {str(key): full_result[str(key)] for key in configs.include}
-            )
-        else:
-            print(
-                f"{path} is no longer a valid file! Please re-run vectorcode vectorise to refresh the database.",
-                file=sys.stderr,
-            )
+        return await query_projects(configs)
 
-    if configs.pipe:
-        print(json.dumps(structured_result))
-    else:
-        for idx, result in enumerate(structured_result):
-            for include_item in configs.include:
-                print(f"{include_item.to_header()}{result.get(include_item.value)}")
-            if idx != len(structured_result) - 1:
-                print()
+    cache = get_query_cache(get_collection_name(str(configs.project_root)), configs)
+    try:
+        result = None
+        if cache is not None:
+            cache_key = await get_query_cache_key(configs)
+            # read before the query, so that a write during the query makes
+            # the result outdated.
+            generation = cache.generation
+            cached = cache.get(cache_key)
+            if cached is not None:
+                result = load_query_result(cached)
+        if result is None:
+            result = await query_collection(configs)
+            if result is None:
+                return 1
+            if cache is not None:
+                cache.put(cache_key, generation, dump_query_result(*result), result[0])
+    finally:
+        if cache is not None:
+            cache.close()
+
+    print_query_results(configs, *result)
     return 0
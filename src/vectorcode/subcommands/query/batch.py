@@ -0,0 +1,300 @@
+import json
+import sys
+from dataclasses import replace
+from typing import IO, Any, Iterator, Optional
+
+from chromadb.api.models.AsyncCollection import AsyncCollection
+from chromadb.api.types import EmbeddingFunction, QueryResult
+
+from vectorcode.cli_utils import Config, QueryInclude, QueryMode, expand_path
+from vectorcode.common import get_embedding_function
+from vectorcode.lexical import fuse_lexical_result, get_lexical_result
+from vectorcode.query_cache import QueryCache, get_query_cache, get_query_cache_key
+from vectorcode.results import (
+    Snippet,
+    build_query_results,
+    dump_query_result,
+    get_snippets,
+    load_query_result,
+)
+
+from . import (
+    QueryPlan,
+    get_excluded_files,
+    get_num_ranked,
+    get_query_chunks,
+    get_query_filter,
+    get_reranker,
+    open_collection,
+    plan_query,
+    widen_query,
+)
+from .reranker import RerankerBase
+
+# the items of a `QueryResult` that have one entry for each query chunk.
+PER_QUERY_KEYS = (
+    "ids",
+    "embeddings",
+    "documents",
+    "uris",
+    "data",
+    "metadatas",
+    "distances",
+)
+# number of query specs that are read, embedded and answered together.
+BATCH_SIZE = 64
+
+
+def get_spec_configs(configs: Config, spec: Any) -> Config:
+    """
+    The configs of a query spec (a line of the batch file). Raise ValueError
+    if the spec is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("A query spec should be a JSON object.")
+    query = spec.get("query")
+    if isinstance(query, str):
+        query = [query]
+    if (
+        not isinstance(query, list)
+        or len(query) == 0
+        or not all(isinstance(q, str) and q for q in query)
+    ):
+        raise ValueError("`query` should be a non-empty string or a list of them.")
+    updates: dict[str, Any] = {"query": query, "batch": None}
+    for key, field_name in (
+        ("n", "n_result"),
+        ("max_bytes", "max_bytes"),
+        ("max_tokens", "max_tokens"),
+    ):
+        if key in spec:
+            if not isinstance(spec[key], int):
+                raise ValueError(f"`{key}` should be an integer.")
+            updates[field_name] = spec[key]
+    if "exclude" in spec:
+        if not isinstance(spec["exclude"], list):
+            raise ValueError("`exclude` should be a list of paths.")
+        updates["query_exclude"] = list(spec["exclude"])
+    if "include" in spec:
+        if not isinstance(spec["include"], list):
+            raise ValueError("`include` should be a list.")
+        updates["include"] = [QueryInclude(i) for i in spec["include"]]
+    return replace(configs, **updates)
+
+
+def read_specs(
+    fin: IO[str], configs: Config
+) -> Iterator[tuple[Any, Config | Exception]]:
+    """Yield the ID and the configs (or the error) of each spec in the file."""
+    for line in fin:
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield None, ValueError(f"Invalid JSON: {e}")
+            continue
+        spec_id = spec.get("id") if isinstance(spec, dict) else None
+        try:
+            yield spec_id, get_spec_configs(configs, spec)
+        except ValueError as e:
+            yield spec_id, e
+
+
+def split_query_result(results: QueryResult, counts: list[int]) -> list[QueryResult]:
+    """
+    Split the result of a query with several queries' chunks into one result
+    for each query, which had `counts` chunks respectively.
+    """
+    splits = []
+    start = 0
+    for count in counts:
+        splits.append(
+            QueryResult(
+                **{
+                    key: value[start : start + count]
+                    if key in PER_QUERY_KEYS and value is not None
+                    else value
+                    for key, value in results.items()
+                }
+            )
+        )
+        start += count
+    return splits
+
+
+async def answer_specs(
+    collection: AsyncCollection,
+    collection_size: int,
+    embedding_function: EmbeddingFunction,
+    reranker: RerankerBase,
+    specs: list[Config],
+) -> list[tuple[list[str], dict[str, list[Snippet]]] | Exception]:
+    """
+    Answer the queries. The chunks of all queries are embedded in one go, and
+    the queries with the same plan and filter are sent to the database
+    together.
+    """
+    answers: list[Any] = [([], {}) for _ in specs]
+    query_chunks = [get_query_chunks(spec) for spec in specs]
+    all_chunks = [chunk for chunks in query_chunks for chunk in chunks]
+    if collection_size == 0 or not all_chunks:
+        return answers
+    embeddings = embedding_function(all_chunks)
+    offsets = [0]
+    for chunks in query_chunks:
+        offsets.append(offsets[-1] + len(chunks))
+
+    groups: dict[tuple[QueryPlan, str], list[int]] = {}
+    for idx, spec in enumerate(specs):
+        if not query_chunks[idx]:
+            continue
+        spec.query_exclude = await get_excluded_files(spec)
+        key = (
+            plan_query(spec, collection_size, reranker),
+            json.dumps(get_query_filter(spec.query_exclude)),
+        )
+        groups.setdefault(key, []).append(idx)
+
+    project_root = str(expand_path(str(specs[0].project_root), True))
+    while groups:
+        # the queries that get too few files, with wider plans.
+        widened: dict[tuple[QueryPlan, str], list[int]] = {}
+        for (plan, where), indices in groups.items():
+            try:
+                results = await collection.query(
+                    query_embeddings=[
+                        embeddings[i]
+                        for idx in indices
+                        for i in range(offsets[idx], offsets[idx + 1])
+                    ],
+                    n_results=plan.num_query,
+                    include=plan.get_include(),
+                    where=json.loads(where),
+                )
+            except IndexError:
+                # no results found
+                continue
+            except Exception as e:
+                for idx in indices:
+                    answers[idx] = e
+                continue
+            for idx, result in zip(
+                indices,
+                split_query_result(
+                    results, [len(query_chunks[idx]) for idx in indices]
+                ),
+            ):
+                num_ranked = get_num_ranked(specs[idx])
+                wider_plan = widen_query(plan, result, num_ranked, collection_size)
+                if wider_plan is not None:
+                    widened.setdefault((wider_plan, where), []).append(idx)
+                    continue
+                try:
+                    files = reranker.rerank(
+                        result, n_result=num_ranked, query_chunks=query_chunks[idx]
+                    )
+                    answers[idx] = (files, get_snippets(result, files, project_root))
+                    if specs[idx].query_mode == QueryMode.hybrid:
+                        answers[idx] = await fuse_lexical_result(
+                            collection.name, specs[idx], *answers[idx]
+                        )
+                except Exception as e:
+                    answers[idx] = e
+        groups = widened
+    return answers
+
+
+async def query_batch(configs: Config) -> int:
+    """
+    Answer the queries in the JSONL file `configs.batch` (`-` for stdin), and
+    print one JSON object for each of them, in the same order. The embedding
+    model, the collection and the reranker are loaded once for all queries.
+
+    Returns 1 if any of the queries failed.
+    """
+    embedding_function = get_embedding_function(configs)
+    collection = await open_collection(configs, embedding_function)
+    if collection is None:
+        return 1
+    collection_size = await collection.count()
+    if collection_size == 0:
+        print("Empty collection!", file=sys.stderr)
+    reranker = get_reranker(configs, [])
+    cache = get_query_cache(collection.name, configs)
+
+    return_code = 0
+    fin = sys.stdin if configs.batch == "-" else open(str(configs.batch))
+    try:
+        batch: list[tuple[Any, Config | Exception]] = []
+        for item in read_specs(fin, configs):
+            batch.append(item)
+            if len(batch) < BATCH_SIZE:
+                continue
+            if not await run_batch(
+                collection, collection_size, embedding_function, reranker, cache, batch
+            ):
+                return_code = 1
+            batch = []
+        if batch and not await run_batch(
+            collection, collection_size, embedding_function, reranker, cache, batch
+        ):
+            return_code = 1
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if cache is not None:
+            cache.close()
+    return return_code
+
+
+async def run_batch(
+    collection: AsyncCollection,
+    collection_size: int,
+    embedding_function: EmbeddingFunction,
+    reranker: RerankerBase,
+    cache: Optional[QueryCache],
+    batch: list[tuple[Any, Config | Exception]],
+) -> bool:
+    """Answer and print a batch of specs. Returns False if any of them failed."""
+    answers: list[Any] = [None] * len(batch)
+    keys: list[Optional[str]] = [None] * len(batch)
+    generation = cache.generation if cache is not None else 0
+    missed: list[int] = []
+    for idx, (_, spec) in enumerate(batch):
+        if isinstance(spec, Exception):
+            answers[idx] = spec
+            continue
+        if cache is not None:
+            keys[idx] = await get_query_cache_key(spec)
+            cached = cache.get(keys[idx])
+            if cached is not None:
+                answers[idx] = load_query_result(cached)
+                continue
+        answers[idx] = await get_lexical_result(spec)
+        if answers[idx] is None:
+            missed.append(idx)
+
+    if missed:
+        specs = [batch[idx][1] for idx in missed]
+        for idx, answer in zip(
+            missed,
+            await answer_specs(
+                collection, collection_size, embedding_function, reranker, specs
+            ),
+        ):
+            answers[idx] = answer
+            if cache is not None and not isinstance(answer, Exception):
+                cache.put(keys[idx], generation, dump_query_result(*answer), answer[0])
+
+    ok = True
+    for (spec_id, spec), answer in zip(batch, answers):
+        output: dict[str, Any] = {} if spec_id is None else {"id": spec_id}
+        if isinstance(answer, Exception):
+            ok = False
+            output["error"] = str(answer)
+        else:
+            output["results"] = build_query_results(spec, *answer)
+        sys.stdout.write(json.dumps(output) + "\n")
+    sys.stdout.flush()
+    return ok
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import sys
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from chromadb.api import AsyncClientAPI
+from chromadb.api.types import EmbeddingFunction, QueryResult
+
+from vectorcode.cli_utils import Config, QueryMode, expand_path, load_project_config
+from vectorcode.common import get_client, get_collections, get_embedding_function
+from vectorcode.lexical import fuse_lexical_result
+from vectorcode.results import Snippet, get_snippets, print_query_results
+
+from . import open_collection, retrieve_files
+
+# the options of the command that apply to all projects. The others (the
+# database, the embedding function and the chunking) come from the configs of
+# each project, because they have to match how the project was vectorised.
+SHARED_OPTIONS = (
+    "action",
+    "query",
+    "n_result",
+    "query_multiplier",
+    "query_mode",
+    "query_exclude",
+    "include",
+    "max_bytes",
+    "max_tokens",
+    "reranker",
+    "reranker_params",
+    "use_absolute_path",
+    "pipe",
+)
+# the database options that are shared when the command started its own
+# chromadb, which the projects' configs don't know about.
+TEMPORARY_SERVER_OPTIONS = ("host", "port", "db_settings", "temporary_server")
+
+
+@dataclass
+class ProjectResult:
+    project_root: str
+    files: list[str]
+    snippets: dict[str, list[Snippet]]
+    # the smallest distance of each retrieved file to the query.
+    distances: dict[str, float]
+    # the embedding function and its parameters, which the distances depend on.
+    embedding: str
+
+
+def get_file_distances(results: QueryResult) -> dict[str, float]:
+    """The smallest distance of any chunk of each file to any query chunk."""
+    assert results["metadatas"] is not None
+    assert results["distances"] is not None
+    distances: dict[str, float] = {}
+    for metas, chunk_distances in zip(results["metadatas"], results["distances"]):
+        for meta, distance in zip(metas, chunk_distances):
+            path = meta.get("path")
+            if path is not None:
+                distances[str(path)] = min(
+                    distances.get(str(path), float("inf")), float(distance)
+                )
+    return distances
+
+
+def split_refresh_budget(refresh_budget: int, num_projects: int) -> list[int]:
+    """
+    The refresh budget of each project, so that the projects re-embed no more
+    than `refresh_budget` files in total. The earlier projects get the rest of
+    the division.
+    """
+    if refresh_budget < 0 or num_projects == 0:
+        return [refresh_budget] * num_projects
+    quotient, remainder = divmod(refresh_budget, num_projects)
+    return [quotient + (1 if idx < remainder else 0) for idx in range(num_projects)]
+
+
+def merge_project_results(
+    project_results: list[ProjectResult], n_result: int
+) -> tuple[list[str], dict[str, list[Snippet]], dict[str, str]]:
+    """
+    Merge the ranked files of the projects by the distances of their best
+    chunks. The distances of projects that use different embedding functions
+    aren't comparable, so they're rescaled to [0, 1] in each project first.
+    The order of the files of each project is kept.
+
+    Returns the files, their snippets and the roots of their projects.
+    """
+    normalize = len({result.embedding for result in project_results}) > 1
+    scored: list[tuple[float, int, str, ProjectResult]] = []
+    for result in project_results:
+        low = min(result.distances.values(), default=0.0)
+        high = max(result.distances.values(), default=0.0)
+        score = float("-inf")
+        for rank, path in enumerate(result.files):
+            # files that only the lexical index found (with `hybrid`).
+            distance = result.distances.get(path, high)
+            if normalize:
+                distance = (distance - low) / ((high - low) or 1.0)
+            # a file can't be scored better than the ones ranked above it.
+            score = max(score, distance)
+            scored.append((score, rank, path, result))
+
+    files: list[str] = []
+    snippets: dict[str, list[Snippet]] = {}
+    projects: dict[str, str] = {}
+    for _, _, path, result in sorted(scored, key=lambda item: item[:2]):
+        if len(files) == n_result:
+            break
+        if path in projects:
+            # in nested projects.
+            continue
+        files.append(path)
+        snippets[path] = result.snippets.get(path, [])
+        projects[path] = result.project_root
+    return files, snippets, projects
+
+
+async def query_project(
+    configs: Config,
+    client: AsyncClientAPI,
+    embedding_function: EmbeddingFunction,
+) -> Optional[ProjectResult]:
+    collection = await open_collection(configs, embedding_function, client)
+    if collection is None:
+        return None
+    retrieved = await retrieve_files(collection, configs, embedding_function)
+    project_root = str(expand_path(str(configs.project_root), True))
+    embedding = json.dumps(
+        [configs.embedding_function, configs.embedding_params], sort_keys=True
+    )
+    if retrieved is None:
+        return ProjectResult(project_root, [], {}, {}, embedding)
+    results, files = retrieved
+    snippets = get_snippets(results, files, project_root)
+    if configs.query_mode == QueryMode.hybrid:
+        files, snippets = await fuse_lexical_result(
+            collection.name, configs, files, snippets
+        )
+    return ProjectResult(
+        project_root, files, snippets, get_file_distances(results), embedding
+    )
+
+
+async def get_project_configs(configs: Config) -> list[Config]:
+    """
+    The configs of each project to be queried: the listed projects, or all
+    projects in the database with `query_all`. If the command started its own
+    chromadb, all projects are queried on it.
+    """
+    roots = [str(expand_path(str(root), True)) for root in configs.project_roots]
+    if configs.query_all:
+        client = await get_client(configs)
+        roots = [
+            str(collection.metadata["path"])
+            async for collection in get_collections(client)
+        ]
+    roots = list(dict.fromkeys(roots))
+    shared_options = SHARED_OPTIONS
+    if configs.temporary_server:
+        shared_options += TEMPORARY_SERVER_OPTIONS
+    project_configs = []
+    for root, refresh_budget in zip(
+        roots, split_refresh_budget(configs.refresh_budget, len(roots))
+    ):
+        project_config = await load_project_config(root)
+        project_config.project_root = root
+        project_configs.append(
+            replace(
+                project_config,
+                **{name: getattr(configs, name) for name in shared_options},
+                refresh_budget=refresh_budget,
+            )
+        )
+    return project_configs
+
+
+async def query_projects(configs: Config) -> int:
+    """
+    Query several projects concurrently, and print the merged results. The
+    projects on the same database share a client, and the projects with the
+    same embedding function share an instance of it.
+
+    Returns 1 if none of the projects could be queried.
+    """
+    try:
+        project_configs = await get_project_configs(configs)
+    except IOError as e:
+        print(f"Failed to load the configs: {e}", file=sys.stderr)
+        return 1
+    if not project_configs:
+        print("There's no project to query.", file=sys.stderr)
+        return 1
+
+    clients: dict[tuple, AsyncClientAPI] = {}
+    embedding_functions: dict[str, EmbeddingFunction] = {}
+    tasks = []
+    for project_config in project_configs:
+        client_key = (
+            project_config.host,
+            project_config.port,
+            json.dumps(project_config.db_settings, sort_keys=True),
+        )
+        if client_key not in clients:
+            clients[client_key] = await get_client(project_config)
+        ef_key = json.dumps(
+            [project_config.embedding_function, project_config.embedding_params],
+            sort_keys=True,
+        )
+        if ef_key not in embedding_functions:
+            embedding_functions[ef_key] = get_embedding_function(project_config)
+        tasks.append(
+            query_project(
+                project_config, clients[client_key], embedding_functions[ef_key]
+            )
+        )
+
+    project_results = []
+    for project_config, result in zip(
+        project_configs, await asyncio.gather(*tasks, return_exceptions=True)
+    ):
+        if isinstance(result, BaseException):
+            print(
+                f"Failed to query {project_config.project_root}: {result}",
+                file=sys.stderr,
+            )
+        elif result is not None:
+            project_results.append(result)
+    if not project_results:
+        return 1
+
+    files, snippets, projects = merge_project_results(project_results, configs.n_result)
+    print_query_results(configs, files, snippets, projects)
+    return 0
@@ -1,7 +1,7 @@
 import heapq
 from abc import abstractmethod
 from collections import defaultdict
-from typing import Any, DefaultDict
+from typing import Any, DefaultDict, Optional
 
 import numpy
 from chromadb.api.types import QueryResult
@@ -10,11 +10,27 @@ from vectorcode.cli_utils import Config
 
 
 class RerankerBase:
+    """
+    Rank the files in the query results. `n_result` and `query_chunks` can be
+    overridden in each call to `rerank`, so that one instance (and one loaded
+    model) can serve many queries.
+    """
+
+    # whether `rerank` reads the documents of the chunks.
+    needs_documents = False
+    # number of chunks retrieved for each file to be ranked (see `plan_query`).
+    candidates_per_file = 10
+
     def __init__(self, configs: Config, **kwargs: Any):
         self.n_result = configs.n_result
 
     @abstractmethod
-    def rerank(self, results: QueryResult) -> list[str]:
+    def rerank(
+        self,
+        results: QueryResult,
+        n_result: Optional[int] = None,
+        query_chunks: Optional[list[str]] = None,
+    ) -> list[str]:
         raise NotImplementedError
 
 
@@ -22,7 +38,12 @@ class NaiveReranker(RerankerBase):
     def __init__(self, configs: Config, **kwargs: Any):
         super().__init__(configs)
 
-    def rerank(self, results: QueryResult) -> list[str]:
+    def rerank(
+        self,
+        results: QueryResult,
+        n_result: Optional[int] = None,
+        query_chunks: Optional[list[str]] = None,
+    ) -> list[str]:
         assert results["metadatas"] is not None
         assert results["distances"] is not None
         documents: DefaultDict[str, list[float]] = defaultdict(list)
@@ -39,11 +60,17 @@ class NaiveReranker(RerankerBase):
                 documents[path].append(distance)
 
         return heapq.nsmallest(
-            self.n_result, documents.keys(), lambda x: float(numpy.mean(documents[x]))
+            n_result or self.n_result,
+            documents.keys(),
+            lambda x: float(numpy.mean(documents[x])),
         )
 
 
 class CrossEncoderReranker(RerankerBase):
+    needs_documents = True
+    # every candidate is scored by the model, so fewer of them are retrieved.
+    candidates_per_file = 4
+
     def __init__(
         self, configs: Config, query_chunks: list[str], model_name: str, **kwargs: Any
     ):
@@ -53,15 +80,22 @@ class CrossEncoderReranker(RerankerBase):
         self.model = CrossEncoder(model_name, **kwargs)
         self.query_chunks = query_chunks
 
-    def rerank(self, results: QueryResult) -> list[str]:
+    def rerank(
+        self,
+        results: QueryResult,
+        n_result: Optional[int] = None,
+        query_chunks: Optional[list[str]] = None,
+    ) -> list[str]:
         assert results["metadatas"] is not None
         assert results["documents"] is not None
+        if query_chunks is None:
+            query_chunks = self.query_chunks
         documents: DefaultDict[str, list[float]] = defaultdict(list)
-        for query_chunk_idx in range(len(self.query_chunks)):
+        for query_chunk_idx in range(len(query_chunks)):
             chunk_metas = results["metadatas"][query_chunk_idx]
             chunk_docs = results["documents"][query_chunk_idx]
             ranks = self.model.rank(
-                self.query_chunks[query_chunk_idx], chunk_docs, apply_softmax=True
+                query_chunks[query_chunk_idx], chunk_docs, apply_softmax=True
             )
             for rank in ranks:
                 documents[chunk_metas[rank["corpus_id"]]["path"]].append(
@@ -69,7 +103,7 @@ class CrossEncoderReranker(RerankerBase):
                 )
 
         return heapq.nlargest(
-            self.n_result,
+            n_result or self.n_result,
             documents.keys(),
             key=lambda x: float(numpy.mean(documents[x])),
         )
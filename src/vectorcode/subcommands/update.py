@@ -1,15 +1,94 @@
-import asyncio
 import os
 import sys
 from asyncio import Lock
+from typing import Iterable
 
-import tqdm
-from chromadb.api.types import IncludeEnum
+from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.errors import InvalidCollectionException
 
-from vectorcode.cli_utils import Config
-from vectorcode.common import get_client, get_collection, verify_ef
-from vectorcode.subcommands.vectorise import chunked_add, show_stats
+from vectorcode.cli_utils import LAST_INDEXED_COMMIT, Config, expand_path
+from vectorcode.common import (
+    get_bulk_embedding_function,
+    get_client,
+    get_collection,
+    get_embedding_cache,
+    get_manifest,
+    record_git_commit,
+    verify_ef,
+)
+from vectorcode.embedding_pool import EmbeddingPool
+from vectorcode.git import GitChanges, get_changes, get_head
+from vectorcode.manifest import Manifest
+from vectorcode.query_cache import bump_generation
+from vectorcode.subcommands.vectorise import (
+    METADATA_PAGE_SIZE,
+    BatchWriter,
+    add_files,
+    get_chunker,
+    get_collection_paths,
+    new_stats,
+    remove_paths,
+    show_stats,
+    split_orphanes,
+)
+from vectorcode.walker import is_in_dir, iter_files
+
+
+async def get_indexed_paths(
+    collection: AsyncCollection,
+    manifest: Manifest,
+    paths: Iterable[str],
+    page_size: int,
+    batch_size: int = 512,
+) -> set[str]:
+    """
+    The paths that have been vectorised. They're looked up in the manifest
+    first, and the rest in the collection (which may have been vectorised
+    before the manifest was kept, or with other settings).
+    """
+    indexed: set[str] = set()
+    unknown: list[str] = []
+    for path in paths:
+        if manifest.get(path) is not None:
+            indexed.add(path)
+        else:
+            unknown.append(path)
+    for idx in range(0, len(unknown), batch_size):
+        indexed.update(
+            await get_collection_paths(
+                collection,
+                page_size,
+                where={"path": {"$in": unknown[idx : idx + batch_size]}},
+            )
+        )
+    return indexed
+
+
+async def get_changed_files(
+    collection: AsyncCollection,
+    manifest: Manifest,
+    changes: GitChanges,
+    project_root: str,
+    page_size: int,
+) -> list[str]:
+    """
+    The files in the project that git reports as changed and that have been
+    vectorised, including the new paths of the vectorised files that have been
+    renamed. Like `update` without `--since`, new files are left to `vectorise`.
+    """
+    changed = sorted(path for path in changes.changed if is_in_dir(path, project_root))
+    indexed = await get_indexed_paths(
+        collection,
+        manifest,
+        changed
+        + [changes.renamed[path] for path in changed if path in changes.renamed],
+        page_size,
+    )
+    return [
+        path
+        for path in changed
+        if path in indexed or changes.renamed.get(path) in indexed
+    ]
 
 
 async def update(configs: Config) -> int:
@@ -28,50 +107,83 @@ async def update(configs: Config) -> int:
     if collection is None or not verify_ef(collection, configs):
         return 1
 
-    metas = (await collection.get(include=[IncludeEnum.metadatas]))["metadatas"]
-    if metas is None:
-        return 0
-    files_gen = (str(meta.get("path", "")) for meta in metas)
-    files = set()
-    orphanes = set()
-    for file in files_gen:
-        if os.path.isfile(file):
-            files.add(file)
-        else:
-            orphanes.add(file)
+    project_root = str(expand_path(str(configs.project_root), True))
+    head = await get_head(project_root)
+    manifest = get_manifest(collection, configs)
+    max_batch_size = await client.get_max_batch_size()
+    changes = None
+    if configs.since is not None:
+        since = configs.since
+        if since == LAST_INDEXED_COMMIT:
+            since = (collection.metadata or {}).get("git_commit")
+        if since:
+            changes = await get_changes(project_root, str(since))
+        if changes is not None:
+            # files with uncommitted changes at the last update.
+            for path in manifest.get_value("git_dirty") or []:
+                if os.path.isfile(path):
+                    changes.changed.add(path)
+                else:
+                    changes.deleted.add(path)
+        if changes is None:
+            print(
+                "Failed to find the changes in git. Updating all files instead.",
+                file=sys.stderr,
+            )
+    page_size = min(max_batch_size, METADATA_PAGE_SIZE)
+    if changes is not None:
+        # only the indexed files that git reports as changed. Like a full
+        # update, the ignore rules don't apply, so that files vectorised with
+        # `--force` are kept up to date.
+        files = iter_files(
+            await get_changed_files(
+                collection, manifest, changes, project_root, page_size
+            )
+        )
+        orphanes = {path for path in changes.deleted if is_in_dir(path, project_root)}
+    else:
+        files, orphanes = await split_orphanes(
+            await get_collection_paths(collection, page_size)
+        )
 
-    stats = {"add": 0, "update": 0, "removed": len(orphanes)}
+    stats = new_stats(removed=len(orphanes))
     collection_lock = Lock()
     stats_lock = Lock()
-    max_batch_size = await client.get_max_batch_size()
+    chunker = get_chunker(configs)
+    embedding_function = get_bulk_embedding_function(configs)
+    writer = BatchWriter(
+        collection,
+        collection_lock,
+        stats,
+        stats_lock,
+        embedding_function,
+        max_batch_size,
+        manifest,
+        get_embedding_cache(configs),
+        max_pending_chunks=configs.max_pending_chunks,
+        max_pending_bytes=configs.max_pending_bytes,
+    )
 
-    with tqdm.tqdm(
-        total=len(files), desc="Vectorising files...", disable=configs.pipe
-    ) as bar:
-        try:
-            tasks = [
-                asyncio.create_task(
-                    chunked_add(
-                        str(file),
-                        collection,
-                        collection_lock,
-                        stats,
-                        stats_lock,
-                        configs,
-                        max_batch_size,
-                    )
-                )
-                for file in files
-            ]
-            for task in asyncio.as_completed(tasks):
-                await task
-                bar.update(1)
-        except asyncio.CancelledError:
-            print("Abort.", file=sys.stderr)
-            return 1
+    completed = False
+    try:
+        completed = await add_files(files, writer, stats, stats_lock, configs, chunker)
+    finally:
+        if isinstance(embedding_function, EmbeddingPool):
+            embedding_function.close()
+        if not completed or stats["add"] or stats["update"]:
+            # an interrupted run may have written some of the chunks.
+            bump_generation(collection.name)
+    if not completed:
+        manifest.close()
+        return 1
 
-    if len(orphanes):
-        await collection.delete(where={"path": {"$in": list(orphanes)}})
+    await remove_paths(collection, orphanes)
+    manifest.remove(orphanes)
+    if orphanes:
+        bump_generation(collection.name)
+    if head is not None:
+        await record_git_commit(collection, manifest, project_root, head)
+    manifest.close()
 
     show_stats(configs, stats)
     return 0
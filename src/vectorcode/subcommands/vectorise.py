@@ -1,20 +1,58 @@
 import asyncio
 import hashlib
+import itertools
 import json
 import os
 import sys
-import uuid
+import threading
+import time
 from asyncio import Lock
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Sized, TextIO
 
-import pathspec
+import chromadb
 import tabulate
 import tqdm
 from chromadb.api.models.AsyncCollection import AsyncCollection
 from chromadb.api.types import IncludeEnum
 
-from vectorcode.chunking import FileChunker
-from vectorcode.cli_utils import Config, expand_globs, expand_path
-from vectorcode.common import get_client, get_collection, verify_ef
+from vectorcode.chunking import (
+    Chunk,
+    ChunkerBase,
+    FileChunker,
+    LineChunker,
+    TokenChunker,
+    count_truncated_chars,
+)
+from vectorcode.cli_utils import ChunkMode, Config, expand_path
+from vectorcode.common import (
+    get_bulk_embedding_function,
+    get_client,
+    get_collection,
+    get_embedding_cache,
+    get_embedding_function,
+    get_embedding_tokenizer,
+    get_manifest,
+    record_git_commit,
+    verify_ef,
+)
+from vectorcode.embedding_cache import EmbeddingCache
+from vectorcode.embedding_pool import EmbeddingPool
+from vectorcode.filters import should_skip
+from vectorcode.git import get_head
+from vectorcode.manifest import Fingerprint, Manifest, is_stat_unchanged
+from vectorcode.priority import (
+    IndexProgress,
+    get_hot_files,
+    get_priority_signals,
+    prioritise,
+)
+from vectorcode.query_cache import bump_generation
+from vectorcode.walker import IgnoreMatcher, is_walked, iter_files, read_path_list
 
 
 def hash_str(string: str) -> str:
@@ -22,79 +60,944 @@ def hash_str(string: str) -> str:
     return hashlib.sha256(string.encode()).hexdigest()
 
 
-def get_uuid() -> str:
-    return uuid.uuid4().hex
+def get_chunk_id(path: str, sha256: str, occurrence: int = 0) -> str:
+    """
+    Deterministic ID of a chunk, so that a chunk that hasn't changed keeps its
+    ID when the file is vectorised again. `occurrence` tells apart identical
+    chunks in the same file.
+    """
+    return hash_str(f"{path}\0{sha256}\0{occurrence}")
+
+
+def get_chunk_entry(chunk: Chunk | str, full_path: str) -> tuple[str, dict]:
+    """Return the document and the metadata to be stored for a chunk."""
+    if isinstance(chunk, Chunk):
+        return chunk.text, {
+            "path": full_path,
+            "start_line": chunk.start_line,
+            "end_line": chunk.end_line,
+            "start_byte": chunk.start_byte,
+            "end_byte": chunk.end_byte,
+        }
+    return chunk, {"path": full_path}
+
+
+def locate_chunks(
+    chunks: list[Chunk | str], step_size: int
+) -> list[Optional[tuple[int, int]]]:
+    """
+    The byte offsets of the chunks that are plain strings (from `FileChunker`,
+    which starts a chunk every `step_size` characters). None for the chunks
+    that carry their own offsets.
+    """
+    offsets: list[Optional[tuple[int, int]]] = []
+    # the start of the next string chunk, in bytes.
+    byte_pos = 0
+    for chunk in chunks:
+        if isinstance(chunk, Chunk):
+            offsets.append(None)
+            continue
+        offsets.append((byte_pos, byte_pos + len(chunk.encode())))
+        byte_pos += len(chunk[:step_size].encode())
+    return offsets
+
+
+class HashingReader:
+    """
+    A text stream that hashes what is read from it, so that a file can be
+    hashed (like `hash_str` of its content) while it's being chunked.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.__stream = stream
+        self.__hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> str:
+        text = self.__stream.read(size)
+        self.__hash.update(text.encode())
+        return text
+
+    def __iter__(self) -> "HashingReader":
+        return self
+
+    def __next__(self) -> str:
+        line = next(self.__stream)
+        self.__hash.update(line.encode())
+        return line
+
+    def hexdigest(self) -> str:
+        """The hash of the content, after the rest of the stream is read."""
+        while self.read(1 << 16):
+            pass
+        return self.__hash.hexdigest()
+
+
+def get_chunker(configs: Config) -> ChunkerBase:
+    match configs.chunk_mode:
+        case ChunkMode.token:
+            tokenizer = get_embedding_tokenizer(get_embedding_function(configs))
+            if tokenizer is not None:
+                tokenizer, max_tokens = tokenizer
+                chunk_size = max_tokens
+                if configs.chunk_size > 0:
+                    chunk_size = min(configs.chunk_size, max_tokens)
+                return TokenChunker(tokenizer, chunk_size, configs.overlap_ratio)
+            print(
+                f"{configs.embedding_function} doesn't expose its tokenizer. Falling back to line mode.",
+                file=sys.stderr,
+            )
+            return LineChunker(configs.chunk_size, configs.overlap_ratio)
+        case ChunkMode.line:
+            return LineChunker(configs.chunk_size, configs.overlap_ratio)
+        case _:
+            return FileChunker(configs.chunk_size, configs.overlap_ratio)
+
+
+def get_truncation_counter(configs: Config) -> Optional[Callable[[str], int]]:
+    """
+    Return a function that counts the characters of a chunk that will be
+    truncated by the embedding model, or None if the model doesn't expose its tokenizer.
+    """
+    tokenizer = get_embedding_tokenizer(get_embedding_function(configs))
+    if tokenizer is None:
+        print(
+            f"{configs.embedding_function} doesn't expose its tokenizer. Cannot report truncation.",
+            file=sys.stderr,
+        )
+        return None
+    tokenizer, max_tokens = tokenizer
+    return partial(count_truncated_chars, tokenizer, max_tokens=max_tokens)
+
+
+async def embed_chunks(
+    collection: AsyncCollection,
+    documents: list[str],
+    hashes: list[str],
+    embedding_function: chromadb.EmbeddingFunction,
+    max_batch_size: int,
+    executor: Optional[Executor] = None,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    manifest: Optional[Manifest] = None,
+) -> tuple[list, int]:
+    """
+    Compute the embeddings of the documents. Chunks whose content hash is in
+    the embedding cache or already in the collection reuse the stored
+    embedding instead of going through the embedding function again. The
+    chunks in the collection are looked up by the IDs that the manifest
+    records for the hashes, so only one row is fetched for each hash. The
+    embedding function and the cache are called in `executor` so that they
+    don't block the event loop.
+
+    Returns the embeddings and the number of reused embeddings.
+    """
+    loop = asyncio.get_running_loop()
+    known: dict[str, Any] = {}
+    unique_hashes = list(set(hashes))
+    if embedding_cache is not None:
+        known.update(
+            await loop.run_in_executor(executor, embedding_cache.get, unique_hashes)
+        )
+        unique_hashes = [h for h in unique_hashes if h not in known]
+    # embeddings that are not in the cache yet.
+    new_embeddings: dict[str, Any] = {}
+    chunk_ids = []
+    if manifest is not None and unique_hashes:
+        chunk_ids = list(manifest.get_chunk_ids(unique_hashes).values())
+    for idx in range(0, len(chunk_ids), max_batch_size):
+        existing = await collection.get(
+            ids=chunk_ids[idx : idx + max_batch_size],
+            include=[IncludeEnum.metadatas, IncludeEnum.embeddings],
+        )
+        if existing["metadatas"] is None or existing["embeddings"] is None:
+            continue
+        for meta, embedding in zip(existing["metadatas"], existing["embeddings"]):
+            new_embeddings[str(meta["sha256"])] = embedding
+    known.update(new_embeddings)
+    num_reused = sum(1 for h in hashes if h in known)
+
+    missing: dict[str, str] = {}
+    for document, h in zip(documents, hashes):
+        if h not in known:
+            missing[h] = document
+    if missing:
+        embeddings = await loop.run_in_executor(
+            executor, embedding_function, list(missing.values())
+        )
+        new_embeddings.update(zip(missing.keys(), embeddings))
+        known.update(new_embeddings)
+    if embedding_cache is not None and new_embeddings:
+        await loop.run_in_executor(executor, embedding_cache.put, new_embeddings)
+    return [known[h] for h in hashes], num_reused
+
+
+# number of chunks per batch in the pipeline. The server usually accepts much
+# larger batches, but smaller batches allow embedding and writing to overlap.
+PIPELINE_BATCH_SIZE = 256
+
+# number of chunks whose metadata is fetched at once when listing the paths in
+# a collection.
+METADATA_PAGE_SIZE = 4096
+
+# number of paths that a worker stats at once when looking for orphanes.
+STAT_BATCH_SIZE = 256
+
+
+@dataclass
+class PendingFile:
+    """The chunks of a file that are waiting to be written to the collection."""
+
+    path: str
+    ids: list[str]
+    documents: list[str]
+    metadatas: list[dict]
+    fingerprint: Optional[Fingerprint] = None
+    # number of chunks that have been handed to a batch.
+    written: int = 0
+    # metadata of the chunks of this file that are already in the collection,
+    # by ID. Filled in when the first batch of the file is embedded.
+    existing: dict[str, dict] = field(default_factory=dict)
+    # size of the documents in bytes. Filled in when the file is added.
+    nbytes: int = 0
+
+
+@dataclass
+class EmbeddedBatch:
+    """A batch of chunks whose embeddings are ready to be written."""
+
+    # (file, start, end) slices of the chunks in this batch.
+    slices: list[tuple[PendingFile, int, int]]
+    # new chunks, to be added to the collection.
+    ids: list[str]
+    documents: list[str]
+    metadatas: list[dict]
+    embeddings: list
+    # chunks that are already in the collection, but whose metadata (the line
+    # and byte ranges) has changed.
+    moved_ids: list[str]
+    moved_metadatas: list[dict]
+    # chunks that are no longer in the files in this batch.
+    stale_ids: list[str]
+    num_reused: int
+    num_kept: int
+
+
+class BatchWriter:
+    """
+    Accumulate the chunks of many files and write them to the collection in
+    batches of up to `batch_size` chunks (capped by `max_batch_size` of the
+    server), so that small files don't each cost a round of get/delete/add
+    requests.
+
+    Chunk IDs are derived from the path and the content of the chunks, so
+    only the chunks that are not in the collection yet are embedded and added,
+    and only the chunks that are no longer in the file are deleted. Chunks
+    that are kept but moved to other lines have their metadata updated.
+
+    The batches go through two stages connected by bounded queues: the first
+    one diffs the chunks against the collection and computes the embeddings
+    (in a dedicated thread, so that the event loop keeps reading files and
+    talking to the database), and the second one writes the changes. A file
+    whose chunks don't fit into one batch is continued in the next batch.
+
+    `add` blocks when both stages are busy, or when the files that have been
+    added but not completely written hold more than `max_pending_chunks`
+    chunks or `max_pending_bytes` bytes of documents (non-positive values mean
+    no limit). Call `flush` to wait for everything to be written, and `close`
+    when the writer is no longer needed. Once a batch fails, `add` and `flush`
+    raise its error.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncCollection,
+        collection_lock: Lock,
+        stats: dict[str, int],
+        stats_lock: Lock,
+        embedding_function: chromadb.EmbeddingFunction,
+        max_batch_size: int,
+        manifest: Optional[Manifest] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+        queue_size: int = 2,
+        max_pending_chunks: int = -1,
+        max_pending_bytes: int = -1,
+    ):
+        self.collection = collection
+        self.manifest = manifest
+        # set by the caller to follow when the hot files become searchable.
+        self.progress: Optional[IndexProgress] = None
+        self.__embedding_cache = embedding_cache
+        self.__collection_lock = collection_lock
+        self.__stats = stats
+        self.__stats_lock = stats_lock
+        self.__embedding_function = embedding_function
+        self.__max_batch_size = max_batch_size
+        self.__batch_size = min(batch_size, max_batch_size)
+        self.__pending: deque[PendingFile] = deque()
+        self.__num_pending_chunks = 0
+        self.__embed_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vectorcode-embed"
+        )
+        self.__embed_queue: asyncio.Queue[list[tuple[PendingFile, int, int]]] = (
+            asyncio.Queue(queue_size)
+        )
+        self.__write_queue: asyncio.Queue[EmbeddedBatch] = asyncio.Queue(queue_size)
+        self.__workers: list[asyncio.Task] = []
+        self.__error: Optional[BaseException] = None
+        self.__max_pending_chunks = max_pending_chunks
+        self.__max_pending_bytes = max_pending_bytes
+        # chunks and bytes of the files that haven't been completely written.
+        self.__held_chunks = 0
+        self.__held_bytes = 0
+        self.__released = asyncio.Event()
+
+    def __is_over_budget(self, num_chunks: int, nbytes: int) -> bool:
+        if self.__held_chunks == 0:
+            # a file that exceeds the budget by itself is still let in.
+            return False
+        return (
+            0 < self.__max_pending_chunks < self.__held_chunks + num_chunks
+            or 0 < self.__max_pending_bytes < self.__held_bytes + nbytes
+        )
+
+    async def add(self, file: PendingFile):
+        file.nbytes = sum(len(document.encode()) for document in file.documents)
+        while self.__error is None and self.__is_over_budget(
+            len(file.documents), file.nbytes
+        ):
+            if self.__pending:
+                # send the partial batch, so that the held files can be written.
+                await self.__submit(self.__take_batch())
+            else:
+                self.__released.clear()
+                await self.__released.wait()
+        if self.__error is not None:
+            # stop the caller from reading more files. `flush` raises it too.
+            raise self.__error
+        self.__held_chunks += len(file.documents)
+        self.__held_bytes += file.nbytes
+        if self.manifest is not None:
+            self.manifest.mark_in_progress(file.path)
+        self.__pending.append(file)
+        self.__num_pending_chunks += len(file.documents)
+        while self.__num_pending_chunks >= self.__batch_size:
+            await self.__submit(self.__take_batch())
+
+    async def flush(self):
+        """Wait for all files that have been added so far to be written."""
+        while self.__pending:
+            await self.__submit(self.__take_batch())
+        await self.__embed_queue.join()
+        await self.__write_queue.join()
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    async def close(self):
+        for worker in self.__workers:
+            worker.cancel()
+        await asyncio.gather(*self.__workers, return_exceptions=True)
+        self.__workers.clear()
+        # wait for the running call, which may be using the cache.
+        self.__embed_executor.shutdown(wait=True, cancel_futures=True)
+        if self.__embedding_cache is not None:
+            self.__embedding_cache.close()
+            self.__embedding_cache = None
+
+    async def __submit(self, batch: list[tuple[PendingFile, int, int]]):
+        if not self.__workers:
+            self.__workers = [
+                asyncio.create_task(self.__embed_worker()),
+                asyncio.create_task(self.__write_worker()),
+            ]
+        await self.__embed_queue.put(batch)
+
+    def __take_batch(self) -> list[tuple[PendingFile, int, int]]:
+        """Pop up to `batch_size` chunks as (file, start, end) slices."""
+        batch: list[tuple[PendingFile, int, int]] = []
+        size = 0
+        while self.__pending and size < self.__batch_size:
+            file = self.__pending[0]
+            start = file.written
+            end = min(len(file.documents), start + self.__batch_size - size)
+            batch.append((file, start, end))
+            size += end - start
+            file.written = end
+            if end == len(file.documents):
+                self.__pending.popleft()
+        self.__num_pending_chunks -= size
+        return batch
+
+    async def __embed_worker(self):
+        while True:
+            batch = await self.__embed_queue.get()
+            try:
+                if self.__error is None:
+                    await self.__write_queue.put(await self.__embed_batch(batch))
+            except Exception as e:
+                self.__error = e
+                self.__released.set()
+            finally:
+                self.__embed_queue.task_done()
+
+    async def __write_worker(self):
+        while True:
+            batch = await self.__write_queue.get()
+            try:
+                if self.__error is None:
+                    await self.__write_batch(batch)
+            except Exception as e:
+                self.__error = e
+                self.__released.set()
+            finally:
+                self.__write_queue.task_done()
+
+    async def __embed_batch(
+        self, batch: list[tuple[PendingFile, int, int]]
+    ) -> EmbeddedBatch:
+        # files that start in this batch. Their old chunks need to be diffed.
+        new_files = {file.path: file for file, start, _ in batch if start == 0}
+        stale_ids: list[str] = []
+        if new_files:
+            existing = await self.collection.get(
+                where={"path": {"$in": list(new_files.keys())}},
+                include=[IncludeEnum.metadatas],
+            )
+            for chunk_id, meta in zip(existing["ids"], existing["metadatas"] or []):
+                new_files[str(meta["path"])].existing[chunk_id] = dict(meta)
+            for file in new_files.values():
+                new_ids = set(file.ids)
+                stale_ids.extend(i for i in file.existing if i not in new_ids)
+
+        ids: list[str] = []
+        documents: list[str] = []
+        metadatas: list[dict] = []
+        moved_ids: list[str] = []
+        moved_metadatas: list[dict] = []
+        for file, start, end in batch:
+            for idx in range(start, end):
+                chunk_id, metadata = file.ids[idx], file.metadatas[idx]
+                if chunk_id not in file.existing:
+                    ids.append(chunk_id)
+                    documents.append(file.documents[idx])
+                    metadatas.append(metadata)
+                elif file.existing[chunk_id] != metadata:
+                    moved_ids.append(chunk_id)
+                    moved_metadatas.append(metadata)
+
+        # this runs before the stale chunks are removed by the write stage, so
+        # that chunks that moved to another file don't have to be embedded again.
+        embeddings, num_reused = await embed_chunks(
+            self.collection,
+            documents,
+            [str(meta["sha256"]) for meta in metadatas],
+            self.__embedding_function,
+            self.__max_batch_size,
+            self.__embed_executor,
+            self.__embedding_cache,
+            self.manifest,
+        )
+        return EmbeddedBatch(
+            slices=batch,
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=embeddings,
+            moved_ids=moved_ids,
+            moved_metadatas=moved_metadatas,
+            stale_ids=stale_ids,
+            num_reused=num_reused,
+            num_kept=sum(end - start for _, start, end in batch) - len(ids),
+        )
+
+    async def __write_batch(self, batch: EmbeddedBatch):
+        step = self.__max_batch_size
+        async with self.__collection_lock:
+            for idx in range(0, len(batch.stale_ids), step):
+                await self.collection.delete(ids=batch.stale_ids[idx : idx + step])
+            if batch.moved_ids:
+                await self.collection.update(
+                    ids=batch.moved_ids, metadatas=batch.moved_metadatas
+                )
+            if batch.ids:
+                await self.collection.upsert(
+                    ids=batch.ids,
+                    documents=batch.documents,
+                    metadatas=batch.metadatas,
+                    embeddings=batch.embeddings,
+                )
+
+        async with self.__stats_lock:
+            for file, start, end in batch.slices:
+                if start == 0 and file.documents:
+                    if file.existing:
+                        self.__stats["update"] += 1
+                    else:
+                        self.__stats["add"] += 1
+            self.__stats["chunks"] += len(batch.ids)
+            self.__stats["kept"] += batch.num_kept
+            self.__stats["deduplicated"] += batch.num_reused
+
+        for file, _, end in batch.slices:
+            if end == len(file.documents):
+                self.__held_chunks -= len(file.documents)
+                self.__held_bytes -= file.nbytes
+                self.__released.set()
+                if self.progress is not None:
+                    self.progress.done(file.path)
+
+        if self.manifest is not None:
+            for file, _, end in batch.slices:
+                if end < len(file.documents):
+                    continue
+                if file.fingerprint is not None:
+                    self.manifest.update(file.path, file.fingerprint)
+                    self.manifest.add_chunks(
+                        (str(meta["sha256"]), chunk_id)
+                        for meta, chunk_id in zip(file.metadatas, file.ids)
+                    )
+                    # the last document is the path of the file (see `load_file`).
+                    self.manifest.lexical.replace(
+                        file.path,
+                        file.documents[-1] if file.documents else "",
+                        (
+                            (
+                                document,
+                                meta.get("start_line"),
+                                meta.get("end_line"),
+                                meta.get("start_byte"),
+                                meta.get("end_byte"),
+                            )
+                            for document, meta in zip(
+                                file.documents[:-1], file.metadatas[:-1]
+                            )
+                        ),
+                        file.fingerprint.sha256,
+                    )
+                else:
+                    self.manifest.remove([file.path])
+            # checkpoint, so that an interrupted run can be resumed from here.
+            self.manifest.commit()
+
+
+def load_file(
+    full_path: str,
+    configs: Config,
+    chunker: ChunkerBase,
+    known_fingerprint: Optional[Fingerprint] = None,
+    truncation_counter: Optional[Callable[[str], int]] = None,
+    chunker_lock: Optional[threading.Lock] = None,
+) -> tuple[str, Optional[PendingFile], int]:
+    """
+    Read and chunk a file. This doesn't touch the event loop, the collection
+    or the manifest, so it can run in a worker thread.
+
+    Returns a tuple of:
+    - the outcome: "skipped", "unchanged", "touched" (the content matches
+      `known_fingerprint` but the mtime doesn't) or "changed";
+    - the chunks to be written (or, for "touched", the new fingerprint), and
+    - the number of characters that will be truncated by the embedding model.
+    """
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        return "skipped", None, 0
+    # the files that look unchanged are not opened at all.
+    if is_stat_unchanged(known_fingerprint, stat):
+        return "unchanged", None, 0
+    if not configs.force and should_skip(full_path, configs.max_file_size):
+        return "skipped", None, 0
+
+    fingerprint = None
+    chunks: list[Chunk | str] = []
+    try:
+        # the file is hashed while it's chunked, so only the chunks are held
+        # in memory. The line endings are kept (and lines only end at "\n"),
+        # so that the byte offsets of the chunks match the file.
+        with open(full_path, newline="\n") as fin, chunker_lock or nullcontext():
+            reader = HashingReader(fin)
+            chunks = list(chunker.chunk(reader))
+            fingerprint = Fingerprint(
+                stat.st_size, stat.st_mtime_ns, reader.hexdigest()
+            )
+    except UnicodeDecodeError:
+        # probably binary. skip it.
+        chunks = []
+    if (
+        fingerprint is not None
+        and known_fingerprint is not None
+        and known_fingerprint.sha256 == fingerprint.sha256
+    ):
+        return "touched", PendingFile(full_path, [], [], [], fingerprint), 0
+    if len(chunks) == 1 and chunks[0] == "":
+        # empty file
+        chunks = []
+
+    step_size = chunker.step_size if isinstance(chunker, FileChunker) else 0
+    documents: list[str] = []
+    metadatas: list[dict] = []
+    for chunk, offsets in zip(chunks, locate_chunks(chunks, step_size)):
+        document, metadata = get_chunk_entry(chunk, full_path)
+        if offsets is not None:
+            metadata["start_byte"], metadata["end_byte"] = offsets
+        metadata["sha256"] = hash_str(document)
+        documents.append(document)
+        metadatas.append(metadata)
+
+    truncated = 0
+    if documents and truncation_counter is not None:
+        with chunker_lock or nullcontext():
+            truncated = sum(truncation_counter(document) for document in documents)
+    if documents:
+        relpath = str(os.path.relpath(full_path, configs.project_root))
+        documents.append(relpath)
+        metadatas.append({"path": full_path, "sha256": hash_str(relpath)})
+
+    ids: list[str] = []
+    occurrences: dict[str, int] = {}
+    for metadata in metadatas:
+        sha256 = metadata["sha256"]
+        ids.append(get_chunk_id(full_path, sha256, occurrences.get(sha256, 0)))
+        occurrences[sha256] = occurrences.get(sha256, 0) + 1
+    return (
+        "changed",
+        PendingFile(full_path, ids, documents, metadatas, fingerprint),
+        truncated,
+    )
 
 
 async def chunked_add(
     file_path: str,
-    collection: AsyncCollection,
-    collection_lock: Lock,
+    writer: BatchWriter,
     stats: dict[str, int],
     stats_lock: Lock,
     configs: Config,
-    max_batch_size: int,
+    chunker: Optional[ChunkerBase] = None,
+    truncation_counter: Optional[Callable[[str], int]] = None,
+    truncated_chars: Optional[dict[str, int]] = None,
+    executor: Optional[Executor] = None,
+    chunker_lock: Optional[threading.Lock] = None,
 ):
+    """
+    Read and chunk a file in `executor`, and hand the chunks to the writer.
+    The chunks may not have been written to the collection when this function
+    returns. Call `writer.flush()` after the last file.
+    """
     full_path_str = str(expand_path(str(file_path), True))
-    async with collection_lock:
-        num_existing_chunks = len(
-            (
-                await collection.get(
-                    where={"path": full_path_str},
-                    include=[IncludeEnum.metadatas],
+    if chunker is None:
+        chunker = get_chunker(configs)
+    manifest = writer.manifest
+    known_fingerprint = None
+    if manifest is not None:
+        known_fingerprint = manifest.get(full_path_str)
+        if known_fingerprint is not None and not manifest.lexical.has(full_path_str):
+            # vectorised before the lexical index was added. Read it again so
+            # that it's indexed. Its chunks in the collection are kept.
+            known_fingerprint = None
+
+    outcome, pending, truncated = await asyncio.get_running_loop().run_in_executor(
+        executor,
+        load_file,
+        full_path_str,
+        configs,
+        chunker,
+        known_fingerprint,
+        truncation_counter,
+        chunker_lock,
+    )
+    if outcome in ("skipped", "unchanged", "touched"):
+        if outcome == "touched" and manifest is not None and pending is not None:
+            assert pending.fingerprint is not None
+            manifest.update(full_path_str, pending.fingerprint)
+        async with stats_lock:
+            stats["skipped" if outcome == "skipped" else "unchanged"] += 1
+        if writer.progress is not None:
+            writer.progress.done(full_path_str)
+        return
+    assert pending is not None
+    if truncated_chars is not None and pending.documents:
+        truncated_chars[full_path_str] = truncated
+    await writer.add(pending)
+
+
+async def add_files(
+    files: Iterable[str],
+    writer: BatchWriter,
+    stats: dict[str, int],
+    stats_lock: Lock,
+    configs: Config,
+    chunker: ChunkerBase,
+    truncation_counter: Optional[Callable[[str], int]] = None,
+    truncated_chars: Optional[dict[str, int]] = None,
+    num_readers: Optional[int] = None,
+    progress_bar: bool = True,
+) -> bool:
+    """
+    Run the files through the read/chunk → embed → write pipeline, and wait
+    for all of them to be written. `files` is consumed lazily, so it can be a
+    generator that is still walking the directories. At most `2 * num_readers`
+    files are read or waiting for the writer at any time. The progress bar is
+    shown if `progress_bar` is True, unless the output is piped.
+
+    Returns False if the process is aborted.
+    """
+    if num_readers is None:
+        num_readers = min(32, (os.cpu_count() or 1) + 4)
+    chunker_lock = None
+    if isinstance(chunker, TokenChunker) or truncation_counter is not None:
+        # huggingface tokenizers are not safe to share between threads.
+        chunker_lock = threading.Lock()
+    in_flight = asyncio.Semaphore(2 * num_readers)
+    tasks: set[asyncio.Task] = set()
+    errors: list[BaseException] = []
+
+    with (
+        ThreadPoolExecutor(
+            max_workers=num_readers, thread_name_prefix="vectorcode-read"
+        ) as executor,
+        tqdm.tqdm(
+            total=len(files) if isinstance(files, Sized) else None,
+            desc="Vectorising files...",
+            disable=configs.pipe or not progress_bar,
+        ) as bar,
+    ):
+
+        def on_done(task: asyncio.Task):
+            in_flight.release()
+            tasks.discard(task)
+            bar.update(1)
+            if not task.cancelled() and task.exception() is not None:
+                errors.append(task.exception())
+
+        try:
+            for file in files:
+                await in_flight.acquire()
+                if errors:
+                    break
+                task = asyncio.create_task(
+                    chunked_add(
+                        str(file),
+                        writer,
+                        stats,
+                        stats_lock,
+                        configs,
+                        chunker,
+                        truncation_counter,
+                        truncated_chars,
+                        executor,
+                        chunker_lock,
+                    )
                 )
-            )["ids"]
+                tasks.add(task)
+                task.add_done_callback(on_done)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if errors:
+                raise errors[0]
+            await writer.flush()
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            print("Abort.", file=sys.stderr)
+            return False
+        finally:
+            await writer.close()
+    return True
+
+
+async def iter_collection_paths(
+    collection: AsyncCollection, page_size: int, where: Optional[dict] = None
+) -> AsyncIterator[set[str]]:
+    """
+    Yield the paths of the documents in the collection (that match `where`),
+    one page of `page_size` chunks at a time. A path may appear in more than
+    one page.
+    """
+    offset = 0
+    while True:
+        page = await collection.get(
+            where=where,
+            include=[IncludeEnum.metadatas],
+            limit=page_size,
+            offset=offset,
         )
+        metadatas = page["metadatas"] or []
+        paths: set[str] = set()
+        for meta in metadatas:
+            path = meta.get("path")
+            if isinstance(path, str):
+                paths.add(path)
+        yield paths
+        if len(metadatas) < page_size:
+            return
+        offset += page_size
 
-    if num_existing_chunks:
-        async with collection_lock:
-            await collection.delete(where={"path": full_path_str})
 
-    try:
-        with open(full_path_str) as fin:
-            chunks = list(
-                FileChunker(configs.chunk_size, configs.overlap_ratio).chunk(fin)
+async def get_collection_paths(
+    collection: AsyncCollection, page_size: int, where: Optional[dict] = None
+) -> set[str]:
+    """
+    Return the paths of all documents in the collection (that match `where`).
+    The metadata is fetched `page_size` chunks at a time, so that large
+    collections don't have to be loaded into memory at once.
+    """
+    paths: set[str] = set()
+    async for page in iter_collection_paths(collection, page_size, where):
+        paths.update(page)
+    return paths
+
+
+async def find_orphanes(collection: AsyncCollection, page_size: int) -> set[str]:
+    """
+    Return the paths in the collection that no longer exist. The collection is
+    read one page at a time, and a path that appears in more than one page is
+    only checked once.
+    """
+    orphanes: set[str] = set()
+    files: set[str] = set()
+    with ThreadPoolExecutor(thread_name_prefix="vectorcode-stat") as executor:
+        async for page in iter_collection_paths(collection, page_size):
+            existing, missing = await split_orphanes(
+                page - orphanes - files, executor=executor
             )
-            if len(chunks) == 0 or (len(chunks) == 1 and chunks[0] == ""):
-                # empty file
-                return
-            chunks.append(str(os.path.relpath(full_path_str, configs.project_root)))
-            async with collection_lock:
-                for idx in range(0, len(chunks), max_batch_size):
-                    inserted_chunks = chunks[idx : idx + max_batch_size]
-                    await collection.add(
-                        ids=[get_uuid() for _ in inserted_chunks],
-                        documents=inserted_chunks,
-                        metadatas=[{"path": full_path_str} for _ in inserted_chunks],
-                    )
-    except UnicodeDecodeError:
-        # probably binary. skip it.
-        return
+            files.update(existing)
+            orphanes.update(missing)
+    return orphanes
 
-    if num_existing_chunks:
-        async with stats_lock:
-            stats["update"] += 1
-    else:
-        async with stats_lock:
-            stats["add"] += 1
 
+async def split_orphanes(
+    paths: Iterable[str],
+    num_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> tuple[set[str], set[str]]:
+    """
+    Stat the paths in `executor` (or a new thread pool of `num_workers`).
+    Return the paths that are still files, and the paths that no longer exist.
+    """
+    paths = list(paths)
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return await split_orphanes(paths, executor=executor)
+    loop = asyncio.get_running_loop()
+    batches = [
+        paths[idx : idx + STAT_BATCH_SIZE]
+        for idx in range(0, len(paths), STAT_BATCH_SIZE)
+    ]
+    is_file = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                executor, lambda batch: list(map(os.path.isfile, batch)), batch
+            )
+            for batch in batches
+        )
+    )
+    existing = {
+        path
+        for batch, flags in zip(batches, is_file)
+        for path, exists in zip(batch, flags)
+        if exists
+    }
+    return existing, set(paths) - existing
 
-def show_stats(configs: Config, stats):
+
+async def remove_paths(
+    collection: AsyncCollection, paths: Iterable[str], batch_size: int = 512
+):
+    """Remove all chunks of the paths, `batch_size` paths per request."""
+    paths = list(paths)
+    for idx in range(0, len(paths), batch_size):
+        await collection.delete(where={"path": {"$in": paths[idx : idx + batch_size]}})
+
+
+def new_stats(removed: int = 0) -> dict[str, int]:
+    """The counters reported by `vectorise`, `update`, `watch` and `query`."""
+    return {
+        "add": 0,
+        "update": 0,
+        "unchanged": 0,
+        "removed": removed,
+        "skipped": 0,
+        "chunks": 0,
+        "kept": 0,
+        "deduplicated": 0,
+    }
+
+
+def get_dedup_ratio(stats: dict[str, Any]) -> float:
+    """The ratio of chunks whose embeddings were reused instead of computed."""
+    if stats.get("chunks", 0) == 0:
+        return 0.0
+    return stats.get("deduplicated", 0) / stats["chunks"]
+
+
+def show_stats(
+    configs: Config,
+    stats,
+    truncated_chars: Optional[dict[str, int]] = None,
+    progress: Optional[IndexProgress] = None,
+):
     if configs.pipe:
+        stats = dict(stats, dedup_ratio=get_dedup_ratio(stats))
+        if truncated_chars is not None:
+            stats["truncated"] = truncated_chars
+        if progress is not None:
+            stats["hot_files"] = progress.num_hot_files
+            stats["time_to_hot"] = progress.report()
         print(json.dumps(stats))
     else:
         print(
             tabulate.tabulate(
                 [
-                    ["Added", "Updated", "Removed"],
-                    [stats["add"], stats["update"], stats["removed"]],
+                    [
+                        "Added",
+                        "Updated",
+                        "Unchanged",
+                        "Removed",
+                        "Skipped",
+                        "Dedup Ratio",
+                    ],
+                    [
+                        stats["add"],
+                        stats["update"],
+                        stats["unchanged"],
+                        stats["removed"],
+                        stats["skipped"],
+                        f"{get_dedup_ratio(stats):.2%}",
+                    ],
                 ],
                 headers="firstrow",
             )
         )
+        if truncated_chars:
+            rows = sorted(
+                (
+                    (os.path.relpath(path, str(configs.project_root)), count)
+                    for path, count in truncated_chars.items()
+                    if count > 0
+                ),
+                key=lambda row: row[1],
+                reverse=True,
+            )
+            print()
+            print(
+                f"{sum(truncated_chars.values())} characters in {len(rows)} file(s) are truncated by the embedding model."
+            )
+            if rows:
+                print(tabulate.tabulate(rows, headers=["File", "Truncated Characters"]))
+        if progress is not None and progress.num_hot_files:
+            reached = ", ".join(
+                f"{fraction} in {seconds:.1f}s"
+                for fraction, seconds in progress.report().items()
+                if seconds is not None
+            )
+            print()
+            print(f"{progress.num_hot_files} hot file(s) searchable: {reached}.")
 
 
 async def vectorise(configs: Config) -> int:
+    start_time = time.monotonic()
+    if not configs.files and configs.files_from is None and not configs.resume:
+        print("No files to vectorise.", file=sys.stderr)
+        return 1
     client = await get_client(configs)
     try:
         collection = await get_collection(client, configs, True)
@@ -103,61 +1006,152 @@ async def vectorise(configs: Config) -> int:
         return 1
     if not verify_ef(collection, configs):
         return 1
-    gitignore_path = os.path.join(str(configs.project_root), ".gitignore")
-    files = await expand_globs(configs.files or [], recursive=configs.recursive)
-    if os.path.isfile(gitignore_path):
-        with open(gitignore_path) as fin:
-            gitignore_spec = pathspec.GitIgnoreSpec.from_lines(fin.readlines())
-        files = [
-            file
-            for file in files
-            if (configs.force or not gitignore_spec.match_file(file))
-        ]
-    else:
-        gitignore_spec = None
-
-    stats = {"add": 0, "update": 0, "removed": 0}
+    stats = new_stats()
     collection_lock = Lock()
     stats_lock = Lock()
     max_batch_size = await client.get_max_batch_size()
+    chunker = get_chunker(configs)
+    manifest = get_manifest(collection, configs)
+    head = await get_head(str(configs.project_root))
 
-    with tqdm.tqdm(
-        total=len(files), desc="Vectorising files...", disable=configs.pipe
-    ) as bar:
+    paths = [os.path.abspath(expand_path(str(path))) for path in configs.files]
+    files_from = configs.files_from
+    if files_from is not None and files_from != "-":
+        files_from = os.path.abspath(expand_path(files_from))
+    run = manifest.get_run()
+    if configs.resume and not paths and files_from is None:
+        if run is None:
+            print("There's no interrupted run to resume.", file=sys.stderr)
+            manifest.close()
+            return 1
+        paths = run["files"]
+        files_from = run.get("files_from")
+        configs.recursive = run["recursive"]
+        configs.force = run["force"]
+        if files_from == "-":
+            print(
+                "The paths of the interrupted run were read from STDIN. Pipe them again to vectorise the remaining files.",
+                file=sys.stderr,
+            )
+            files_from = None
+    manifest.begin_run(
+        {
+            "files": paths,
+            "files_from": files_from,
+            "recursive": configs.recursive,
+            "force": configs.force,
+        }
+    )
+
+    path_stream = None
+    if files_from == "-":
+        path_stream = sys.stdin.buffer
+    elif files_from is not None:
         try:
-            tasks = [
-                asyncio.create_task(
-                    chunked_add(
-                        str(file),
-                        collection,
-                        collection_lock,
-                        stats,
-                        stats_lock,
-                        configs,
-                        max_batch_size,
-                    )
-                )
-                for file in files
-            ]
-            for task in asyncio.as_completed(tasks):
-                await task
-                bar.update(1)
-        except asyncio.CancelledError:
-            print("Abort.", file=sys.stderr)
+            path_stream = open(files_from, "rb")
+        except OSError as e:
+            print(f"Failed to read the paths from {files_from}: {e}", file=sys.stderr)
+            manifest.close()
             return 1
+    if configs.resume:
+        # files that may have been partially written go first.
+        paths = manifest.in_progress_paths() + paths
+    # with a single path, or a stream of paths that may be arbitrarily long,
+    # the files are not deduplicated so that memory use doesn't grow with them.
+    dedup = path_stream is None and len(paths) > 1
+    matcher = None
+    if not configs.force:
+        matcher = IgnoreMatcher(str(configs.project_root))
+    sources: Iterable[str] = paths
+    if path_stream is not None:
+        sources = itertools.chain(paths, read_path_list(path_stream))
+    files: Iterable[str] = iter_files(sources, configs.recursive, matcher, dedup)
+    progress = None
+    if path_stream is None:
+        hot_files: list[str] = []
+        if len(paths) > 1 or any("*" in path or os.path.isdir(path) for path in paths):
+            # the open and recently changed files go first, and the rest of the
+            # walk is streamed after them. Not worth asking git for a single
+            # file, like the ones that editors vectorise on save.
+            signals = await get_priority_signals(
+                str(configs.project_root), configs.prioritise
+            )
+            hot_files = get_hot_files(
+                signals,
+                partial(
+                    is_walked, paths=paths, recursive=configs.recursive, matcher=matcher
+                ),
+            )
+            files = prioritise(files, hot_files)
+        progress = IndexProgress(hot_files, start=start_time)
+
+    embedding_function = get_bulk_embedding_function(configs)
+    writer = BatchWriter(
+        collection,
+        collection_lock,
+        stats,
+        stats_lock,
+        embedding_function,
+        max_batch_size,
+        manifest,
+        get_embedding_cache(configs),
+        max_pending_chunks=configs.max_pending_chunks,
+        max_pending_bytes=configs.max_pending_bytes,
+    )
+    writer.progress = progress
+    truncation_counter = None
+    truncated_chars = None
+    if configs.truncation_report:
+        truncation_counter = get_truncation_counter(configs)
+        if truncation_counter is not None:
+            truncated_chars = {}
+
+    completed = False
+    try:
+        completed = await add_files(
+            files,
+            writer,
+            stats,
+            stats_lock,
+            configs,
+            chunker,
+            truncation_counter,
+            truncated_chars,
+        )
+    finally:
+        if path_stream is not None and path_stream is not sys.stdin.buffer:
+            path_stream.close()
+        if isinstance(embedding_function, EmbeddingPool):
+            embedding_function.close()
+        if not completed or stats["add"] or stats["update"]:
+            # an interrupted run may have written some of the chunks.
+            bump_generation(collection.name)
+    if not completed:
+        print("Run `vectorcode vectorise --resume` to continue.", file=sys.stderr)
+        manifest.close()
+        return 1
 
     async with collection_lock:
-        all_results = await collection.get(include=[IncludeEnum.metadatas])
-        if all_results is not None and all_results.get("metadatas"):
-            paths = (meta["path"] for meta in all_results["metadatas"])
-            orphanes = set()
-            for path in paths:
-                if isinstance(path, str) and not os.path.isfile(path):
-                    orphanes.add(path)
-            async with stats_lock:
-                stats["removed"] = len(orphanes)
-            if len(orphanes):
-                await collection.delete(where={"path": {"$in": list(orphanes)}})
-
-    show_stats(configs=configs, stats=stats)
+        orphanes = await find_orphanes(
+            collection, min(max_batch_size, METADATA_PAGE_SIZE)
+        )
+        async with stats_lock:
+            stats["removed"] = len(orphanes)
+        await remove_paths(collection, orphanes)
+        manifest.remove(orphanes)
+    if orphanes:
+        bump_generation(collection.name)
+    manifest.end_run()
+    if head is not None and not (collection.metadata or {}).get("git_commit"):
+        # the first run. Later runs may only vectorise some of the files, so
+        # the commit is only updated by `update`.
+        await record_git_commit(collection, manifest, str(configs.project_root), head)
+    manifest.close()
+
+    show_stats(
+        configs=configs,
+        stats=stats,
+        truncated_chars=truncated_chars,
+        progress=progress,
+    )
     return 0
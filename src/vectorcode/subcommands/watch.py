@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+from asyncio import Lock
+from typing import Iterable
+
+from vectorcode.cli_utils import Config, expand_path
+from vectorcode.common import (
+    get_client,
+    get_collection,
+    get_embedding_cache,
+    get_embedding_function,
+    get_manifest,
+    verify_ef,
+)
+from vectorcode.manifest import Manifest
+from vectorcode.query_cache import bump_generation
+from vectorcode.subcommands.vectorise import (
+    METADATA_PAGE_SIZE,
+    BatchWriter,
+    add_files,
+    get_chunker,
+    get_collection_paths,
+    new_stats,
+    remove_paths,
+    show_stats,
+    split_orphanes,
+)
+from vectorcode.walker import IgnoreMatcher, is_in_dir, iter_files
+from vectorcode.watcher import TreeWatcher
+
+
+def resolve_changes(
+    changes: Iterable[str], manifest: Manifest
+) -> tuple[list[str], set[str]]:
+    """
+    Split the paths reported by the watcher into the paths to be (re)vectorised
+    and the indexed files that no longer exist. Deleted paths that were never
+    indexed (like the temporary files of editors) are dropped. The indexed
+    files are looked up in the manifest, so the cost doesn't grow with the size
+    of the project.
+    """
+    paths: list[str] = []
+    orphanes: set[str] = set()
+    for path in changes:
+        if os.path.isfile(path):
+            paths.append(path)
+        elif os.path.isdir(path):
+            paths.append(path)
+            orphanes.update(
+                file for file in manifest.paths_in(path) if not os.path.isfile(file)
+            )
+        else:
+            if manifest.get(path) is not None:
+                orphanes.add(path)
+            orphanes.update(manifest.paths_in(path))
+    return paths, orphanes
+
+
+async def watch(configs: Config) -> int:
+    project_root = str(expand_path(str(configs.project_root), True))
+    roots = [os.path.abspath(expand_path(str(path))) for path in configs.files] or [
+        project_root
+    ]
+    for root in roots:
+        if not os.path.isdir(root):
+            print(f"{root} is not a directory.", file=sys.stderr)
+            return 1
+
+    client = await get_client(configs)
+    try:
+        collection = await get_collection(client, configs, True)
+    except IndexError:
+        print("Failed to get/create the collection. Please check your config.")
+        return 1
+    if not verify_ef(collection, configs):
+        return 1
+
+    # loaded once and kept for the lifetime of the watcher.
+    max_batch_size = await client.get_max_batch_size()
+    chunker = get_chunker(configs)
+    embedding_function = get_embedding_function(configs)
+    manifest = get_manifest(collection, configs)
+    matcher = IgnoreMatcher(project_root)
+    collection_lock = Lock()
+    stats_lock = Lock()
+
+    async def sync(
+        files: Iterable[str], orphanes: set[str], progress_bar: bool = False
+    ) -> bool:
+        stats = new_stats(removed=len(orphanes))
+        writer = BatchWriter(
+            collection,
+            collection_lock,
+            stats,
+            stats_lock,
+            embedding_function,
+            max_batch_size,
+            manifest,
+            get_embedding_cache(configs),
+            max_pending_chunks=configs.max_pending_chunks,
+            max_pending_bytes=configs.max_pending_bytes,
+        )
+        try:
+            if not await add_files(
+                files,
+                writer,
+                stats,
+                stats_lock,
+                configs,
+                chunker,
+                progress_bar=progress_bar,
+            ):
+                return False
+            await remove_paths(collection, orphanes)
+            manifest.remove(orphanes)
+            manifest.commit()
+        finally:
+            if stats["add"] or stats["update"] or stats["removed"]:
+                bump_generation(collection.name)
+        if stats["add"] or stats["update"] or stats["removed"]:
+            if configs.pipe:
+                show_stats(configs, stats)
+            else:
+                print(
+                    f"[{time.strftime('%H:%M:%S')}] Added {stats['add']}, updated {stats['update']} and removed {stats['removed']} file(s)."
+                )
+            sys.stdout.flush()
+        return True
+
+    # watch before catching up, so that changes made in the meantime aren't lost.
+    watcher = TreeWatcher(roots, matcher, configs.debounce)
+    try:
+        watcher.start()
+    except OSError as e:
+        watcher.close()
+        manifest.close()
+        print(f"Failed to watch {', '.join(roots)}: {e}", file=sys.stderr)
+        return 1
+
+    try:
+        _, orphanes = await split_orphanes(
+            path
+            for path in await get_collection_paths(
+                collection, min(max_batch_size, METADATA_PAGE_SIZE)
+            )
+            if any(is_in_dir(path, root) for root in roots)
+        )
+        # the catch-up walks the whole tree, so it shows its progress.
+        if not await sync(iter_files(roots, True, matcher), orphanes, True):
+            return 1
+        print(
+            f"Watching {watcher.num_watches} directories. Press Ctrl-C to stop.",
+            file=sys.stderr,
+        )
+        # the changes of a failed sync, which are retried with the next ones.
+        retry_paths: list[str] = []
+        retry_orphanes: set[str] = set()
+        while True:
+            paths, orphanes = resolve_changes(await watcher.changes(), manifest)
+            paths = list(dict.fromkeys(retry_paths + paths))
+            # the files that have been created again since are not removed.
+            orphanes.update(path for path in retry_orphanes if not os.path.isfile(path))
+            try:
+                if not await sync(iter_files(paths, True, matcher), orphanes):
+                    return 1
+                retry_paths, retry_orphanes = [], set()
+            except Exception as e:
+                # keep watching, e.g. when the database is briefly unreachable or
+                # the manifest is locked by another process.
+                manifest.rollback()
+                print(
+                    f"[{time.strftime('%H:%M:%S')}] Failed to update {len(paths) + len(orphanes)} path(s), which will be retried with the next change: {e}",
+                    file=sys.stderr,
+                )
+                retry_paths, retry_orphanes = paths, orphanes
+    finally:
+        watcher.close()
+        manifest.close()
@@ -0,0 +1,239 @@
+import glob
+import os
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import pathspec
+
+IGNORE_FILES = (".gitignore", ".vectorcodeignore")
+
+READ_SIZE = 64 * 1024
+
+
+def is_in_dir(path: str, directory: str) -> bool:
+    """Whether `path` is `directory` or inside it. Both should be absolute."""
+    return path == directory or path.startswith(os.path.join(directory, ""))
+
+
+def load_spec(path: str) -> Optional[pathspec.GitIgnoreSpec]:
+    try:
+        with open(path) as fin:
+            spec = pathspec.GitIgnoreSpec.from_lines(fin.readlines())
+    except (OSError, UnicodeDecodeError):
+        return None
+    if len(spec) == 0:
+        return None
+    return spec
+
+
+class IgnoreMatcher:
+    """
+    Match paths against the ignore rules of a project:
+    - `.gitignore` and `.vectorcodeignore` in the project root and any of its
+      subdirectories. The rules in a file apply to the directory that contains
+      it, and the rules in `.vectorcodeignore` take precedence over the rules
+      in `.gitignore` in the same directory;
+    - `.git/info/exclude` of the project.
+
+    As in git, the rules of deeper directories take precedence, and the last
+    matching rule in a file wins.
+    """
+
+    def __init__(self, project_root: str):
+        self.project_root = os.path.abspath(project_root)
+        # ignore specs of each directory, from the lowest to the highest precedence.
+        self.__specs: dict[str, list[pathspec.GitIgnoreSpec]] = {}
+        exclude = load_spec(os.path.join(self.project_root, ".git", "info", "exclude"))
+        self.__exclude = [exclude] if exclude is not None else []
+
+    def __get_specs(self, directory: str) -> list[pathspec.GitIgnoreSpec]:
+        specs = self.__specs.get(directory)
+        if specs is None:
+            specs = []
+            for name in IGNORE_FILES:
+                spec = load_spec(os.path.join(directory, name))
+                if spec is not None:
+                    specs.append(spec)
+            if directory == self.project_root:
+                specs = self.__exclude + specs
+            self.__specs[directory] = specs
+        return specs
+
+    def invalidate(self, directory: str):
+        """Reload the ignore files of `directory` the next time they're needed."""
+        self.__specs.pop(os.path.abspath(directory), None)
+
+    def is_ignored(self, path: str, is_dir: Optional[bool] = None) -> bool:
+        """
+        Whether `path` is ignored by the rules in its ancestors. This doesn't
+        check whether an ancestor directory is ignored; the walker prunes those.
+        Paths outside of the project root are never ignored.
+        """
+        path = os.path.abspath(path)
+        if path == self.project_root or not is_in_dir(path, self.project_root):
+            return False
+        if is_dir is None:
+            is_dir = os.path.isdir(path)
+        directory = os.path.dirname(path)
+        while True:
+            specs = self.__get_specs(directory)
+            if specs:
+                # the path relative to the directory that holds the ignore file.
+                relpath = os.path.relpath(path, directory).replace(os.sep, "/")
+                if is_dir:
+                    relpath += "/"
+                for spec in reversed(specs):
+                    result = spec.check_file(relpath)
+                    if result.include is not None:
+                        return result.include
+            if directory == self.project_root:
+                return False
+            directory = os.path.dirname(directory)
+
+    def is_path_ignored(self, path: str) -> bool:
+        """Whether `path`, or any of its ancestor directories, is ignored."""
+        path = os.path.abspath(path)
+        if self.is_ignored(path):
+            return True
+        directory = os.path.dirname(path)
+        while directory != self.project_root and is_in_dir(
+            directory, self.project_root
+        ):
+            if self.is_ignored(directory, True):
+                return True
+            directory = os.path.dirname(directory)
+        return False
+
+
+def walk_files(
+    root: str,
+    matcher: Optional[IgnoreMatcher] = None,
+    include_hidden: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the files under `root` as they are found. Directories that are
+    ignored by `matcher` are not descended into. Hidden files and directories
+    are skipped unless `include_hidden` is True, and symlinks to directories
+    are not followed.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirs = []
+                for entry in entries:
+                    if not include_hidden and entry.name.startswith("."):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if not is_dir and not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if matcher is not None and matcher.is_ignored(entry.path, is_dir):
+                        continue
+                    if is_dir:
+                        subdirs.append(entry.path)
+                    else:
+                        yield entry.path
+        except OSError:
+            continue
+        # visit the subdirectories in alphabetical order.
+        stack.extend(sorted(subdirs, reverse=True))
+
+
+def is_walked(
+    path: str,
+    paths: Iterable[str],
+    recursive: bool = False,
+    matcher: Optional[IgnoreMatcher] = None,
+) -> bool:
+    """
+    Whether `iter_files(paths, recursive, matcher)` yields the file at `path`
+    (an absolute path), without walking the directories. Files that are only
+    matched by a glob are not recognised.
+    """
+    for target in paths:
+        target = os.path.abspath(os.path.expandvars(os.path.expanduser(str(target))))
+        if "*" in target:
+            continue
+        if path == target:
+            return matcher is None or not matcher.is_path_ignored(path)
+        if recursive and is_in_dir(path, target) and os.path.isdir(target):
+            relpath = os.path.relpath(path, target)
+            if any(part.startswith(".") for part in relpath.split(os.sep)):
+                # hidden files are skipped by the walker.
+                continue
+            return matcher is None or not matcher.is_path_ignored(path)
+    return False
+
+
+def read_path_list(stream: BinaryIO) -> Iterator[str]:
+    """
+    Yield the paths in `stream` as they are read. The paths are separated by
+    NUL if there's a NUL in the first block of the stream (as printed by
+    `find -print0` or `git ls-files -z`), or by newlines otherwise.
+    """
+    separator = None
+    remainder = b""
+    while True:
+        block = stream.read(READ_SIZE)
+        if not block:
+            break
+        if separator is None:
+            separator = b"\0" if b"\0" in block else b"\n"
+        *entries, remainder = (remainder + block).split(separator)
+        for entry in entries:
+            if separator == b"\n":
+                entry = entry.rstrip(b"\r")
+            if entry:
+                yield os.fsdecode(entry)
+    if separator == b"\n":
+        remainder = remainder.rstrip(b"\r")
+    if remainder:
+        yield os.fsdecode(remainder)
+
+
+def iter_files(
+    paths: Iterable[str],
+    recursive: bool = False,
+    matcher: Optional[IgnoreMatcher] = None,
+    dedup: bool = True,
+) -> Iterator[str]:
+    """
+    Yield the files that the paths refer to. A path can be a file, a glob, or a
+    directory (only expanded when `recursive` is True). Files that are
+    ignored by `matcher` are skipped.
+
+    Duplicates are dropped if `dedup` is True. This keeps every yielded path
+    in memory, so it can be turned off for very long streams of paths.
+    """
+    seen: set[str] = set()
+    for path in paths:
+        path = os.path.expandvars(os.path.expanduser(str(path)))
+        # the walker prunes the ignored paths under the directory by itself.
+        check_ignored = matcher is not None
+        if os.path.isfile(path):
+            candidates: Iterable[str] = (path,)
+        elif "*" in path:
+            candidates = (
+                file
+                for file in glob.iglob(path, recursive=recursive)
+                if os.path.isfile(file)
+            )
+        elif os.path.isdir(path) and recursive:
+            if matcher is not None and matcher.is_path_ignored(path):
+                continue
+            candidates = walk_files(path, matcher)
+            check_ignored = False
+        else:
+            continue
+        for file in candidates:
+            abs_path = os.path.abspath(file)
+            if dedup:
+                if abs_path in seen:
+                    continue
+                seen.add(abs_path)
+            if check_ignored and matcher and matcher.is_path_ignored(abs_path):
+                continue
+            yield file
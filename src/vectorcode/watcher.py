@@ -0,0 +1,271 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from vectorcode.walker import IGNORE_FILES, IgnoreMatcher, is_in_dir
+
+# flags from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_CREATE
+    | IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# struct inotify_event, without the trailing name.
+EVENT_HEADER = struct.Struct("iIII")
+
+READ_SIZE = 64 * 1024
+
+
+@dataclass
+class InotifyEvent:
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+def get_libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError(errno.ENOSYS, "inotify is not available on this platform.")
+    return libc
+
+
+class Inotify:
+    """A minimal wrapper of the Linux inotify API."""
+
+    def __init__(self):
+        self.__libc = get_libc()
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            self.__raise()
+
+    def __raise(self, path: Optional[str] = None):
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+
+    def fileno(self) -> int:
+        return self.__fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        Watch `path` and return its watch descriptor. Watching a path that is
+        already watched returns the same descriptor.
+        """
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+        if wd < 0:
+            self.__raise(path)
+        return wd
+
+    def remove_watch(self, wd: int):
+        # fails if the watch is already gone, which is fine.
+        self.__libc.inotify_rm_watch(self.__fd, wd)
+
+    def read_events(self) -> list[InotifyEvent]:
+        """Return the events that are ready, without blocking."""
+        events: list[InotifyEvent] = []
+        while True:
+            try:
+                data = os.read(self.__fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+
+    def close(self):
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+
+class TreeWatcher:
+    """
+    Watch the directories under `roots` for files that are created, modified,
+    moved or deleted. Hidden directories and the directories that are ignored
+    by `matcher` are not watched, and directories that are created later are
+    watched as they appear.
+
+    The events are coalesced: `changes` waits until the tree has been quiet for
+    `debounce` seconds (or until `max_delay` seconds have passed since the
+    first event, so that a steady stream of events doesn't starve the
+    caller), and returns the set of paths that changed since the last call.
+    """
+
+    def __init__(
+        self,
+        roots: Iterable[str],
+        matcher: Optional[IgnoreMatcher] = None,
+        debounce: float = 0.5,
+        max_delay: Optional[float] = None,
+    ):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.matcher = matcher
+        self.debounce = debounce
+        self.max_delay = max_delay if max_delay is not None else max(10 * debounce, 1)
+        self.__inotify: Optional[Inotify] = None
+        # watched directories, by watch descriptor.
+        self.__dirs: dict[int, str] = {}
+        self.__pending: set[str] = set()
+        self.__changed = asyncio.Event()
+        self.__first_event = 0.0
+        self.__last_event = 0.0
+
+    def start(self):
+        """
+        Start watching. Raise OSError if inotify is not available or the
+        limit of watches (`fs.inotify.max_user_watches`) is reached.
+        """
+        self.__inotify = Inotify()
+        for root in self.roots:
+            if self.matcher is None or not self.matcher.is_path_ignored(root):
+                self.__watch_tree(root)
+        asyncio.get_running_loop().add_reader(
+            self.__inotify.fileno(), self.__read_events
+        )
+
+    def close(self):
+        if self.__inotify is not None:
+            asyncio.get_running_loop().remove_reader(self.__inotify.fileno())
+            self.__inotify.close()
+            self.__inotify = None
+        self.__dirs.clear()
+
+    @property
+    def num_watches(self) -> int:
+        return len(self.__dirs)
+
+    async def changes(self) -> set[str]:
+        """
+        Wait for the next set of changes. A path in the set is either a file
+        that has changed, or a directory whose contents should be scanned
+        again (because it was created, moved or deleted, its ignore rules
+        changed, or events were lost). The paths may no longer exist.
+        """
+        loop = asyncio.get_running_loop()
+        await self.__changed.wait()
+        while True:
+            wake_up = min(
+                self.__last_event + self.debounce, self.__first_event + self.max_delay
+            )
+            if wake_up <= loop.time():
+                break
+            await asyncio.sleep(wake_up - loop.time())
+        changes, self.__pending = self.__pending, set()
+        self.__changed.clear()
+        return changes
+
+    def __is_skipped(self, path: str, is_dir: bool) -> bool:
+        if os.path.basename(path).startswith("."):
+            return True
+        return self.matcher is not None and self.matcher.is_ignored(path, is_dir)
+
+    def __watch_tree(self, root: str):
+        assert self.__inotify is not None
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                wd = self.__inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                # removed in the meantime, or not readable.
+                continue
+            self.__dirs[wd] = directory
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if is_dir and not self.__is_skipped(entry.path, True):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+    def __unwatch_tree(self, root: str):
+        assert self.__inotify is not None
+        for wd, directory in list(self.__dirs.items()):
+            if is_in_dir(directory, root):
+                self.__inotify.remove_watch(wd)
+                self.__dirs.pop(wd)
+
+    def __read_events(self):
+        if self.__inotify is None:
+            return
+        try:
+            self.__handle_events(self.__inotify.read_events())
+        except OSError as e:
+            print(f"Failed to watch new directories: {e}", file=sys.stderr)
+        if self.__pending and not self.__changed.is_set():
+            self.__first_event = asyncio.get_running_loop().time()
+            self.__changed.set()
+
+    def __handle_events(self, events: list[InotifyEvent]):
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # the kernel dropped some events.
+                self.__pending.update(self.roots)
+                for root in self.roots:
+                    self.__watch_tree(root)
+                continue
+            if event.mask & IN_IGNORED:
+                self.__dirs.pop(event.wd, None)
+                continue
+            directory = self.__dirs.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            is_dir = bool(event.mask & IN_ISDIR)
+            if event.name in IGNORE_FILES and not is_dir:
+                if self.matcher is not None:
+                    self.matcher.invalidate(directory)
+                # directories that are no longer ignored need to be watched.
+                self.__watch_tree(directory)
+                self.__pending.add(directory)
+            elif self.__is_skipped(path, is_dir):
+                continue
+            elif is_dir:
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    self.__watch_tree(path)
+                elif event.mask & IN_MOVED_FROM:
+                    self.__unwatch_tree(path)
+                self.__pending.add(path)
+            else:
+                self.__pending.add(path)
+        if events:
+            self.__last_event = asyncio.get_running_loop().time()
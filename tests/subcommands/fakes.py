@@ -0,0 +1,95 @@
+"""In-memory stand-ins for the database and the embedding function."""
+
+from typing import Any, Optional
+
+from chromadb.api.types import IncludeEnum
+
+
+class FakeCollection:
+    """An in-memory stand-in for `AsyncCollection`, which records the requests."""
+
+    def __init__(self):
+        self.name = "fake"
+        self.id = "fake-id"
+        self.metadata: dict[str, Any] = {}
+        # id -> (document, metadata, embedding)
+        self.rows: dict[str, tuple[str, dict, Any]] = {}
+        self.requests: list[tuple[str, dict]] = []
+        # raised by the next `upsert`, if set.
+        self.upsert_error: Optional[Exception] = None
+
+    @staticmethod
+    def __matches(meta: dict, where: Optional[dict]) -> bool:
+        for key, condition in (where or {}).items():
+            if isinstance(condition, dict) and "$in" in condition:
+                if meta.get(key) not in condition["$in"]:
+                    return False
+            elif meta.get(key) != condition:
+                return False
+        return True
+
+    async def get(self, ids=None, where=None, include=(), limit=None, offset=None):
+        self.requests.append(("get", {"ids": ids, "where": where, "limit": limit}))
+        rows = [
+            (chunk_id, row)
+            for chunk_id, row in self.rows.items()
+            if (ids is None or chunk_id in ids) and self.__matches(row[1], where)
+        ]
+        rows = rows[offset or 0 :]
+        if limit is not None:
+            rows = rows[:limit]
+        return {
+            "ids": [chunk_id for chunk_id, _ in rows],
+            "documents": [row[0] for _, row in rows]
+            if IncludeEnum.documents in include
+            else None,
+            "metadatas": [dict(row[1]) for _, row in rows]
+            if IncludeEnum.metadatas in include
+            else None,
+            "embeddings": [row[2] for _, row in rows]
+            if IncludeEnum.embeddings in include
+            else None,
+        }
+
+    async def upsert(self, ids, documents, metadatas, embeddings):
+        self.requests.append(("upsert", {"ids": ids}))
+        if self.upsert_error is not None:
+            raise self.upsert_error
+        for chunk_id, document, meta, embedding in zip(
+            ids, documents, metadatas, embeddings
+        ):
+            self.rows[chunk_id] = (document, dict(meta), embedding)
+
+    async def update(self, ids, metadatas):
+        self.requests.append(("update", {"ids": ids}))
+        for chunk_id, meta in zip(ids, metadatas):
+            document, _, embedding = self.rows[chunk_id]
+            self.rows[chunk_id] = (document, dict(meta), embedding)
+
+    async def delete(self, ids=None, where=None):
+        self.requests.append(("delete", {"ids": ids, "where": where}))
+        for chunk_id in [
+            chunk_id
+            for chunk_id, row in self.rows.items()
+            if (ids is None or chunk_id in ids) and self.__matches(row[1], where)
+        ]:
+            del self.rows[chunk_id]
+
+    async def count(self) -> int:
+        return len(self.rows)
+
+    async def modify(self, metadata=None):
+        self.requests.append(("modify", {"metadata": metadata}))
+        if metadata is not None:
+            self.metadata = dict(metadata)
+
+
+class CountingEmbeddingFunction:
+    """Embed each document as its length, and record the embedded documents."""
+
+    def __init__(self):
+        self.documents: list[str] = []
+
+    def __call__(self, documents: list[str]) -> list[list[float]]:
+        self.documents.extend(documents)
+        return [[float(len(document)), 1.0] for document in documents]
@@ -0,0 +1,111 @@
+import os
+import subprocess
+from contextlib import ExitStack
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fakes import CountingEmbeddingFunction, FakeCollection
+
+from vectorcode.cli_utils import ChunkMode, Config
+from vectorcode.git import GitChanges, get_head
+from vectorcode.manifest import Fingerprint, Manifest
+from vectorcode.subcommands.update import get_changed_files, update
+
+
+@pytest.mark.asyncio
+async def test_get_changed_files(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.db"), "id", {})
+    manifest.update("/p/indexed.py", Fingerprint(1, 1, "a"))
+    collection = MagicMock()
+    # vectorised before the manifest was kept.
+    collection.get = AsyncMock(
+        return_value={"metadatas": [{"path": "/p/old.py"}, {"path": "/p/legacy.py"}]}
+    )
+    changes = GitChanges(
+        changed={
+            "/p/indexed.py",
+            "/p/legacy.py",
+            "/p/untracked.py",
+            "/p/new.py",
+            "/p/renamed.py",
+            "/elsewhere/indexed.py",
+        },
+        deleted={"/p/old.py", "/p/unindexed.py"},
+        renamed={"/p/new.py": "/p/old.py", "/p/renamed.py": "/p/unindexed.py"},
+    )
+    assert await get_changed_files(collection, manifest, changes, "/p", 100) == [
+        "/p/indexed.py",
+        "/p/legacy.py",
+        "/p/new.py",
+    ]
+    # only the paths that aren't in the manifest are looked up in the collection.
+    collection.get.assert_awaited_once()
+    assert sorted(collection.get.await_args.kwargs["where"]["path"]["$in"]) == [
+        "/p/legacy.py",
+        "/p/new.py",
+        "/p/old.py",
+        "/p/renamed.py",
+        "/p/unindexed.py",
+        "/p/untracked.py",
+    ]
+    manifest.close()
+
+
+def git(cwd, *args: str):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_since_ignored_file(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    git(project, "init", "-q")
+    # tracked by git, but vectorised on purpose with `vectorise -f`.
+    generated = project / "generated.py"
+    generated.write_text("x = 1\n")
+    (project / ".vectorcodeignore").write_text("generated.py\n")
+    git(project, "add", ".")
+    git(project, "commit", "-q", "-m", "init")
+    since = await get_head(str(project))
+    assert since is not None
+    generated.write_text("x = 2\n")
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    configs = Config(
+        project_root=str(project),
+        since=since,
+        chunk_mode=ChunkMode.line,
+        chunk_size=6,
+        overlap_ratio=0,
+        pipe=True,
+    )
+    collection = FakeCollection()
+    collection.rows["old"] = ("x = 1\n", {"path": str(generated)}, [1.0])
+    client = MagicMock()
+    client.get_max_batch_size = AsyncMock(return_value=100)
+    module = "vectorcode.subcommands.update"
+    with ExitStack() as stack:
+        for target, mock in (
+            (f"{module}.get_client", AsyncMock(return_value=client)),
+            (f"{module}.get_collection", AsyncMock(return_value=collection)),
+            (f"{module}.verify_ef", MagicMock(return_value=True)),
+            (
+                f"{module}.get_bulk_embedding_function",
+                MagicMock(return_value=CountingEmbeddingFunction()),
+            ),
+            (f"{module}.get_embedding_cache", MagicMock(return_value=None)),
+            (f"{module}.bump_generation", MagicMock()),
+            ("vectorcode.common.get_cache_dir", MagicMock(return_value=cache_dir)),
+        ):
+            stack.enter_context(patch(target, new=mock))
+        assert await update(configs) == 0
+    # the ignore rules only apply to new files, so it's kept up to date.
+    assert sorted(row[0] for row in collection.rows.values()) == [
+        "generated.py",
+        "x = 2\n",
+    ]
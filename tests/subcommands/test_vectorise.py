@@ -0,0 +1,506 @@
+import asyncio
+import os
+from asyncio import Lock
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Optional
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fakes import CountingEmbeddingFunction, FakeCollection
+
+from vectorcode.chunking import FileChunker, LineChunker
+from vectorcode.cli_utils import ChunkMode, Config
+from vectorcode.manifest import Fingerprint, Manifest
+from vectorcode.priority import PrioritySignals
+from vectorcode.subcommands.vectorise import (
+    BatchWriter,
+    add_files,
+    chunked_add,
+    embed_chunks,
+    find_orphanes,
+    get_chunk_id,
+    hash_str,
+    load_file,
+    new_stats,
+    remove_paths,
+    split_orphanes,
+    vectorise,
+)
+
+
+@contextmanager
+def fake_database(collection: FakeCollection, cache_dir: str, embedding_function):
+    """Run `vectorise` against the fake collection, with the manifest in `cache_dir`."""
+    client = MagicMock()
+    client.get_max_batch_size = AsyncMock(return_value=100)
+    module = "vectorcode.subcommands.vectorise"
+    with ExitStack() as stack:
+        for target, mock in (
+            (f"{module}.get_client", AsyncMock(return_value=client)),
+            (f"{module}.get_collection", AsyncMock(return_value=collection)),
+            (f"{module}.verify_ef", MagicMock(return_value=True)),
+            (
+                f"{module}.get_bulk_embedding_function",
+                MagicMock(return_value=embedding_function),
+            ),
+            (f"{module}.get_embedding_cache", MagicMock(return_value=None)),
+            (f"{module}.bump_generation", MagicMock()),
+            ("vectorcode.common.get_cache_dir", MagicMock(return_value=cache_dir)),
+        ):
+            stack.enter_context(patch(target, new=mock))
+        yield
+
+
+async def write_files(
+    paths: list[str],
+    collection: FakeCollection,
+    embedding_function,
+    configs: Config,
+    manifest: Optional[Manifest] = None,
+    **kwargs,
+) -> dict[str, int]:
+    """Add the files through `chunked_add` and a new writer, and return the stats."""
+    stats = new_stats()
+    stats_lock = Lock()
+    writer = BatchWriter(
+        collection,
+        Lock(),
+        stats,
+        stats_lock,
+        embedding_function,
+        100,
+        manifest,
+        **kwargs,
+    )
+    try:
+        for path in paths:
+            await chunked_add(path, writer, stats, stats_lock, configs)
+        await writer.flush()
+    finally:
+        await writer.close()
+    return stats
+
+
+def get_configs(project_root, **kwargs) -> Config:
+    return Config(
+        project_root=str(project_root),
+        chunk_mode=ChunkMode.line,
+        chunk_size=6,
+        overlap_ratio=0,
+        pipe=True,
+        **kwargs,
+    )
+
+
+def test_load_file_crlf(tmp_path):
+    path = tmp_path / "crlf.py"
+    path.write_bytes(b"".join(b"x_%d = %d\r\n" % (i, i) for i in range(20)))
+    outcome, pending, _ = load_file(
+        str(path), Config(project_root=str(tmp_path)), LineChunker(30, 0)
+    )
+    assert outcome == "changed" and pending is not None
+    encoded = path.read_bytes()
+    # the last document is the path of the file.
+    assert len(pending.documents) > 2
+    for document, metadata in zip(pending.documents[:-1], pending.metadatas[:-1]):
+        assert (
+            encoded[metadata["start_byte"] : metadata["end_byte"]] == document.encode()
+        )
+
+
+def test_load_file_char_mode_offsets(tmp_path):
+    path = tmp_path / "chars.py"
+    path.write_text("ß = 1\n" * 20)
+    outcome, pending, _ = load_file(
+        str(path), Config(project_root=str(tmp_path)), FileChunker(25, 0.2)
+    )
+    assert outcome == "changed" and pending is not None
+    encoded = path.read_bytes()
+    for document, metadata in zip(pending.documents[:-1], pending.metadatas[:-1]):
+        assert (
+            encoded[metadata["start_byte"] : metadata["end_byte"]] == document.encode()
+        )
+
+
+def test_load_file_streams_content(tmp_path):
+    path = tmp_path / "big.py"
+    path.write_bytes(b"".join(b"\xc3\x9f_%d = %d\r\n" % (i, i) for i in range(2000)))
+    encoded = path.read_bytes()
+    real_open = open
+    sizes = []
+
+    class SizedReads:
+        def __init__(self, fin):
+            self.fin = fin
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.fin.close()
+
+        def read(self, size=-1):
+            sizes.append(size)
+            return self.fin.read(size)
+
+    with patch(
+        "builtins.open", side_effect=lambda *a, **kw: SizedReads(real_open(*a, **kw))
+    ):
+        outcome, pending, _ = load_file(
+            str(path),
+            Config(project_root=str(tmp_path)),
+            FileChunker(100, 0.3, buffer_size=1000),
+        )
+    assert outcome == "changed" and pending is not None
+    # the file is never read in one go.
+    assert sizes and all(0 < size <= 1 << 16 for size in sizes)
+    assert pending.fingerprint is not None
+    assert pending.fingerprint.sha256 == hash_str(encoded.decode())
+    assert len(pending.documents) > 2
+    for document, metadata in zip(pending.documents[:-1], pending.metadatas[:-1]):
+        assert (
+            encoded[metadata["start_byte"] : metadata["end_byte"]] == document.encode()
+        )
+
+
+def test_load_file_unchanged_not_opened(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("x = 1\n")
+    stat = os.stat(path)
+    fingerprint = Fingerprint(stat.st_size, stat.st_mtime_ns, "hash")
+    with patch("builtins.open", side_effect=AssertionError("opened")):
+        outcome, pending, _ = load_file(
+            str(path), Config(project_root=str(tmp_path)), LineChunker(), fingerprint
+        )
+    assert outcome == "unchanged" and pending is None
+
+
+@pytest.mark.asyncio
+async def test_embed_chunks_reuses_one_row_per_hash(tmp_path):
+    collection = FakeCollection()
+    # a license header that's in many files.
+    for idx in range(50):
+        collection.rows[f"header-{idx}"] = ("# license", {"sha256": "h1"}, [9.0, 9.0])
+    manifest = Manifest(str(tmp_path / "manifest.db"), "fake-id", {})
+    manifest.add_chunks([("h1", "header-7")])
+    embedding_function = CountingEmbeddingFunction()
+
+    embeddings, num_reused = await embed_chunks(
+        collection,
+        ["# license", "x = 1", "x = 1"],
+        ["h1", "h2", "h2"],
+        embedding_function,
+        100,
+        manifest=manifest,
+    )
+    assert embeddings == [[9.0, 9.0], [5.0, 1.0], [5.0, 1.0]]
+    assert num_reused == 1
+    # the new chunk is embedded once.
+    assert embedding_function.documents == ["x = 1"]
+    # only the recorded chunk is fetched, instead of every duplicate.
+    assert collection.requests == [
+        ("get", {"ids": ["header-7"], "where": None, "limit": None})
+    ]
+    manifest.close()
+
+
+@pytest.mark.asyncio
+async def test_vectorise_resume_partly_written(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "a.py").write_text("a = 1\nb = 2\nc = 3\n")
+    (project / "b.py").write_text("d = 4\n")
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    collection = FakeCollection()
+    embedding_function = CountingEmbeddingFunction()
+    configs = get_configs(project, files=[str(project)], recursive=True)
+    with fake_database(collection, cache_dir, embedding_function):
+        assert await vectorise(configs) == 0
+    num_rows = len(collection.rows)
+
+    # a run that was interrupted while the chunks of a.py were written: some
+    # of them are lost, and its fingerprint is outdated.
+    manifest = Manifest(os.path.join(cache_dir, "manifest.db"), "fake-id", {}, False)
+    manifest.begin_run({"files": [str(project)], "recursive": True, "force": False})
+    manifest.update(str(project / "a.py"), Fingerprint(0, 0, ""))
+    manifest.mark_in_progress(str(project / "a.py"))
+    manifest.commit()
+    manifest.close()
+    lost = next(
+        chunk_id for chunk_id, row in collection.rows.items() if row[0] == "c = 3\n"
+    )
+    del collection.rows[lost]
+    embedding_function.documents.clear()
+
+    with fake_database(collection, cache_dir, embedding_function):
+        assert await vectorise(get_configs(project, resume=True)) == 0
+    assert len(collection.rows) == num_rows
+    # a.py is re-processed once, and only its lost chunk is embedded.
+    assert embedding_function.documents == ["c = 3\n"]
+    assert [request for request in collection.requests if request[0] == "upsert"][
+        -1
+    ] == ("upsert", {"ids": [lost]})
+    manifest = Manifest(os.path.join(cache_dir, "manifest.db"), "fake-id", {}, False)
+    assert manifest.in_progress_paths() == []
+    assert manifest.get_run() is None
+    manifest.close()
+
+
+def test_get_chunk_id():
+    assert get_chunk_id("/a.py", "h") == get_chunk_id("/a.py", "h", 0)
+    assert get_chunk_id("/a.py", "h") != get_chunk_id("/b.py", "h")
+    # identical chunks in the same file.
+    assert get_chunk_id("/a.py", "h", 0) != get_chunk_id("/a.py", "h", 1)
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_append(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("a = 1\nb = 2\n")
+    configs = get_configs(tmp_path)
+    collection = FakeCollection()
+    embedding_function = CountingEmbeddingFunction()
+    stats = await write_files([str(path)], collection, embedding_function, configs)
+    assert stats["add"] == 1
+    ids = set(collection.rows)
+
+    path.write_text("a = 1\nb = 2\nc = 3\n")
+    embedding_function.documents.clear()
+    collection.requests.clear()
+    stats = await write_files([str(path)], collection, embedding_function, configs)
+    assert stats["update"] == 1
+    # only the new line is embedded. The other chunks keep their IDs.
+    assert embedding_function.documents == ["c = 3\n"]
+    assert ids < set(collection.rows)
+    assert len(collection.rows) == len(ids) + 1
+    assert not [request for request in collection.requests if request[0] == "delete"]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_diff(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("a = 1\nb = 2\nc = 3\n")
+    configs = get_configs(tmp_path)
+    collection = FakeCollection()
+    embedding_function = CountingEmbeddingFunction()
+    await write_files([str(path)], collection, embedding_function, configs)
+    old_ids = set(collection.rows)
+
+    # b is removed, and c moves up.
+    path.write_text("a = 1\nc = 3\n")
+    embedding_function.documents.clear()
+    collection.requests.clear()
+    stats = await write_files([str(path)], collection, embedding_function, configs)
+    assert embedding_function.documents == []
+    assert stats["kept"] == 3
+    deleted = [
+        request[1]["ids"] for request in collection.requests if request[0] == "delete"
+    ]
+    assert len(deleted) == 1 and len(deleted[0]) == 1
+    assert set(collection.rows) == old_ids - set(deleted[0])
+    assert sorted(
+        (row[0], row[1].get("start_line")) for row in collection.rows.values()
+    ) == [("a = 1\n", 1), ("a.py", None), ("c = 3\n", 2)]
+
+
+@pytest.mark.asyncio
+async def test_chunked_add_unchanged(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text("a = 1\nb = 2\n")
+    configs = get_configs(tmp_path)
+    collection = FakeCollection()
+    embedding_function = CountingEmbeddingFunction()
+    manifest = Manifest(str(tmp_path / "manifest.db"), "fake-id", {})
+    await write_files([str(path)], collection, embedding_function, configs, manifest)
+    embedding_function.documents.clear()
+    collection.requests.clear()
+
+    stats = await write_files(
+        [str(path)], collection, embedding_function, configs, manifest
+    )
+    assert stats["unchanged"] == 1
+    assert collection.requests == []
+
+    # the same content with a new modification time.
+    os.utime(path, ns=(0, 0))
+    stats = await write_files(
+        [str(path)], collection, embedding_function, configs, manifest
+    )
+    assert stats["unchanged"] == 1
+    assert collection.requests == []
+    assert embedding_function.documents == []
+    fingerprint = manifest.get(str(path))
+    assert fingerprint is not None and fingerprint.mtime_ns == 0
+    manifest.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_writer_batches_files(tmp_path):
+    paths = []
+    for idx in range(5):
+        path = tmp_path / f"{idx}.py"
+        path.write_text(f"x = {idx}\n")
+        paths.append(str(path))
+    collection = FakeCollection()
+    stats = await write_files(
+        paths,
+        collection,
+        CountingEmbeddingFunction(),
+        get_configs(tmp_path),
+        batch_size=4,
+    )
+    assert stats["add"] == 5
+    # 10 chunks (a line and the path of each file) in batches of up to 4.
+    upserts = [
+        request[1]["ids"] for request in collection.requests if request[0] == "upsert"
+    ]
+    assert [len(ids) for ids in upserts] == [4, 4, 2]
+    assert len(collection.rows) == 10
+
+
+@pytest.mark.asyncio
+async def test_batch_writer_pending_budget(tmp_path):
+    paths = []
+    for idx in range(6):
+        path = tmp_path / f"{idx}.py"
+        path.write_text("".join(f"x{idx} = {line}\n" for line in range(idx + 1)))
+        paths.append(str(path))
+    configs = get_configs(tmp_path)
+    unbounded = FakeCollection()
+    await write_files(paths, unbounded, CountingEmbeddingFunction(), configs)
+    bounded = FakeCollection()
+    # every file exceeds the budget by itself, so they're written one by one.
+    stats = await write_files(
+        paths,
+        bounded,
+        CountingEmbeddingFunction(),
+        configs,
+        max_pending_chunks=1,
+        max_pending_bytes=1,
+    )
+    assert stats["add"] == 6
+    assert bounded.rows == unbounded.rows
+    upserts = [request for request in bounded.requests if request[0] == "upsert"]
+    assert len(upserts) == 6
+
+
+@pytest.mark.asyncio
+async def test_add_files_upsert_error(tmp_path):
+    paths = []
+    for idx in range(200):
+        path = tmp_path / f"{idx}.py"
+        path.write_text(f"x = {idx}\n")
+        paths.append(str(path))
+    consumed = []
+
+    def walk():
+        for path in paths:
+            consumed.append(path)
+            yield path
+
+    collection = FakeCollection()
+    collection.upsert_error = RuntimeError("disk full")
+    stats = new_stats()
+    stats_lock = Lock()
+    writer = BatchWriter(
+        collection,
+        Lock(),
+        stats,
+        stats_lock,
+        CountingEmbeddingFunction(),
+        100,
+        batch_size=2,
+    )
+    with pytest.raises(RuntimeError, match="disk full"):
+        await asyncio.wait_for(
+            add_files(
+                walk(),
+                writer,
+                stats,
+                stats_lock,
+                get_configs(tmp_path),
+                LineChunker(6, 0),
+                num_readers=2,
+            ),
+            timeout=30,
+        )
+    # the walk stops soon after the error, instead of reading every file.
+    assert len(consumed) < len(paths)
+    assert (
+        len([request for request in collection.requests if request[0] == "upsert"]) == 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_split_orphanes(tmp_path):
+    (tmp_path / "a.py").write_text("")
+    existing, missing = await split_orphanes(
+        [str(tmp_path / "a.py"), str(tmp_path / "b.py"), str(tmp_path)], 2
+    )
+    assert existing == {str(tmp_path / "a.py")}
+    # directories are not files either.
+    assert missing == {str(tmp_path / "b.py"), str(tmp_path)}
+
+
+@pytest.mark.asyncio
+async def test_find_orphanes_and_remove_paths(tmp_path):
+    collection = FakeCollection()
+    for idx in range(10):
+        path = tmp_path / f"{idx}.py"
+        if idx % 3:
+            path.write_text("")
+        for chunk in range(3):
+            collection.rows[f"{idx}-{chunk}"] = ("", {"path": str(path)}, [0.0])
+    isfile = os.path.isfile
+    checked = []
+
+    def counting_isfile(path):
+        checked.append(path)
+        return isfile(path)
+
+    with (
+        patch("os.path.isfile", side_effect=counting_isfile),
+        patch(
+            "vectorcode.subcommands.vectorise.ThreadPoolExecutor",
+            wraps=ThreadPoolExecutor,
+        ) as executor_class,
+    ):
+        orphanes = await find_orphanes(collection, 4)
+    assert orphanes == {str(tmp_path / f"{idx}.py") for idx in (0, 3, 6, 9)}
+    # paged through the collection, 4 chunks at a time.
+    assert [request[1]["limit"] for request in collection.requests] == [4] * 8
+    # one thread pool for the whole sweep, and each path is checked once.
+    assert executor_class.call_count == 1
+    assert sorted(checked) == sorted({str(tmp_path / f"{idx}.py") for idx in range(10)})
+
+    collection.requests.clear()
+    await remove_paths(collection, sorted(orphanes), batch_size=3)
+    assert len(collection.rows) == 18
+    assert all(row[1]["path"] not in orphanes for row in collection.rows.values())
+    assert [
+        len(request[1]["where"]["path"]["$in"]) for request in collection.requests
+    ] == [3, 1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("walked", [False, True])
+async def test_vectorise_priority_signals(tmp_path, walked):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "a.py").write_text("a = 1\n")
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    target = str(project) if walked else str(project / "a.py")
+    with (
+        fake_database(FakeCollection(), cache_dir, CountingEmbeddingFunction()),
+        patch(
+            "vectorcode.subcommands.vectorise.get_priority_signals",
+            new=AsyncMock(return_value=PrioritySignals()),
+        ) as get_priority_signals,
+    ):
+        configs = get_configs(project, files=[target], recursive=True)
+        assert await vectorise(configs) == 0
+    # git is only asked for the order of the files when there is one.
+    assert get_priority_signals.called == walked
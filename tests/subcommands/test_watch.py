@@ -0,0 +1,127 @@
+import os
+from contextlib import ExitStack
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fakes import CountingEmbeddingFunction, FakeCollection
+
+from vectorcode.cli_utils import ChunkMode, Config
+from vectorcode.manifest import Fingerprint, Manifest
+from vectorcode.subcommands.watch import resolve_changes, watch
+
+
+def test_resolve_changes(tmp_path):
+    (tmp_path / "kept.py").write_text("")
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "new.py").write_text("")
+    manifest = Manifest(str(tmp_path / "manifest.db"), "id", {})
+    for path in (
+        tmp_path / "kept.py",
+        tmp_path / "deleted.py",
+        tmp_path / "dir" / "gone.py",
+        tmp_path / "moved" / "a.py",
+        # not under the moved directory, though its path starts with it.
+        tmp_path / "moved.py",
+    ):
+        manifest.update(str(path), Fingerprint(1, 1, ""))
+    paths, orphanes = resolve_changes(
+        [
+            str(tmp_path / "kept.py"),
+            str(tmp_path / "deleted.py"),
+            str(tmp_path / "dir"),
+            str(tmp_path / "moved"),
+            # the temporary file that vim writes to check the permissions.
+            str(tmp_path / "4913"),
+        ],
+        manifest,
+    )
+    assert paths == [str(tmp_path / "kept.py"), str(tmp_path / "dir")]
+    assert orphanes == {
+        str(tmp_path / "deleted.py"),
+        str(tmp_path / "dir" / "gone.py"),
+        str(tmp_path / "moved" / "a.py"),
+    }
+    manifest.close()
+
+
+class StopWatching(Exception):
+    pass
+
+
+class FakeWatcher:
+    """Report the scripted changes, after running the action before each of them."""
+
+    def __init__(self, batches):
+        self.batches = iter(batches)
+        self.num_watches = 1
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def changes(self) -> set[str]:
+        try:
+            action, changes = next(self.batches)
+        except StopIteration:
+            raise StopWatching
+        action()
+        return changes
+
+
+@pytest.mark.asyncio
+async def test_watch_survives_failed_sync(tmp_path, capsys):
+    project = tmp_path / "project"
+    project.mkdir()
+    a = project / "a.py"
+    a.write_text("a = 1\n")
+    b = project / "b.py"
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    collection = FakeCollection()
+    client = MagicMock()
+    client.get_max_batch_size = AsyncMock(return_value=100)
+
+    def break_database():
+        a.write_text("a = 2\n")
+        collection.upsert_error = RuntimeError("connection refused")
+
+    def fix_database():
+        b.write_text("b = 1\n")
+        collection.upsert_error = None
+
+    watcher = FakeWatcher([(break_database, {str(a)}), (fix_database, {str(b)})])
+    module = "vectorcode.subcommands.watch"
+    with ExitStack() as stack:
+        for target, mock in (
+            (f"{module}.get_client", AsyncMock(return_value=client)),
+            (f"{module}.get_collection", AsyncMock(return_value=collection)),
+            (f"{module}.verify_ef", MagicMock(return_value=True)),
+            (
+                f"{module}.get_embedding_function",
+                MagicMock(return_value=CountingEmbeddingFunction()),
+            ),
+            (f"{module}.get_embedding_cache", MagicMock(return_value=None)),
+            (f"{module}.bump_generation", MagicMock()),
+            (f"{module}.TreeWatcher", MagicMock(return_value=watcher)),
+            ("vectorcode.common.get_cache_dir", MagicMock(return_value=cache_dir)),
+        ):
+            stack.enter_context(patch(target, new=mock))
+        with pytest.raises(StopWatching):
+            await watch(
+                Config(
+                    project_root=str(project),
+                    chunk_mode=ChunkMode.line,
+                    chunk_size=6,
+                    overlap_ratio=0,
+                )
+            )
+    assert "Failed to update 1 path(s)" in capsys.readouterr().err
+    # the failed change is written along with the next one.
+    assert sorted(row[0] for row in collection.rows.values()) == [
+        "a = 2\n",
+        "a.py",
+        "b = 1\n",
+        "b.py",
+    ]
@@ -1,4 +1,24 @@
-from vectorcode.chunking import FileChunker, StringChunker
+import re
+from io import StringIO
+
+from vectorcode.chunking import (
+    FileChunker,
+    LineChunker,
+    StringChunker,
+    TokenChunker,
+    count_truncated_chars,
+)
+
+
+class WordTokenizer:
+    """Mimics the call signature of huggingface tokenizers. Each word is a token."""
+
+    def __call__(self, text, return_offsets_mapping=False, **kwargs):
+        matches = list(re.finditer(r"\S+", text))
+        encoding = {"input_ids": [0] * len(matches)}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = [m.span() for m in matches]
+        return encoding
 
 
 class TestChunking:
@@ -46,3 +66,100 @@ class TestChunking:
         )
         for string_chunk, file_chunk in zip(string_chunks, file_chunks):
             assert string_chunk == file_chunk
+
+    def test_file_chunker_matches_string_chunker(self):
+        data = "hello world\nfoo bar baz\n" * 7
+        for chunk_size in (-1, 1, 5, 24, len(data), len(data) + 1):
+            for ratio in (0, 0.2, 0.5, 0.8):
+                for buffer_size in (1, 16, 1 << 16):
+                    file_chunker = FileChunker(
+                        chunk_size=chunk_size,
+                        overlap_ratio=ratio,
+                        buffer_size=buffer_size,
+                    )
+                    string_chunker = StringChunker(
+                        chunk_size=chunk_size, overlap_ratio=ratio
+                    )
+                    assert list(file_chunker.chunk(StringIO(data))) == list(
+                        string_chunker.chunk(data)
+                    ), f"{chunk_size=}, {ratio=}, {buffer_size=}"
+
+    def test_file_chunker_empty_file(self):
+        assert list(FileChunker(chunk_size=5).chunk(StringIO(""))) == []
+        assert list(FileChunker().chunk(StringIO(""))) == [""]
+
+    def test_line_chunker_ranges(self):
+        data = "".join(f"def func_{i}():\n    return 'ß{i}'\n\n" for i in range(20))
+        encoded = data.encode()
+        lines = data.splitlines(keepends=True)
+        chunks = list(
+            LineChunker(chunk_size=60, overlap_ratio=0.2).chunk(StringIO(data))
+        )
+        assert chunks[0].start_line == 1
+        assert chunks[-1].end_line == len(lines)
+        for chunk in chunks:
+            assert len(chunk.text) <= 60
+            assert chunk.text == "".join(lines[chunk.start_line - 1 : chunk.end_line])
+            assert encoded[chunk.start_byte : chunk.end_byte].decode() == chunk.text
+        for prev, curr in zip(chunks, chunks[1:]):
+            assert prev.start_line < curr.start_line <= prev.end_line + 1
+
+    def test_line_chunker_crlf(self, tmp_path):
+        path = tmp_path / "crlf.txt"
+        path.write_bytes(b"".join(b"line %d\r\n\r\n" % i for i in range(10)))
+        with open(path, newline="") as fin:
+            chunks = list(LineChunker(chunk_size=20, overlap_ratio=0).chunk(fin))
+        encoded = path.read_bytes()
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert encoded[chunk.start_byte : chunk.end_byte].decode() == chunk.text
+        assert chunks[1].start_line == 5
+
+    def test_line_chunker_snaps_to_blank_lines(self):
+        data = "a = 1\nb = 2\n\nc = 3\nd = 4\n"
+        chunks = list(LineChunker(chunk_size=20, overlap_ratio=0).chunk(StringIO(data)))
+        assert [chunk.text for chunk in chunks] == [
+            "a = 1\nb = 2\n\n",
+            "c = 3\nd = 4\n",
+        ]
+
+    def test_line_chunker_long_line(self):
+        data = "short\n" + "x" * 25 + "\nend"
+        chunks = list(LineChunker(chunk_size=10, overlap_ratio=0).chunk(StringIO(data)))
+        assert [chunk.text for chunk in chunks] == [
+            "short\n",
+            "x" * 10,
+            "x" * 10,
+            "x" * 5 + "\n",
+            "end",
+        ]
+        assert [chunk.start_line for chunk in chunks] == [1, 2, 2, 2, 3]
+        assert chunks[2].start_byte == 16
+
+    def test_line_chunker_no_chunking(self):
+        data = "hello\nworld"
+        chunks = list(LineChunker().chunk(StringIO(data)))
+        assert len(chunks) == 1
+        assert chunks[0].text == data
+        assert (chunks[0].start_line, chunks[0].end_line) == (1, 2)
+        assert list(LineChunker(chunk_size=5).chunk(StringIO(""))) == []
+
+    def test_token_chunker(self):
+        data = "".join(f"word{i} " * (i % 4 + 1) + "\n" for i in range(30))
+        chunker = TokenChunker(WordTokenizer(), chunk_size=6, overlap_ratio=0.2)
+        chunks = list(chunker.chunk(StringIO(data)))
+        assert chunks[-1].end_line == 30
+        for chunk in chunks:
+            assert len(chunk.text.split()) <= 6
+
+    def test_token_chunker_long_line(self):
+        data = " ".join(f"w{i}" for i in range(10))
+        chunker = TokenChunker(WordTokenizer(), chunk_size=4, overlap_ratio=0)
+        chunks = [chunk.text.split() for chunk in chunker.chunk(StringIO(data))]
+        assert sum(chunks, []) == data.split()
+        assert all(len(chunk) <= 4 for chunk in chunks)
+
+    def test_count_truncated_chars(self):
+        tokenizer = WordTokenizer()
+        assert count_truncated_chars(tokenizer, "a b c", 3) == 0
+        assert count_truncated_chars(tokenizer, "a b c d", 2) == len("c d")
@@ -7,8 +7,11 @@ from unittest.mock import patch
 import pytest
 
 from vectorcode.cli_utils import (
+    LAST_INDEXED_COMMIT,
+    ChunkMode,
     CliAction,
     Config,
+    QueryMode,
     expand_envs_in_dict,
     expand_globs,
     expand_path,
@@ -92,6 +95,17 @@ async def test_config_merge_from_new_fields():
     assert merged_config.recursive
 
 
+@pytest.mark.asyncio
+async def test_config_merge_from_zero():
+    config1 = Config(refresh_budget=8, max_file_size=100, pipe=True)
+    config2 = Config(refresh_budget=0, max_file_size=0, pipe=False)
+    merged_config = await config1.merge_from(config2)
+    # explicit zeros are kept, unset flags fall back.
+    assert merged_config.refresh_budget == 0
+    assert merged_config.max_file_size == 0
+    assert merged_config.pipe
+
+
 @pytest.mark.asyncio
 async def test_config_import_from_missing_keys():
     config_dict: Dict[str, Any] = {}  # Empty dictionary, all keys missing
@@ -105,6 +119,12 @@ async def test_config_import_from_missing_keys():
     assert config.db_path == os.path.expanduser("~/.local/share/vectorcode/chromadb/")
     assert config.chunk_size == -1
     assert config.overlap_ratio == 0.2
+    assert config.chunk_mode == ChunkMode.char
+    assert config.max_file_size == 1024 * 1024
+    assert config.embedding_cache_size == 512 * 1024 * 1024
+    assert config.max_pending_chunks == 4096
+    assert config.workers == 1
+    assert config.max_pending_bytes == 64 * 1024 * 1024
     assert config.query_multiplier == -1
     assert config.reranker is None
     assert config.reranker_params == {}
@@ -274,3 +294,129 @@ async def test_cli_arg_parser():
         assert config.query == ["test_query"]
         assert config.n_result == 5
         assert config.use_absolute_path
+        assert config.refresh_budget == 4
+        assert config.query_mode == QueryMode.auto
+    with patch(
+        "sys.argv", ["vectorcode", "query", "test_query", "--refresh_budget", "-1"]
+    ):
+        config = await parse_cli_args()
+        assert config.refresh_budget == -1
+    with patch(
+        "sys.argv", ["vectorcode", "query", "test_query", "--query_mode", "hybrid"]
+    ):
+        config = await parse_cli_args()
+        assert config.query_mode == QueryMode.hybrid
+    with patch("sys.argv", ["vectorcode", "query", "--batch", "-"]):
+        config = await parse_cli_args()
+        assert config.batch == "-"
+        assert not config.query
+    with patch("sys.argv", ["vectorcode", "query"]):
+        with pytest.raises(SystemExit):
+            await parse_cli_args()
+    with patch(
+        "sys.argv",
+        ["vectorcode", "query", "q", "--project_root", "a", "--project_root", "b"],
+    ):
+        config = await parse_cli_args()
+        assert config.project_root == "a"
+        assert config.project_roots == ["a", "b"]
+    with patch("sys.argv", ["vectorcode", "query", "q", "--all"]):
+        config = await parse_cli_args()
+        assert config.query_all
+        assert config.project_roots == []
+    with patch("sys.argv", ["vectorcode", "query", "--batch", "-", "--all"]):
+        with pytest.raises(SystemExit):
+            await parse_cli_args()
+    with patch(
+        "sys.argv",
+        ["vectorcode", "ls", "--project_root", "a", "--project_root", "b"],
+    ):
+        with pytest.raises(SystemExit):
+            await parse_cli_args()
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_chunk_mode():
+    with patch(
+        "sys.argv", ["vectorcode", "vectorise", "file.py", "--chunk_mode", "line"]
+    ):
+        config = await parse_cli_args()
+        assert config.chunk_mode == ChunkMode.line
+    with patch("sys.argv", ["vectorcode", "vectorise", "file.py"]):
+        config = await parse_cli_args()
+        assert config.chunk_mode == ChunkMode.char
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_resume():
+    with patch("sys.argv", ["vectorcode", "vectorise", "--resume"]):
+        config = await parse_cli_args()
+        assert config.resume
+        assert config.files == []
+    with patch("sys.argv", ["vectorcode", "vectorise", "file.py"]):
+        config = await parse_cli_args()
+        assert not config.resume
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_since():
+    with patch("sys.argv", ["vectorcode", "update"]):
+        assert (await parse_cli_args()).since is None
+    with patch("sys.argv", ["vectorcode", "update", "--since"]):
+        assert (await parse_cli_args()).since == LAST_INDEXED_COMMIT
+    with patch("sys.argv", ["vectorcode", "update", "--since", "HEAD~3"]):
+        assert (await parse_cli_args()).since == "HEAD~3"
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_watch():
+    with patch("sys.argv", ["vectorcode", "watch"]):
+        config = await parse_cli_args()
+        assert config.action == CliAction.watch
+        assert config.files == []
+        assert config.recursive
+        assert config.debounce == 0.5
+    with patch("sys.argv", ["vectorcode", "watch", "src", "--debounce", "2"]):
+        config = await parse_cli_args()
+        assert config.files == ["src"]
+        assert config.debounce == 2
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_files_from():
+    with patch("sys.argv", ["vectorcode", "vectorise", "--files_from", "-"]):
+        config = await parse_cli_args()
+        assert config.files_from == "-"
+        assert config.files == []
+    with patch("sys.argv", ["vectorcode", "vectorise", "file.py"]):
+        assert (await parse_cli_args()).files_from is None
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_workers():
+    with patch("sys.argv", ["vectorcode", "vectorise", "--workers", "4", "src"]):
+        assert (await parse_cli_args()).workers == 4
+    with patch("sys.argv", ["vectorcode", "update", "--workers", "2"]):
+        assert (await parse_cli_args()).workers == 2
+    with patch("sys.argv", ["vectorcode", "update"]):
+        assert (await parse_cli_args()).workers == 1
+
+
+@pytest.mark.asyncio
+async def test_cli_arg_parser_prioritise():
+    with patch(
+        "sys.argv",
+        [
+            "vectorcode",
+            "vectorise",
+            "-r",
+            ".",
+            "--prioritise",
+            "a.py",
+            "--prioritise",
+            "b.py",
+        ],
+    ):
+        config = await parse_cli_args()
+        assert config.prioritise == ["a.py", "b.py"]
+        assert config.files == ["."]
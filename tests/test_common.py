@@ -16,6 +16,7 @@ from vectorcode.common import (
     get_collection,
     get_collection_name,
     get_embedding_function,
+    get_embedding_tokenizer,
     start_server,
     try_server,
     verify_ef,
@@ -45,6 +46,17 @@ def test_get_collection_name():
         assert collection_name == collection_name3
 
 
+def test_get_embedding_tokenizer():
+    embedding_function = MagicMock()
+    embedding_function._model.max_seq_length = 256
+    embedding_function._model.tokenizer.num_special_tokens_to_add.return_value = 2
+    tokenizer, max_tokens = get_embedding_tokenizer(embedding_function)
+    assert tokenizer is embedding_function._model.tokenizer
+    assert max_tokens == 254
+
+    assert get_embedding_tokenizer(MagicMock(spec=[])) is None
+
+
 def test_get_embedding_function():
     # Test with a valid embedding function
     config = Config(
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+
+import numpy
+import pytest
+
+from vectorcode.embedding_cache import EmbeddingCache
+
+
+def make_embeddings(keys, dim=8) -> dict:
+    return {
+        key: numpy.full(dim, i / 10, dtype=numpy.float32) for i, key in enumerate(keys)
+    }
+
+
+def test_embedding_cache_roundtrip():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        cache = EmbeddingCache(temp_dir, 1024 * 1024)
+        assert cache.get(["a"]) == {}
+        embeddings = make_embeddings(["a", "b", "c"])
+        cache.put(embeddings)
+        cache.close()
+
+        cache = EmbeddingCache(temp_dir, 1024 * 1024)
+        assert len(cache) == 3
+        cached = cache.get(["a", "c", "d"])
+        assert set(cached.keys()) == {"a", "c"}
+        for key in cached:
+            assert cached[key].dtype == numpy.float32
+            numpy.testing.assert_allclose(cached[key], embeddings[key], atol=1e-3)
+        cache.close()
+
+
+def test_embedding_cache_lru_eviction():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        # room for 4 embeddings of 8 float16 values.
+        cache = EmbeddingCache(temp_dir, 4 * 8 * 2)
+        cache.put(make_embeddings(["a", "b", "c", "d"]))
+        assert cache.capacity == 4
+        # "a" becomes the most recently used.
+        cache.get(["a"])
+        cache.put(make_embeddings(["e", "f"]))
+        assert len(cache) == 4
+        assert set(cache.get(["a", "b", "c", "d", "e", "f"]).keys()) == {
+            "a",
+            "d",
+            "e",
+            "f",
+        }
+        assert os.path.getsize(os.path.join(temp_dir, "vectors.f16")) == 4 * 8 * 2
+        cache.close()
+
+
+def test_embedding_cache_overflow():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        cache = EmbeddingCache(temp_dir, 1024)
+        cache.put(
+            {
+                "small": numpy.ones(4, dtype=numpy.float32),
+                "large": numpy.full(4, 1e6, dtype=numpy.float32),
+            }
+        )
+        assert set(cache.get(["small", "large"]).keys()) == {"small"}
+        cache.close()
+
+
+def expected_embedding(key: str, dim=8):
+    return numpy.full(dim, int(key) / 7, dtype=numpy.float32)
+
+
+def put_many(directory: str, worker: int, barrier):
+    cache = EmbeddingCache(directory, 1024 * 1024)
+    barrier.wait()
+    for i in range(200):
+        keys = [str(worker * 10000 + i * 5 + j) for j in range(5)]
+        cache.put({key: expected_embedding(key) for key in keys})
+    cache.close()
+
+
+def test_embedding_cache_concurrent_writers():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Barrier(4)
+        workers = [
+            ctx.Process(target=put_many, args=(temp_dir, i, barrier)) for i in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        cache = EmbeddingCache(temp_dir, 1024 * 1024)
+        keys = [str(worker * 10000 + i) for worker in range(4) for i in range(1000)]
+        cached = cache.get(keys)
+        assert len(cache) == len(cached) == 4000
+        for key, embedding in cached.items():
+            numpy.testing.assert_allclose(embedding, expected_embedding(key), rtol=1e-2)
+        cache.close()
+
+
+class FailingConnection:
+    """A connection that fails to record new entries, like a crashed writer."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, sql: str, *args):
+        if sql.startswith("INSERT OR REPLACE INTO entries"):
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(sql, *args)
+
+
+def test_embedding_cache_failed_put_keeps_entries():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        cache = EmbeddingCache(temp_dir, 4 * 8 * 2)
+        old = make_embeddings(["a", "b", "c", "d"])
+        cache.put(old)
+        conn = cache._EmbeddingCache__conn
+        cache._EmbeddingCache__conn = FailingConnection(conn)
+        new = {h: numpy.full(8, 5.0, dtype=numpy.float32) for h in ("e", "f")}
+        with pytest.raises(sqlite3.OperationalError):
+            cache.put(new)
+        cache._EmbeddingCache__conn = conn
+        # the entries that survived still have their own vectors.
+        found = cache.get(["a", "b", "c", "d"])
+        assert found
+        for h, vector in found.items():
+            numpy.testing.assert_allclose(vector, old[h], atol=1e-3)
+        # and the rows of the evicted ones are reused.
+        cache.put(new)
+        numpy.testing.assert_allclose(cache.get(["e"])["e"], new["e"])
+        assert len(cache) == 4
+        assert os.path.getsize(os.path.join(temp_dir, "vectors.f16")) == 4 * 8 * 2
+        cache.close()
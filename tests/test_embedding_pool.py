@@ -0,0 +1,25 @@
+from vectorcode.cli_utils import Config
+from vectorcode.embedding_pool import MIN_SHARD_SIZE, EmbeddingPool, split_shards
+
+
+def test_split_shards():
+    documents = [str(i) for i in range(100)]
+    shards = split_shards(documents, 3)
+    assert [len(shard) for shard in shards] == [34, 33, 33]
+    assert sum(shards, []) == documents
+
+    # small inputs are not split into tiny shards.
+    assert split_shards(documents[: MIN_SHARD_SIZE * 2], 8) == [
+        documents[:MIN_SHARD_SIZE],
+        documents[MIN_SHARD_SIZE : MIN_SHARD_SIZE * 2],
+    ]
+    assert split_shards(documents[:3], 8) == [documents[:3]]
+    assert split_shards([], 4) == [[]]
+
+
+def test_embedding_pool_empty_input():
+    pool = EmbeddingPool(Config(), 2)
+    try:
+        assert pool([]) == []
+    finally:
+        pool.close()
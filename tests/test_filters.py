@@ -0,0 +1,50 @@
+import base64
+import os
+import random
+import tempfile
+
+from vectorcode.filters import entropy, should_skip, sniff_content
+
+
+def test_entropy():
+    assert entropy(b"") == 0
+    assert entropy(b"aaaa") == 0
+    assert entropy(bytes(range(256))) == 8
+
+
+def test_sniff_content():
+    source = b"def foo():\n    return 1\n\n" * 100
+    assert sniff_content(source) is None
+    assert sniff_content(b"\x89PNG\r\n\x1a\n\0\0\0") == "binary"
+    assert sniff_content(b"\xff\xfe\xfd text") == "binary"
+    # a multibyte character cut in half at the end of the sniffed bytes.
+    assert sniff_content("ß".encode() * 10 + "ß".encode()[:1]) is None
+    assert (
+        sniff_content(b"// Code generated by protoc-gen-go. DO NOT EDIT.\n" + source)
+        == "generated"
+    )
+    assert sniff_content(b"var a=1;" * 1000) == "minified"
+
+    random.seed(0)
+    blob = bytes(random.getrandbits(8) for _ in range(4096)).hex().encode()
+    blob = b"\n".join(blob[i : i + 76] for i in range(0, len(blob), 76))
+    assert sniff_content(blob) is None  # hex only uses 16 symbols.
+    encoded = base64.encodebytes(bytes(random.getrandbits(8) for _ in range(4096)))
+    assert sniff_content(encoded) == "high entropy"
+
+
+def test_should_skip():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        source_file = os.path.join(temp_dir, "main.py")
+        with open(source_file, "w") as fout:
+            fout.write("print('hello world')\n" * 100)
+        assert should_skip(source_file) is None
+        assert should_skip(source_file, max_file_size=100) == "too large"
+        assert should_skip(source_file, max_file_size=-1) is None
+
+        lock_file = os.path.join(temp_dir, "package-lock.json")
+        with open(lock_file, "w") as fout:
+            fout.write("{}")
+        assert should_skip(lock_file) == "lock file"
+        assert should_skip(os.path.join(temp_dir, "bundle.min.js")) == "generated"
+        assert should_skip(os.path.join(temp_dir, "missing.py")) == "unreadable"
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+from vectorcode.freshness import (
+    find_stale_files,
+    get_candidate_files,
+    start_background_update,
+)
+from vectorcode.manifest import Fingerprint, Manifest
+
+
+def test_get_candidate_files():
+    results = {
+        "ids": [["1", "2", "3"], ["4", "5"]],
+        "metadatas": [
+            [{"path": "a.py"}, {"path": "b.py"}, {"path": "c.py"}],
+            [{"path": "d.py"}, {"path": "a.py"}],
+        ],
+    }
+    assert get_candidate_files(results) == ["a.py", "d.py", "b.py", "c.py"]
+    assert get_candidate_files({"ids": [], "metadatas": []}) == []
+
+
+def test_find_stale_files():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        manifest = Manifest(
+            os.path.join(temp_dir, "manifest.db"), "collection", {"chunk_size": 100}
+        )
+        paths = {
+            name: os.path.join(temp_dir, name)
+            for name in ["fresh.py", "stale.py", "unknown.py", "deleted.py"]
+        }
+        for name in ["fresh.py", "stale.py", "unknown.py"]:
+            with open(paths[name], "w") as fout:
+                fout.write(name)
+        for name in ["fresh.py", "stale.py", "deleted.py"]:
+            stat = os.stat(paths["fresh.py"])
+            size = stat.st_size if name != "stale.py" else stat.st_size + 1
+            manifest.update(paths[name], Fingerprint(size, stat.st_mtime_ns, "hash"))
+
+        stale, deleted = find_stale_files(paths.values(), manifest)
+        assert stale == [paths["stale.py"], paths["unknown.py"]]
+        assert deleted == [paths["deleted.py"]]
+        manifest.close()
+
+
+def test_start_background_update():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        lock_path = os.path.join(temp_dir, "refresh.lock")
+        args = [sys.executable, "-c", "import time; time.sleep(2)"]
+        assert start_background_update(temp_dir, lock_path, args)
+        # the first one is still running.
+        assert not start_background_update(temp_dir, lock_path, args)
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from vectorcode.git import (
+    GitChanges,
+    get_changes,
+    get_head,
+    parse_log_names,
+    parse_name_status,
+    parse_untracked,
+)
+
+
+def git(cwd: str, *args: str):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+def write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fout:
+        fout.write(content)
+
+
+def test_parse_name_status():
+    changes = GitChanges()
+    parse_name_status(
+        "M\0a.py\0D\0b.py\0R095\0old.py\0new.py\0A\0dir/c.py\0", changes, "/repo"
+    )
+    assert changes.changed == {"/repo/a.py", "/repo/new.py", "/repo/dir/c.py"}
+    assert changes.deleted == {"/repo/b.py", "/repo/old.py"}
+    assert changes.renamed == {"/repo/new.py": "/repo/old.py"}
+
+
+def test_parse_log_names():
+    output = "\x01\0\nb.py\0a.py\0\x01\0\nc.py\0b.py\0\x01\0\nd.py\0e.py\0f.py\0"
+    assert parse_log_names(output, "/r") == [
+        "/r/b.py",
+        "/r/a.py",
+        "/r/c.py",
+        "/r/d.py",
+        "/r/e.py",
+        "/r/f.py",
+    ]
+    assert parse_log_names(output, "/r", max_files_per_commit=2) == [
+        "/r/b.py",
+        "/r/a.py",
+        "/r/c.py",
+    ]
+
+
+def test_parse_untracked():
+    assert parse_untracked("?? new.py\0 M a.py\0R  x.py\0y.py\0?? d/e.py\0", "/r") == {
+        "/r/new.py",
+        "/r/d/e.py",
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_changes():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        temp_dir = os.path.realpath(temp_dir)
+        git(temp_dir, "init", "-q")
+        write(os.path.join(temp_dir, "a.py"), "a = 1\n")
+        write(os.path.join(temp_dir, "b.py"), "b = 1\n")
+        write(os.path.join(temp_dir, "c.py"), "c = 1\n" * 10)
+        write(os.path.join(temp_dir, ".gitignore"), "*.log\n")
+        git(temp_dir, "add", ".")
+        git(temp_dir, "commit", "-q", "-m", "init")
+        first = await get_head(temp_dir)
+        assert first is not None
+
+        write(os.path.join(temp_dir, "a.py"), "a = 2\n")
+        git(temp_dir, "rm", "-q", "b.py")
+        git(temp_dir, "mv", "c.py", "d.py")
+        git(temp_dir, "commit", "-q", "-am", "second")
+        write(os.path.join(temp_dir, "untracked", "e.py"), "e = 1\n")
+        write(os.path.join(temp_dir, "ignored.log"), "")
+        os.symlink("a.py", os.path.join(temp_dir, "link.py"))
+        git(temp_dir, "add", "link.py")
+
+        changes = await get_changes(temp_dir, first)
+        assert changes is not None
+        assert changes.changed == {
+            os.path.join(temp_dir, "a.py"),
+            os.path.join(temp_dir, "d.py"),
+            os.path.join(temp_dir, "untracked", "e.py"),
+        }
+        assert changes.deleted == {
+            os.path.join(temp_dir, "b.py"),
+            os.path.join(temp_dir, "c.py"),
+        }
+
+        assert await get_changes(temp_dir, "not-a-commit") is None
+
+
+@pytest.mark.asyncio
+async def test_get_changes_not_a_repo():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        assert await get_head(temp_dir) is None
+        assert await get_changes(temp_dir, "HEAD") is None
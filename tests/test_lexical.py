@@ -0,0 +1,183 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from vectorcode.cli_utils import Config, QueryMode
+from vectorcode.lexical import (
+    LexicalIndex,
+    fuse_rankings,
+    get_lexical_result,
+    get_path_terms,
+    get_query_terms,
+    get_terms,
+    is_identifier_query,
+)
+
+
+def test_get_terms():
+    terms = get_terms("getCollection(client) + max_batch_size")
+    assert terms["i:getcollection"] == 1
+    assert terms["i:max_batch_size"] == 1
+    assert terms["w:get"] == 1
+    assert terms["w:collection"] == 1
+    assert terms["w:batch"] == 1
+    assert terms["i:client"] == 1
+    assert terms["t:col"] == 1
+    assert get_terms("") == {}
+
+
+def test_get_path_terms():
+    terms = get_path_terms("src/vectorcode/common.py")
+    assert terms["p:src/vectorcode/common.py"] == 1
+    assert terms["p:common.py"] == 1
+    assert terms["p:common"] == 1
+    assert terms["i:vectorcode"] == 1
+
+
+def test_get_query_terms():
+    terms = get_query_terms(["./common.py"])
+    assert terms["p:common.py"] == 1
+    assert terms["i:common"] == 1
+
+
+def test_is_identifier_query():
+    assert is_identifier_query(["get_collection"])
+    assert is_identifier_query(["BatchWriter", "src/vectorcode/common.py"])
+    assert is_identifier_query(["Config.merge_from"])
+    assert is_identifier_query(["std::vector", "getCollection()", "__init__"])
+    assert is_identifier_query(["common.py"])
+    assert not is_identifier_query(["how are the chunks written?"])
+    assert not is_identifier_query(["get_collection", "load a file"])
+    # the words are judged together, and plain words aren't identifiers.
+    assert not is_identifier_query("how does the cache work".split())
+    assert not is_identifier_query(["Manifest"])
+    assert not is_identifier_query(["the", "end."])
+    assert not is_identifier_query(["3.5"])
+    assert not is_identifier_query([])
+    assert not is_identifier_query(None)
+
+
+def write_chunks(path, chunks: list[str]) -> list[tuple]:
+    """Write the chunks to a file, and return their locations."""
+    content = "".join(chunks)
+    path.write_text(content)
+    locations = []
+    start_byte, start_line = 0, 1
+    for chunk in chunks:
+        end_line = start_line + chunk.count("\n") - 1
+        end_byte = start_byte + len(chunk.encode())
+        locations.append((chunk, start_line, end_line, start_byte, end_byte))
+        start_byte, start_line = end_byte, end_line + 1
+    return locations
+
+
+def test_lexical_index_search(tmp_path):
+    common = tmp_path / "common.py"
+    main = tmp_path / "main.py"
+    index = LexicalIndex(sqlite3.connect(":memory:"))
+    index.replace(
+        str(common),
+        "common.py",
+        write_chunks(
+            common,
+            [
+                "def get_collection(client):\n    pass\n",
+                "def get_client(configs):\n    pass\n",
+            ],
+        ),
+    )
+    index.replace(
+        str(main),
+        "main.py",
+        write_chunks(main, ["collection = get_collection(client)\n"]),
+        hashlib.sha256(main.read_bytes()).hexdigest(),
+    )
+    index.replace("/project/empty.py", "empty.py", [])
+    index.replace("/project/other.py", "other.py", [("print('hello')\n", 1, 1, 0, 15)])
+    assert index.has("/project/empty.py")
+
+    terms = get_query_terms(["get_collection"])
+    assert index.has_exact_match(terms)
+    assert not index.has_exact_match(get_query_terms(["nothing_here"]))
+    files, snippets = index.search(terms, 2)
+    assert set(files) == {str(common), str(main)}
+    assert snippets[str(common)][0].start_line == 1
+    assert snippets[str(common)][0].text == "def get_collection(client):\n    pass\n"
+    assert [snippet.text for snippet in snippets[str(main)]] == [
+        "collection = get_collection(client)\n"
+    ]
+
+    # the chunks of a file that has changed since it was indexed aren't read.
+    main.write_text("something else\n")
+    files, snippets = index.search(terms, 2)
+    assert str(main) in files
+    assert snippets[str(main)] == []
+
+    files, _ = index.search(get_query_terms(["main.py"]), 1)
+    assert files == [str(main)]
+
+    files, _ = index.search(terms, 2, exclude=[str(main)])
+    assert files == [str(common)]
+
+    index.remove([str(common)])
+    assert not index.has(str(common))
+    files, _ = index.search(terms, 2)
+    assert files == [str(main)]
+
+
+def test_lexical_index_drops_chunk_text():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE lexical_chunks (id INTEGER PRIMARY KEY, path TEXT, text TEXT)"
+    )
+    conn.execute("CREATE TABLE lexical_files (path TEXT PRIMARY KEY)")
+    conn.execute("CREATE TABLE lexical_postings (term TEXT, chunk INTEGER)")
+    conn.execute("INSERT INTO lexical_files (path) VALUES ('/a.py')")
+    index = LexicalIndex(conn)
+    # the old index is dropped, so that the files are indexed again.
+    assert not index.has("/a.py")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(lexical_chunks)")]
+    assert "text" not in columns
+
+
+def test_fuse_rankings():
+    assert fuse_rankings([["a", "b", "c"], ["b"]]) == ["b", "a", "c"]
+    assert fuse_rankings([["a"], []]) == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_get_lexical_result():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        configs = Config(project_root=temp_dir, query=["load the config"])
+        # not an identifier.
+        assert await get_lexical_result(configs) is None
+        configs.query = ["load_config"]
+        # no index.
+        assert await get_lexical_result(configs) is None
+        configs.query_mode = QueryMode.vector
+        assert await get_lexical_result(configs) is None
+
+        os.makedirs(os.path.join(temp_dir, "cache"))
+        db_path = os.path.join(temp_dir, "cache", "manifest.db")
+        conn = sqlite3.connect(db_path)
+        LexicalIndex(conn).replace(
+            os.path.join(temp_dir, "a.py"),
+            "a.py",
+            [("def load_config(): ...", 1, 1, 0, 22)],
+        )
+        conn.commit()
+        conn.close()
+
+        with patch("vectorcode.lexical.get_lexical_index_path", return_value=db_path):
+            configs.query_mode = QueryMode.auto
+            files, _ = await get_lexical_result(configs)
+            assert files == [os.path.join(temp_dir, "a.py")]
+            # no exact match.
+            configs.query = ["something_else"]
+            assert await get_lexical_result(configs) is None
+            configs.query_mode = QueryMode.lexical
+            assert await get_lexical_result(configs) == ([], {})
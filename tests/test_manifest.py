@@ -0,0 +1,141 @@
+import os
+import tempfile
+
+from vectorcode.manifest import Fingerprint, Manifest, is_stat_unchanged
+
+
+def test_manifest_roundtrip():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get("a.py") is None
+        manifest.update("a.py", Fingerprint(1, 2, "hash_a"))
+        manifest.update("b.py", Fingerprint(3, 4, "hash_b"))
+        manifest.remove(["b.py"])
+        manifest.close()
+
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get("a.py") == Fingerprint(1, 2, "hash_a")
+        assert manifest.paths() == ["a.py"]
+        manifest.close()
+
+
+def test_manifest_invalidation():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        manifest.update("a.py", Fingerprint(1, 2, "hash_a"))
+        manifest.close()
+
+        # different settings
+        manifest = Manifest(db_path, "collection", {"chunk_size": 200})
+        assert manifest.get("a.py") is None
+        manifest.update("a.py", Fingerprint(1, 2, "hash_a"))
+        manifest.close()
+
+        # re-created collection
+        manifest = Manifest(db_path, "new_collection", {"chunk_size": 200})
+        assert manifest.get("a.py") is None
+        manifest.close()
+
+
+def test_manifest_lexical_index():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        manifest.lexical.replace("/a.py", "a.py", [("def foo(): pass", 1, 1, 0, 15)])
+        manifest.lexical.replace("/b.py", "b.py", [("def bar(): pass", 1, 1, 0, 15)])
+        manifest.remove(["/b.py"])
+        manifest.close()
+
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.lexical.has("/a.py")
+        assert not manifest.lexical.has("/b.py")
+        manifest.close()
+
+        # the index is cleared along with the fingerprints.
+        manifest = Manifest(db_path, "collection", {"chunk_size": 200})
+        assert not manifest.lexical.has("/a.py")
+        manifest.close()
+
+
+def test_manifest_no_reset():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.is_valid
+        manifest.update("a.py", Fingerprint(1, 2, "hash_a"))
+        manifest.close()
+
+        manifest = Manifest(db_path, "collection", {"chunk_size": 200}, reset=False)
+        assert not manifest.is_valid
+        manifest.close()
+
+        # the fingerprints are kept for the owner of the settings.
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.is_valid
+        assert manifest.get("a.py") == Fingerprint(1, 2, "hash_a")
+        manifest.close()
+
+
+def test_is_stat_unchanged():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        file_path = os.path.join(temp_dir, "file.txt")
+        with open(file_path, "w") as fout:
+            fout.write("hello")
+        stat = os.stat(file_path)
+        fingerprint = Fingerprint(stat.st_size, stat.st_mtime_ns, "hash")
+        assert is_stat_unchanged(fingerprint, stat)
+        assert not is_stat_unchanged(None, stat)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert not is_stat_unchanged(fingerprint, os.stat(file_path))
+
+
+def test_manifest_run_progress():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get_run() is None
+        manifest.begin_run({"files": ["/project"], "recursive": True})
+        manifest.mark_in_progress("a.py")
+        manifest.mark_in_progress("b.py")
+        manifest.mark_in_progress("c.py")
+        manifest.update("a.py", Fingerprint(1, 2, "hash_a"))
+        manifest.remove(["c.py"])
+        manifest.commit()
+        # interrupted: the connection is never closed.
+        del manifest
+
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get_run() == {"files": ["/project"], "recursive": True}
+        assert manifest.in_progress_paths() == ["b.py"]
+        assert manifest.get("a.py") == Fingerprint(1, 2, "hash_a")
+        manifest.end_run()
+        assert manifest.get_run() is None
+        manifest.close()
+
+
+def test_manifest_values():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        db_path = os.path.join(temp_dir, "manifest.db")
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get_value("git_dirty") is None
+        manifest.set_value("git_dirty", ["a.py"])
+        manifest.close()
+
+        manifest = Manifest(db_path, "collection", {"chunk_size": 100})
+        assert manifest.get_value("git_dirty") == ["a.py"]
+        manifest.set_value("git_dirty", None)
+        assert manifest.get_value("git_dirty") is None
+        manifest.close()
+
+
+def test_manifest_paths_in():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        manifest = Manifest(os.path.join(temp_dir, "manifest.db"), "collection", {})
+        for path in ("/p/a.py", "/p/d/b.py", "/p/d/e/c.py", "/p/d.py", "/p/d0/f.py"):
+            manifest.update(path, Fingerprint(1, 1, ""))
+        assert sorted(manifest.paths_in("/p/d")) == ["/p/d/b.py", "/p/d/e/c.py"]
+        assert sorted(manifest.paths_in("/p/d/")) == ["/p/d/b.py", "/p/d/e/c.py"]
+        assert manifest.paths_in("/q") == []
+        manifest.close()
@@ -0,0 +1,113 @@
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from vectorcode.priority import (
+    IndexProgress,
+    PrioritySignals,
+    get_hot_files,
+    get_priority_signals,
+    prioritise,
+)
+
+
+def write(path: str, content: str = ""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fout:
+        fout.write(content)
+
+
+def test_prioritise():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        paths = {
+            name: os.path.join(temp_dir, name)
+            for name in ["a.py", "b.py", "open.py", "dirty.py", "ignored.py"]
+        }
+        for path in paths.values():
+            write(path)
+        write(os.path.join(temp_dir, "recent", "old.py"))
+        write(os.path.join(temp_dir, "recent", "new.py"))
+        signals = PrioritySignals(
+            open_files={paths["open.py"], os.path.join(temp_dir, "missing.py")},
+            dirty_files={paths["dirty.py"], paths["ignored.py"]},
+            recent_files={
+                os.path.join(temp_dir, "recent", "new.py"): 0,
+                os.path.join(temp_dir, "recent", "old.py"): 1,
+            },
+        )
+        hot_files = get_hot_files(signals, lambda path: path != paths["ignored.py"])
+        consumed = []
+
+        def walk():
+            for path in [paths["a.py"], paths["dirty.py"], paths["b.py"]] + [
+                os.path.join(temp_dir, "recent", name) for name in ["new.py", "old.py"]
+            ]:
+                consumed.append(path)
+                yield path
+
+        files = prioritise(walk(), hot_files)
+        assert [next(files) for _ in hot_files] == hot_files
+        # the walk only starts after the hot files.
+        assert consumed == []
+        assert [
+            os.path.relpath(path, temp_dir) for path in hot_files + list(files)
+        ] == [
+            "open.py",
+            "dirty.py",
+            "recent/new.py",
+            "recent/old.py",
+            "a.py",
+            "b.py",
+        ]
+
+
+def test_index_progress():
+    progress = IndexProgress(["a", "b", "c", "d"], thresholds=(0.5, 1.0))
+    progress.done("not hot")
+    progress.done("a")
+    assert progress.report() == {"50%": None, "100%": None}
+    progress.done("b")
+    progress.done("b")
+    report = progress.report()
+    assert report["50%"] is not None and report["100%"] is None
+    progress.done("c")
+    progress.done("d")
+    assert progress.report()["100%"] is not None
+    assert progress.num_hot_files == 4
+
+
+@pytest.mark.asyncio
+async def test_get_priority_signals(monkeypatch):
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        temp_dir = os.path.realpath(temp_dir)
+
+        def git(*args: str):
+            subprocess.run(
+                ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+                cwd=temp_dir,
+                check=True,
+                capture_output=True,
+            )
+
+        signals = await get_priority_signals(temp_dir, ["open.py"])
+        assert signals.dirty_files == set() and signals.recent_files == {}
+
+        git("init", "-q")
+        write(os.path.join(temp_dir, "a.py"))
+        git("add", ".")
+        git("commit", "-q", "-m", "a")
+        write(os.path.join(temp_dir, "b.py"))
+        git("add", ".")
+        git("commit", "-q", "-m", "b")
+        write(os.path.join(temp_dir, "c.py"))
+
+        monkeypatch.chdir(temp_dir)
+        signals = await get_priority_signals(temp_dir, ["open.py"])
+        assert signals.open_files == {os.path.join(temp_dir, "open.py")}
+        assert signals.dirty_files == {os.path.join(temp_dir, "c.py")}
+        assert signals.recent_files == {
+            os.path.join(temp_dir, "b.py"): 0,
+            os.path.join(temp_dir, "a.py"): 1,
+        }
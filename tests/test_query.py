@@ -0,0 +1,131 @@
+import sqlite3
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from chromadb.api.types import IncludeEnum
+
+from vectorcode.cli_utils import Config, QueryInclude
+from vectorcode.manifest import Manifest
+from vectorcode.subcommands.query import (
+    MIN_CANDIDATE_CHUNKS,
+    QueryPlan,
+    plan_query,
+    refresh_stale_files,
+    retrieve_files,
+    widen_query,
+)
+from vectorcode.subcommands.query.reranker import NaiveReranker, RerankerBase
+
+
+class DocumentReranker(RerankerBase):
+    needs_documents = True
+    candidates_per_file = 4
+
+
+def test_plan_query():
+    configs = Config(n_result=5, include=[QueryInclude.path, QueryInclude.document])
+    reranker = NaiveReranker(configs)
+    plan = plan_query(configs, 10000, reranker)
+    assert plan.num_query == max(5 * reranker.candidates_per_file, MIN_CANDIDATE_CHUNKS)
+    assert not plan.include_documents
+    assert IncludeEnum.documents not in plan.get_include()
+    # capped by the size of the collection.
+    assert plan_query(configs, 10, reranker).num_query == 10
+
+    configs.query_multiplier = 3
+    assert plan_query(configs, 10000, reranker).num_query == 15
+
+    configs.include = [QueryInclude.path, QueryInclude.chunk]
+    assert plan_query(configs, 10000, reranker).include_documents
+    configs.include = [QueryInclude.path]
+    assert plan_query(configs, 10000, DocumentReranker(configs)).include_documents
+
+
+def test_widen_query():
+    results = {
+        "ids": [["1", "2", "3"]],
+        "metadatas": [[{"path": "a.py"}, {"path": "a.py"}, {"path": "b.py"}]],
+    }
+    plan = QueryPlan(num_query=3, include_documents=False)
+    assert widen_query(plan, results, 2, 100) is None
+    assert widen_query(plan, results, 3, 100) == QueryPlan(6, False)
+    assert widen_query(plan, results, 3, 5) == QueryPlan(5, False)
+    # the whole collection has been retrieved.
+    assert widen_query(plan, results, 3, 3) is None
+
+
+@pytest.mark.asyncio
+async def test_retrieve_files_embeds_query_once():
+    configs = Config(query=["hello", "world"], n_result=3, refresh_budget=0)
+    collection = MagicMock()
+    collection.count = AsyncMock(return_value=100)
+    # only one file is found, so the query is widened until the whole
+    # collection is retrieved.
+    collection.query = AsyncMock(
+        return_value={
+            "ids": [["1"], ["1"]],
+            "metadatas": [[{"path": "a.py"}], [{"path": "a.py"}]],
+            "distances": [[0.1], [0.2]],
+            "documents": None,
+        }
+    )
+    embedding_function = MagicMock(return_value=[[1.0, 0.0], [0.0, 1.0]])
+    with patch(
+        "vectorcode.subcommands.query.refresh_stale_files",
+        new=AsyncMock(return_value=True),
+    ):
+        retrieved = await retrieve_files(collection, configs, embedding_function)
+    assert retrieved is not None
+    assert retrieved[1] == ["a.py"]
+    # the widened queries and the query after the refresh reuse the embeddings.
+    embedding_function.assert_called_once_with(["hello", "world"])
+    assert collection.query.await_count > 2
+    for call in collection.query.await_args_list:
+        assert call.kwargs["query_embeddings"] == [[1.0, 0.0], [0.0, 1.0]]
+        assert "query_texts" not in call.kwargs
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("temporary_server", [False, True])
+async def test_refresh_stale_files_background(tmp_path, temporary_server):
+    stale = tmp_path / "stale.py"
+    stale.write_text("x = 1\n")
+    configs = Config(
+        project_root=str(tmp_path),
+        refresh_budget=0,
+        temporary_server=temporary_server,
+    )
+    manifest = Manifest(str(tmp_path / "manifest.db"), "id", {})
+    with (
+        patch("vectorcode.subcommands.query.get_manifest", return_value=manifest),
+        patch("vectorcode.subcommands.query.get_cache_dir", return_value=str(tmp_path)),
+        patch(
+            "vectorcode.subcommands.query.start_background_update", return_value=True
+        ) as start_background_update,
+    ):
+        assert not await refresh_stale_files(MagicMock(), configs, [str(stale)])
+    # a temporary server stops with the query, so nothing is left to update.
+    assert start_background_update.called != temporary_server
+
+
+@pytest.mark.asyncio
+async def test_refresh_stale_files_locked_manifest(tmp_path):
+    configs = Config(project_root=str(tmp_path), refresh_budget=0)
+    manifest = Manifest(str(tmp_path / "manifest.db"), "id", {})
+    collection = MagicMock()
+    collection.name = "collection"
+    with (
+        patch("vectorcode.subcommands.query.get_manifest", return_value=manifest),
+        patch("vectorcode.subcommands.query.remove_paths", new=AsyncMock()),
+        patch("vectorcode.subcommands.query.bump_generation"),
+        patch.object(
+            Manifest,
+            "commit",
+            side_effect=sqlite3.OperationalError("database is locked"),
+        ),
+    ):
+        # the deleted file is removed from the collection, and the query
+        # carries on without the manifest.
+        assert await refresh_stale_files(
+            collection, configs, [str(tmp_path / "deleted.py")]
+        )
@@ -0,0 +1,64 @@
+import io
+
+import pytest
+
+from vectorcode.cli_utils import Config, QueryInclude
+from vectorcode.subcommands.query.batch import (
+    get_spec_configs,
+    read_specs,
+    split_query_result,
+)
+
+
+def test_get_spec_configs():
+    configs = Config(n_result=1, batch="-", query_exclude=["a.py"])
+    spec_configs = get_spec_configs(
+        configs,
+        {"query": "hello", "n": 5, "include": ["path", "chunk"], "max_bytes": 100},
+    )
+    assert spec_configs.query == ["hello"]
+    assert spec_configs.n_result == 5
+    assert spec_configs.include == [QueryInclude.path, QueryInclude.chunk]
+    assert spec_configs.max_bytes == 100
+    assert spec_configs.query_exclude == ["a.py"]
+    assert spec_configs.batch is None
+    # the shared configs are left untouched.
+    assert configs.n_result == 1
+
+    spec_configs = get_spec_configs(configs, {"query": ["a", "b"], "exclude": []})
+    assert spec_configs.query == ["a", "b"]
+    assert spec_configs.query_exclude == []
+
+    for spec in [[], {}, {"query": ""}, {"query": [1]}, {"query": "a", "n": "5"}]:
+        with pytest.raises(ValueError):
+            get_spec_configs(configs, spec)
+    with pytest.raises(ValueError):
+        get_spec_configs(configs, {"query": "a", "include": ["bogus"]})
+
+
+def test_read_specs():
+    fin = io.StringIO('{"id": 1, "query": "a"}\n\nnot json\n{"id": "x", "query": 1}\n')
+    specs = list(read_specs(fin, Config()))
+    assert len(specs) == 3
+    assert specs[0][0] == 1
+    assert isinstance(specs[0][1], Config)
+    assert specs[1][0] is None
+    assert isinstance(specs[1][1], ValueError)
+    assert specs[2][0] == "x"
+    assert isinstance(specs[2][1], ValueError)
+
+
+def test_split_query_result():
+    results = {
+        "ids": [["1"], ["2"], ["3"]],
+        "metadatas": [[{"path": "a"}], [{"path": "b"}], [{"path": "c"}]],
+        "distances": [[0.1], [0.2], [0.3]],
+        "documents": None,
+        "included": ["metadatas", "distances"],
+    }
+    first, second = split_query_result(results, [1, 2])
+    assert first["ids"] == [["1"]]
+    assert second["ids"] == [["2"], ["3"]]
+    assert second["metadatas"] == [[{"path": "b"}], [{"path": "c"}]]
+    assert second["documents"] is None
+    assert second["included"] == ["metadatas", "distances"]
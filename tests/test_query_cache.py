@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.query_cache import QueryCache, get_query_cache_key
+
+
+def write(path: str, content: str):
+    with open(path, "w") as fout:
+        fout.write(content)
+
+
+def test_query_cache_generation():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        file_path = os.path.join(temp_dir, "a.py")
+        write(file_path, "a")
+        cache = QueryCache(os.path.join(temp_dir, "queries.db"), 10)
+        assert cache.generation == 0
+        assert cache.get("key") is None
+
+        cache.put("key", cache.generation, "value", [file_path])
+        assert cache.get("key") == "value"
+
+        # a result from before a write is never returned.
+        generation = cache.generation
+        cache.bump()
+        assert cache.generation == generation + 1
+        assert cache.get("key") is None
+        cache.put("key", generation, "value", [file_path])
+        assert cache.get("key") is None
+        cache.close()
+
+        # the generation is shared by other handles of the same database.
+        other = QueryCache(os.path.join(temp_dir, "queries.db"), 10)
+        assert other.generation == generation + 1
+        other.close()
+
+
+def test_query_cache_modified_files():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        file_path = os.path.join(temp_dir, "a.py")
+        write(file_path, "a")
+        cache = QueryCache(os.path.join(temp_dir, "queries.db"), 10)
+        cache.put("key", cache.generation, "value", [file_path])
+        write(file_path, "modified")
+        assert cache.get("key") is None
+
+        cache.put("key", cache.generation, "value", [file_path])
+        os.remove(file_path)
+        assert cache.get("key") is None
+        cache.close()
+
+
+def test_query_cache_eviction():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        cache = QueryCache(os.path.join(temp_dir, "queries.db"), 2)
+        for key in ["a", "b"]:
+            cache.put(key, cache.generation, "value", [])
+        assert cache.get("a") == "value"
+        cache.put("c", cache.generation, "value", [])
+        # "b" is the least recently used one.
+        assert cache.get("b") is None
+        assert cache.get("a") == "value" and cache.get("c") == "value"
+        cache.close()
+
+        cache = QueryCache(os.path.join(temp_dir, "queries.db"))
+        cache.put("d", cache.generation, "value", [])
+        assert cache.get("d") is None
+        cache.close()
+
+
+@pytest.mark.asyncio
+async def test_get_query_cache_key():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        file_path = os.path.join(temp_dir, "a.py")
+        write(file_path, "a")
+        configs = Config(query=["foo"], query_exclude=[file_path])
+        key = await get_query_cache_key(configs)
+        assert configs.query_exclude == [file_path]
+        assert key == await get_query_cache_key(
+            Config(query=["foo"], query_exclude=[file_path])
+        )
+        assert key != await get_query_cache_key(Config(query=["foo"]))
+        assert key != await get_query_cache_key(
+            Config(query=["foo"], query_exclude=[file_path], n_result=2)
+        )
@@ -0,0 +1,117 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from vectorcode.cli_utils import Config
+from vectorcode.results import Snippet
+from vectorcode.subcommands.query.fanout import (
+    ProjectResult,
+    get_file_distances,
+    get_project_configs,
+    merge_project_results,
+    split_refresh_budget,
+)
+
+
+def test_get_file_distances():
+    results = {
+        "metadatas": [
+            [{"path": "a.py"}, {"path": "b.py"}],
+            [{"path": "a.py"}, {}],
+        ],
+        "distances": [[0.5, 0.2], [0.1, 0.0]],
+    }
+    assert get_file_distances(results) == {"a.py": 0.1, "b.py": 0.2}
+
+
+def test_merge_project_results():
+    p1 = ProjectResult(
+        "/p1",
+        ["/p1/a.py", "/p1/b.py"],
+        {"/p1/a.py": [Snippet("a")]},
+        {"/p1/a.py": 0.1, "/p1/b.py": 0.4},
+        "ef",
+    )
+    p2 = ProjectResult(
+        "/p2",
+        ["/p2/c.py", "/p2/d.py"],
+        {},
+        {"/p2/c.py": 0.3, "/p2/d.py": 0.2},
+        "ef",
+    )
+    files, snippets, projects = merge_project_results([p1, p2], 3)
+    # d.py is closer than c.py, but it's ranked below it by its project.
+    assert files == ["/p1/a.py", "/p2/c.py", "/p2/d.py"]
+    assert snippets == {"/p1/a.py": [Snippet("a")], "/p2/c.py": [], "/p2/d.py": []}
+    assert projects == {"/p1/a.py": "/p1", "/p2/c.py": "/p2", "/p2/d.py": "/p2"}
+
+
+def test_merge_project_results_normalized():
+    # the distances of different embedding functions are rescaled.
+    p1 = ProjectResult(
+        "/p1", ["/p1/a.py", "/p1/b.py"], {}, {"/p1/a.py": 0.1, "/p1/b.py": 0.3}, "ef1"
+    )
+    p2 = ProjectResult(
+        "/p2", ["/p2/c.py", "/p2/d.py"], {}, {"/p2/c.py": 5.0, "/p2/d.py": 6.0}, "ef2"
+    )
+    files, _, _ = merge_project_results([p1, p2], 4)
+    assert files == ["/p1/a.py", "/p2/c.py", "/p1/b.py", "/p2/d.py"]
+
+
+def test_merge_project_results_nested():
+    # a file in nested projects is only listed once.
+    outer = ProjectResult("/p", ["/p/sub/a.py"], {}, {"/p/sub/a.py": 0.2}, "ef")
+    inner = ProjectResult("/p/sub", ["/p/sub/a.py"], {}, {"/p/sub/a.py": 0.2}, "ef")
+    files, _, projects = merge_project_results([outer, inner], 5)
+    assert files == ["/p/sub/a.py"]
+    assert projects == {"/p/sub/a.py": "/p"}
+
+
+def test_split_refresh_budget():
+    assert split_refresh_budget(4, 1) == [4]
+    assert split_refresh_budget(4, 3) == [2, 1, 1]
+    assert split_refresh_budget(4, 6) == [1, 1, 1, 1, 0, 0]
+    assert split_refresh_budget(0, 2) == [0, 0]
+    assert split_refresh_budget(4, 0) == []
+    # turned off for all projects.
+    assert split_refresh_budget(-1, 3) == [-1, -1, -1]
+
+
+@pytest.mark.asyncio
+async def test_get_project_configs_refresh_budget(tmp_path):
+    roots = [str(tmp_path / name) for name in ("a", "b", "c")]
+    configs = Config(project_roots=roots, n_result=3, refresh_budget=2)
+    with patch(
+        "vectorcode.subcommands.query.fanout.load_project_config",
+        new=AsyncMock(side_effect=lambda root: Config(n_result=10, refresh_budget=8)),
+    ):
+        project_configs = await get_project_configs(configs)
+    assert [c.project_root for c in project_configs] == roots
+    assert [c.n_result for c in project_configs] == [3, 3, 3]
+    assert [c.refresh_budget for c in project_configs] == [1, 1, 0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("temporary_server", [False, True])
+async def test_get_project_configs_temporary_server(tmp_path, temporary_server):
+    configs = Config(
+        project_roots=[str(tmp_path / "a"), str(tmp_path / "b")],
+        host="localhost",
+        port=45678,
+        db_settings={"x": 1},
+        temporary_server=temporary_server,
+    )
+    with patch(
+        "vectorcode.subcommands.query.fanout.load_project_config",
+        new=AsyncMock(side_effect=lambda root: Config(host="127.0.0.1", port=8000)),
+    ):
+        project_configs = await get_project_configs(configs)
+    for project_config in project_configs:
+        if temporary_server:
+            assert (project_config.host, project_config.port) == ("localhost", 45678)
+            assert project_config.db_settings == {"x": 1}
+            assert project_config.temporary_server
+        else:
+            # each project's own database.
+            assert (project_config.host, project_config.port) == ("127.0.0.1", 8000)
+            assert not project_config.temporary_server
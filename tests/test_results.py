@@ -0,0 +1,149 @@
+import os
+import tempfile
+
+from vectorcode.cli_utils import Config, QueryInclude
+from vectorcode.results import (
+    Snippet,
+    build_query_results,
+    dump_query_result,
+    get_snippets,
+    load_query_result,
+    locate_lines,
+)
+
+
+def test_get_snippets():
+    results = {
+        "ids": [["1", "2", "3", "4"], ["5", "6"]],
+        "metadatas": [
+            [
+                {"path": "/project/a.py", "start_line": 1, "end_line": 3},
+                {"path": "/project/a.py"},
+                {"path": "/project/b.py"},
+                {"path": "/project/c.py", "start_line": 1, "end_line": 3},
+            ],
+            [
+                {"path": "/project/a.py", "start_line": 3, "end_line": 5},
+                {"path": "/project/a.py", "start_line": 1, "end_line": 3},
+            ],
+        ],
+        "documents": [
+            ["a1", "a.py", "b", "c"],
+            ["a2", "a1"],
+        ],
+        "distances": [[0.3, 0.1, 0.4, 0.5], [0.2, 0.1]],
+    }
+    snippets = get_snippets(results, ["/project/a.py", "/project/b.py"], "/project")
+    assert snippets == {
+        "/project/a.py": [Snippet("a1", 1, 3, 0.1), Snippet("a2", 3, 5, 0.2)],
+        "/project/b.py": [Snippet("b", None, None, 0.4)],
+    }
+
+
+def test_locate_lines():
+    content = "line 1\nline 2\nline 3\nline 4\n"
+    assert locate_lines(content, "line 2\nline 3\n") == (2, 3)
+    assert locate_lines(content, "line 1") == (1, 1)
+    assert locate_lines(content, "missing") is None
+
+
+def test_build_query_results():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        paths = [os.path.join(temp_dir, name) for name in ["a.py", "b.py"]]
+        for path in paths:
+            with open(path, "w") as fout:
+                fout.write("x = 1\ny = 2\nz = 3\n")
+        snippets = {
+            paths[0]: [Snippet("y = 2\nz = 3\n", 2, 3), Snippet("x = 1\n", 1, 1)],
+            # no line numbers (char mode). They're found in the file.
+            paths[1]: [Snippet("y = 2\n")],
+        }
+        configs = Config(
+            project_root=temp_dir, include=[QueryInclude.path, QueryInclude.chunk]
+        )
+        results = build_query_results(
+            configs, paths + [os.path.join(temp_dir, "deleted.py")], snippets
+        )
+        assert results == [
+            {
+                "path": "a.py",
+                "chunk": [
+                    {"start_line": 1, "end_line": 1, "text": "x = 1\n"},
+                    {"start_line": 2, "end_line": 3, "text": "y = 2\nz = 3\n"},
+                ],
+            },
+            {
+                "path": "b.py",
+                "chunk": [{"start_line": 2, "end_line": 2, "text": "y = 2\n"}],
+            },
+        ]
+
+        # the best chunk of each file goes first.
+        configs.max_bytes = 20
+        results = build_query_results(configs, paths, snippets)
+        assert [len(result["chunk"]) for result in results] == [1, 1]
+
+        # files without anything that fits are dropped.
+        configs.max_bytes = 13
+        results = build_query_results(configs, paths, snippets)
+        assert results == [
+            {
+                "path": "a.py",
+                "chunk": [{"start_line": 2, "end_line": 3, "text": "y = 2\nz = 3\n"}],
+            }
+        ]
+
+        configs.max_bytes = -1
+        configs.max_tokens = 3
+        configs.include = [QueryInclude.path, QueryInclude.document]
+        results = build_query_results(configs, paths, snippets)
+        assert results == []
+
+
+def test_build_query_results_crlf():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        path = os.path.join(temp_dir, "crlf.py")
+        with open(path, "wb") as fout:
+            fout.write(b"x = 1\r\ny = 2\r\nz = 3\r\n")
+        # char mode chunks keep the line endings of the file.
+        snippets = {path: [Snippet("y = 2\r\n")]}
+        configs = Config(
+            project_root=temp_dir,
+            include=[QueryInclude.path, QueryInclude.document, QueryInclude.chunk],
+        )
+        results = build_query_results(configs, [path], snippets)
+        assert results == [
+            {
+                "path": "crlf.py",
+                "document": "x = 1\ny = 2\nz = 3\n",
+                "chunk": [{"start_line": 2, "end_line": 2, "text": "y = 2\r\n"}],
+            }
+        ]
+
+        configs.include = [QueryInclude.path, QueryInclude.document]
+        results = build_query_results(configs, [path], snippets)
+        assert results == [{"path": "crlf.py", "document": "x = 1\ny = 2\nz = 3\n"}]
+
+
+def test_build_query_results_projects():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        roots = [os.path.join(temp_dir, name) for name in ["p1", "p2"]]
+        paths = [os.path.join(root, "a.py") for root in roots]
+        for root, path in zip(roots, paths):
+            os.mkdir(root)
+            with open(path, "w") as fout:
+                fout.write("x = 1\n")
+        configs = Config(project_root=roots[0], include=[QueryInclude.path])
+        results = build_query_results(configs, paths, projects=dict(zip(paths, roots)))
+        assert results == [
+            {"path": "a.py", "project": roots[0]},
+            {"path": "a.py", "project": roots[1]},
+        ]
+
+
+def test_query_result_roundtrip():
+    snippets = {"/project/a.py": [Snippet("a", 1, 2, 0.5)]}
+    assert load_query_result(dump_query_result(["/project/a.py"], snippets)) == (
+        ["/project/a.py"],
+        snippets,
+    )
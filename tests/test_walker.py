@@ -0,0 +1,165 @@
+import io
+import os
+import tempfile
+from unittest.mock import patch
+
+from vectorcode.walker import (
+    IgnoreMatcher,
+    is_walked,
+    iter_files,
+    read_path_list,
+    walk_files,
+)
+
+
+def make_tree(root: str, files: dict[str, str]):
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fout:
+            fout.write(content)
+
+
+def relpaths(root: str, paths) -> set[str]:
+    return {os.path.relpath(path, root) for path in paths}
+
+
+def test_walk_files_nested_ignores():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(
+            temp_dir,
+            {
+                ".gitignore": "node_modules/\n*.log\n",
+                ".vectorcodeignore": "docs/\n",
+                ".git/info/exclude": "scratch.py\n",
+                "main.py": "",
+                "scratch.py": "",
+                "debug.log": "",
+                ".hidden.py": "",
+                "docs/index.md": "",
+                "node_modules/pkg/index.js": "",
+                "src/.gitignore": "generated_*.py\n!keep.log\n",
+                "src/lib.py": "",
+                "src/keep.log": "",
+                "src/generated_api.py": "",
+                "src/sub/generated_models.py": "",
+            },
+        )
+        matcher = IgnoreMatcher(temp_dir)
+        assert relpaths(temp_dir, walk_files(temp_dir, matcher)) == {
+            "main.py",
+            "src/lib.py",
+            "src/keep.log",
+        }
+        assert "node_modules/pkg/index.js" in relpaths(temp_dir, walk_files(temp_dir))
+
+
+def test_walk_files_prunes_ignored_directories():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(temp_dir, {".gitignore": "target/\n", "target/out.txt": ""})
+        matcher = IgnoreMatcher(temp_dir)
+        with patch("os.scandir", wraps=os.scandir) as scandir:
+            assert list(walk_files(temp_dir, matcher)) == []
+        scanned = [call.args[0] for call in scandir.call_args_list]
+        assert scanned == [temp_dir]
+
+
+def test_vectorcodeignore_takes_precedence():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(
+            temp_dir,
+            {
+                ".gitignore": "*.md\n",
+                ".vectorcodeignore": "!README.md\n",
+                "README.md": "",
+                "CHANGELOG.md": "",
+            },
+        )
+        matcher = IgnoreMatcher(temp_dir)
+        assert not matcher.is_ignored(os.path.join(temp_dir, "README.md"))
+        assert matcher.is_ignored(os.path.join(temp_dir, "CHANGELOG.md"))
+
+
+def test_iter_files():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(
+            temp_dir,
+            {
+                ".gitignore": "build/\n",
+                "a.py": "",
+                "b.txt": "",
+                "build/c.py": "",
+                "src/d.py": "",
+            },
+        )
+        matcher = IgnoreMatcher(temp_dir)
+        a_py = os.path.join(temp_dir, "a.py")
+
+        # no duplicates when a file is referred to more than once.
+        files = list(iter_files([a_py, temp_dir], True, matcher))
+        assert relpaths(temp_dir, files) == {"a.py", "b.txt", "src/d.py"}
+        assert len(files) == 3
+
+        # files under ignored directories are ignored even if they're explicitly listed.
+        build_file = os.path.join(temp_dir, "build", "c.py")
+        assert list(iter_files([build_file], False, matcher)) == []
+        assert list(iter_files([build_file], False, None)) == [build_file]
+
+        assert relpaths(
+            temp_dir, iter_files([os.path.join(temp_dir, "**", "*.py")], True, matcher)
+        ) == {"a.py", "src/d.py"}
+
+        # directories are only expanded when recursive.
+        assert list(iter_files([temp_dir], False, matcher)) == []
+        assert list(iter_files([os.path.join(temp_dir, "build")], True, matcher)) == []
+
+
+def test_is_walked():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(
+            temp_dir,
+            {
+                ".gitignore": "build/\n",
+                "a.py": "",
+                "build/c.py": "",
+                "src/d.py": "",
+                ".hidden/e.py": "",
+            },
+        )
+        matcher = IgnoreMatcher(temp_dir)
+        files = [
+            os.path.join(temp_dir, name)
+            for name in ["a.py", "build/c.py", "src/d.py", ".hidden/e.py"]
+        ]
+        for paths, recursive in [
+            ([temp_dir], True),
+            ([temp_dir], False),
+            ([os.path.join(temp_dir, "src")], True),
+            ([files[0], files[1]], False),
+        ]:
+            walked = set(iter_files(paths, recursive, matcher))
+            for file in files:
+                assert is_walked(file, paths, recursive, matcher) == (file in walked)
+
+
+def test_read_path_list():
+    assert list(read_path_list(io.BytesIO(b"a.py\nsrc/b.py\r\n\nc d.py"))) == [
+        "a.py",
+        "src/b.py",
+        "c d.py",
+    ]
+    assert list(read_path_list(io.BytesIO(b"a.py\0new\nline.py\0"))) == [
+        "a.py",
+        "new\nline.py",
+    ]
+    # paths that span more than one block.
+    paths = [f"dir/file_{i}.py" for i in range(20000)]
+    assert list(read_path_list(io.BytesIO("\0".join(paths).encode()))) == paths
+    assert list(read_path_list(io.BytesIO(b""))) == []
+
+
+def test_iter_files_without_dedup():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        make_tree(temp_dir, {"a.py": ""})
+        a_py = os.path.join(temp_dir, "a.py")
+        assert list(iter_files([a_py, a_py], dedup=False)) == [a_py, a_py]
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+from vectorcode.walker import IgnoreMatcher
+from vectorcode.watcher import TreeWatcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is only available on Linux."
+)
+
+
+def write(path: str, content: str = ""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fout:
+        fout.write(content)
+
+
+@pytest.mark.asyncio
+async def test_tree_watcher():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        write(os.path.join(temp_dir, ".gitignore"), "build/\n")
+        write(os.path.join(temp_dir, "a.py"))
+        write(os.path.join(temp_dir, "b.py"))
+        write(os.path.join(temp_dir, "build", "c.py"))
+        write(os.path.join(temp_dir, ".hidden", "d.py"))
+        watcher = TreeWatcher([temp_dir], IgnoreMatcher(temp_dir), debounce=0.05)
+        watcher.start()
+        try:
+            # the root only; ignored and hidden directories are not watched.
+            assert watcher.num_watches == 1
+
+            write(os.path.join(temp_dir, "a.py"), "a = 1\n")
+            os.remove(os.path.join(temp_dir, "b.py"))
+            write(os.path.join(temp_dir, "build", "c.py"), "c = 1\n")
+            write(os.path.join(temp_dir, ".hidden", "d.py"), "d = 1\n")
+            write(os.path.join(temp_dir, "debug.log"))
+            os.rename(
+                os.path.join(temp_dir, "debug.log"), os.path.join(temp_dir, "e.py")
+            )
+            changes = await asyncio.wait_for(watcher.changes(), 5)
+            assert changes == {
+                os.path.join(temp_dir, "a.py"),
+                os.path.join(temp_dir, "b.py"),
+                os.path.join(temp_dir, "debug.log"),
+                os.path.join(temp_dir, "e.py"),
+            }
+
+            # new directories are reported and watched.
+            write(os.path.join(temp_dir, "pkg", "f.py"))
+            changes = await asyncio.wait_for(watcher.changes(), 5)
+            assert os.path.join(temp_dir, "pkg") in changes
+            assert watcher.num_watches == 2
+            write(os.path.join(temp_dir, "pkg", "f.py"), "f = 1\n")
+            changes = await asyncio.wait_for(watcher.changes(), 5)
+            assert changes == {os.path.join(temp_dir, "pkg", "f.py")}
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_tree_watcher_debounce():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        watcher = TreeWatcher([temp_dir], debounce=0.2)
+        watcher.start()
+        try:
+            path = os.path.join(temp_dir, "a.py")
+            for i in range(5):
+                write(path, f"a = {i}\n")
+                await asyncio.sleep(0.05)
+            write(os.path.join(temp_dir, "b.py"))
+            assert await asyncio.wait_for(watcher.changes(), 5) == {
+                path,
+                os.path.join(temp_dir, "b.py"),
+            }
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(watcher.changes(), 0.5)
+        finally:
+            watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_tree_watcher_ignore_file_changes():
+    with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+        write(os.path.join(temp_dir, ".gitignore"), "build/\n")
+        write(os.path.join(temp_dir, "build", "a.py"))
+        matcher = IgnoreMatcher(temp_dir)
+        watcher = TreeWatcher([temp_dir], matcher, debounce=0.05)
+        watcher.start()
+        try:
+            assert watcher.num_watches == 1
+            write(os.path.join(temp_dir, ".gitignore"), "")
+            # the directory of the ignore file is scanned again.
+            assert await asyncio.wait_for(watcher.changes(), 5) == {temp_dir}
+            assert not matcher.is_ignored(os.path.join(temp_dir, "build"), True)
+            assert watcher.num_watches == 2
+        finally:
+            watcher.close()